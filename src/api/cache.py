@@ -0,0 +1,141 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+from fastapi import Response
+
+from src.api.db import fetch_json, fetch_json_page, get_conn
+from src.api.metrics import observe_query
+from src.api.paging import NEXT_CURSOR_HEADER, encode_cursor
+
+# KPI data only changes when a normalization run commits (one dq_run_stats
+# row per run), so responses are cached per (path, query) and tagged with
+# the latest run_id; a new run makes every cached entry stale.
+CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "256"))
+# seconds between data-version lookups (polling clients share one lookup)
+CACHE_VERSION_TTL = float(os.getenv("API_CACHE_VERSION_TTL", "2"))
+# backstop for refreshes that bypass normalize (e.g. kpi_refresh --all)
+CACHE_MAX_AGE = float(os.getenv("API_CACHE_MAX_AGE", "300"))
+
+DATA_VERSION_SQL = "select coalesce(max(run_id), 0) from dq_run_stats"
+
+CacheEntry = namedtuple("CacheEntry", ["version", "etag", "body", "headers", "stored_at"])
+
+
+class ResponseCache:
+    """
+    Bounded LRU of JSON response bodies, tagged with the data version.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, version_ttl=CACHE_VERSION_TTL, max_age=CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    async def data_version(self):
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked_at > self.version_ttl:
+            async with get_conn() as conn, observe_query("data_version"):
+                self._version = await conn.fetchval(DATA_VERSION_SQL)
+            self._version_checked_at = now
+        return self._version
+
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.version != version or time.monotonic() - entry.stored_at > self.max_age:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, version, body, headers=None):
+        etag = f'"{version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        entry = CacheEntry(version, etag, body, headers or {}, time.monotonic())
+        if self.max_entries > 0:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._version = None
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison (RFC 9110): ignore a W/ prefix on either side
+    tags = (t.strip() for t in if_none_match.split(","))
+    return any(t.removeprefix("W/") == etag for t in tags)
+
+
+async def _serve(request, fetch):
+    version = await response_cache.data_version()
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+    entry = response_cache.get(key, version)
+    if entry is None:
+        body, extra_headers = await fetch()
+        entry = response_cache.put(key, version, body, extra_headers)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+async def cached_json(request, sql, *args):
+    """
+    Serve `sql` as JSON through the response cache.
+
+    Sets ETag and answers a matching If-None-Match with 304, so clients
+    polling unchanged data only cost a version lookup (at most one per
+    CACHE_VERSION_TTL).
+    """
+    async def fetch():
+        return await fetch_json(sql, *args), None
+
+    return await _serve(request, fetch)
+
+
+async def cached_json_page(request, query, limit):
+    """
+    Serve one KeysetQuery page through the response cache.
+
+    The cursor of the next page goes in the X-Next-Cursor header (absent
+    on the last page), so the body keeps the plain JSON-array shape.
+    """
+    async def fetch():
+        body, last_key = await fetch_json_page(query, limit)
+        if last_key is None:
+            return body, None
+        return body, {NEXT_CURSOR_HEADER: encode_cursor(last_key)}
+
+    return await _serve(request, fetch)
@@ -1,14 +1,187 @@
+import asyncio
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-
-def get_conn():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        port=int(os.getenv("DB_PORT", "5432")),
-        dbname=os.getenv("DB_NAME", "sales_engine"),
-        user=os.getenv("DB_USER", "postgres"),
-        password=os.getenv("DB_PASSWORD", "postgres"),
-        cursor_factory=RealDictCursor,
-    )
+from contextlib import asynccontextmanager, suppress
+
+import asyncpg
+
+from src.api.metrics import observe_query
+
+# Pool sizing is per process (per uvicorn worker).
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# seconds a request may wait for a free connection before failing
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# connections idle longer than this are closed by the pool and reopened on
+# demand, so a request never gets one the server or a proxy dropped meanwhile
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "30"))
+# exports: rows per server-side cursor fetch, COPY chunks buffered ahead
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "20000"))
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "64"))
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within POOL_TIMEOUT."""
+
+
+_pool = None
+_waiting = 0
+
+
+async def open_pool():
+    """
+    Create the process-wide async pool (called on app startup).
+    """
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            host=os.getenv("DB_HOST", "localhost"),
+            port=int(os.getenv("DB_PORT", "5432")),
+            database=os.getenv("DB_NAME", "sales_engine"),
+            user=os.getenv("DB_USER", "postgres"),
+            password=os.getenv("DB_PASSWORD", "postgres"),
+            min_size=POOL_MIN,
+            max_size=POOL_MAX,
+            max_inactive_connection_lifetime=POOL_MAX_IDLE,
+        )
+
+
+async def close_pool():
+    """
+    Close every pooled connection (called on app shutdown).
+    """
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def _acquire():
+    global _waiting
+    _waiting += 1
+    try:
+        return await _pool.acquire(timeout=POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout(f"no database connection available within {POOL_TIMEOUT}s")
+    finally:
+        _waiting -= 1
+
+
+@asynccontextmanager
+async def get_conn():
+    """
+    Borrow a pooled connection; it goes back to the pool afterwards.
+    """
+    if _pool is None:
+        await open_pool()
+
+    conn = await _acquire()
+    try:
+        yield conn
+    finally:
+        await _pool.release(conn)
+
+
+async def fetch_json(sql, *args):
+    """
+    Run `sql` and return its rows as a JSON array (bytes).
+
+    Postgres encodes each row (row_to_json), so no per-row dict is built
+    and nothing is re-encoded in Python; row order is kept.
+    """
+    async with get_conn() as conn, observe_query("fetch_json"):
+        rows = await conn.fetch(f"select row_to_json(t)::text from ({sql}) t", *args)
+    return b"[" + ",".join(r[0] for r in rows).encode("utf-8") + b"]"
+
+
+async def fetch_json_page(query, limit):
+    """
+    Run a KeysetQuery page; returns (JSON bytes, key of the last row or
+    None when this is the last page).
+    """
+    keys = ", ".join(f"t.{k}" if k.isidentifier() else k for k in query.keys)
+    sql = f"select row_to_json(t)::text, {keys} from ({query.sql(limit)}) t"
+    async with get_conn() as conn, observe_query("fetch_json_page"):
+        rows = await conn.fetch(sql, *query.args)
+
+    body = b"[" + ",".join(r[0] for r in rows).encode("utf-8") + b"]"
+    last_key = list(rows[-1])[1:] if len(rows) == limit else None
+    return body, last_key
+
+
+async def stream_copy_csv(sql, *args):
+    """
+    Yield the rows of `sql` as CSV chunks (with header) via COPY ... TO STDOUT.
+
+    COPY writes into a bounded queue, so a slow client pauses the copy
+    instead of piling the export up in memory.
+    """
+    queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    done = object()
+
+    async with get_conn() as conn:
+        async def copy():
+            try:
+                async with observe_query("export_copy"):
+                    await conn.copy_from_query(sql, *args, output=queue.put, format="csv", header=True)
+            except Exception as exc:
+                await queue.put(exc)
+                return
+            await queue.put(done)
+
+        task = asyncio.create_task(copy())
+        try:
+            while (chunk := await queue.get()) is not done:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                # asyncpg hands over bytearrays; responses send bytes only
+                yield bytes(chunk)
+        finally:
+            # client gone mid-export: stop the COPY before releasing conn
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+
+async def describe(sql, *args):
+    """
+    (column name, Postgres type name) of each column `sql` returns.
+    """
+    async with get_conn() as conn, observe_query("describe"):
+        stmt = await conn.prepare(sql)
+        return [(a.name, a.type.name) for a in stmt.get_attributes()]
+
+
+async def stream_batches(sql, *args, batch_rows=EXPORT_FETCH_ROWS):
+    """
+    Yield the rows of `sql` in lists of up to `batch_rows` records,
+    read through a server-side cursor.
+    """
+    async with get_conn() as conn:
+        async with conn.transaction(readonly=True):
+            cur = await conn.cursor(sql, *args)
+            while True:
+                async with observe_query("export_fetch"):
+                    rows = await cur.fetch(batch_rows)
+                if not rows:
+                    break
+                yield rows
+
+
+def pool_stats():
+    """
+    Pool usage for /health, to size DB_POOL_MAX per worker.
+    """
+    if _pool is None:
+        return {"open": False, "min": POOL_MIN, "max": POOL_MAX}
+
+    size = _pool.get_size()
+    in_use = size - _pool.get_idle_size()
+    return {
+        "open": True,
+        "min": POOL_MIN,
+        "max": POOL_MAX,
+        "size": size,
+        "in_use": in_use,
+        "waiting": _waiting,
+        "saturation": round(in_use / POOL_MAX, 3) if POOL_MAX else None,
+    }
@@ -0,0 +1,164 @@
+from fastapi import HTTPException
+
+from src.api.db import describe, stream_batches, stream_copy_csv
+
+# Exportable tables / views and the date column their range filter uses.
+# Month-grain KPIs select the whole months the range touches.
+DATASETS = {
+    "canonical_sales": ("invoice_date_gregorian", "canonical_id"),
+    "kpi_net_sales_daily": ("day", "day"),
+    "kpi_top_customers_month": ("month", "month, customer_id"),
+    "kpi_return_rate_by_product_month": ("month", "month, product_id"),
+}
+MONTH_GRAIN = {"kpi_top_customers_month", "kpi_return_rate_by_product_month"}
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# numeric has no fixed scale; Arrow decimals need one (Postgres rounds)
+NUMERIC_PRECISION = 38
+NUMERIC_SCALE = 18
+
+
+def export_query(dataset, date_from=None, date_to=None, load_batch_id=None):
+    """
+    SELECT for one dataset with its filters; returns (sql, args).
+    """
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"unknown dataset: {dataset}")
+    date_col, order = DATASETS[dataset]
+
+    where, args = [], []
+    if date_from is not None:
+        args.append(date_from)
+        if dataset in MONTH_GRAIN:
+            where.append(f"{date_col} >= date_trunc('month', ${len(args)}::date)::date")
+        else:
+            where.append(f"{date_col} >= ${len(args)}")
+    if date_to is not None:
+        args.append(date_to)
+        where.append(f"{date_col} <= ${len(args)}")
+    if load_batch_id is not None:
+        if dataset != "canonical_sales":
+            raise HTTPException(status_code=400, detail="load_batch_id only applies to canonical_sales")
+        args.append(load_batch_id)
+        where.append(f"load_batch_id = ${len(args)}")
+
+    where = f"WHERE {' AND '.join(where)}" if where else ""
+    return f"SELECT * FROM {dataset} {where} ORDER BY {order}", args
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise HTTPException(status_code=501, detail="parquet / arrow export needs pyarrow")
+    return pyarrow
+
+
+async def stream_ndjson(sql, args):
+    async for rows in stream_batches(f"select row_to_json(t)::text from ({sql}) t", *args):
+        yield ("\n".join(r[0] for r in rows) + "\n").encode("utf-8")
+
+
+class _ChunkSink:
+    """
+    Write-only file for pyarrow writers; the caller drains it after each
+    batch, so at most one encoded batch is held at a time.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_type(pa, pg_type):
+    types = {
+        "text": pa.string(),
+        "varchar": pa.string(),
+        "date": pa.date32(),
+        "int2": pa.int64(),
+        "int4": pa.int64(),
+        "int8": pa.int64(),
+        "float8": pa.float64(),
+        "bool": pa.bool_(),
+        "bytea": pa.binary(),
+        "timestamptz": pa.timestamp("us", tz="UTC"),
+        "numeric": pa.decimal128(NUMERIC_PRECISION, NUMERIC_SCALE),
+    }
+    return types.get(pg_type)
+
+
+async def stream_arrow(sql, args, fmt):
+    """
+    Stream `sql` as one Parquet file (a row group per cursor batch) or an
+    Arrow IPC stream (a record batch per cursor batch).
+    """
+    pa = require_pyarrow()
+
+    columns = []
+    for name, pg_type in await describe(sql, *args):
+        arrow_type = _arrow_type(pa, pg_type)
+        if pg_type == "numeric":
+            columns.append((f'"{name}"::numeric({NUMERIC_PRECISION}, {NUMERIC_SCALE}) AS "{name}"', name, arrow_type))
+        elif arrow_type is None:
+            columns.append((f'"{name}"::text AS "{name}"', name, pa.string()))
+        else:
+            columns.append((f'"{name}"', name, arrow_type))
+    schema = pa.schema([(name, arrow_type) for _, name, arrow_type in columns])
+    select = ", ".join(expr for expr, _, _ in columns)
+
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+        write = writer.write_table
+        to_batch = pa.Table.from_arrays
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+        to_batch = pa.RecordBatch.from_arrays
+
+    async for rows in stream_batches(f"select {select} from ({sql}) t", *args):
+        arrays = [
+            pa.array([r[i] for r in rows], type=field.type)
+            for i, field in enumerate(schema)
+        ]
+        write(to_batch(arrays, schema=schema))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(sql, args, fmt):
+    if fmt == "csv":
+        return stream_copy_csv(sql, *args)
+    if fmt == "ndjson":
+        return stream_ndjson(sql, args)
+    return stream_arrow(sql, args, fmt)
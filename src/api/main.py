@@ -1,17 +1,47 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from src.api.db import PoolTimeout, close_pool, open_pool
+from src.api.metrics import MetricsMiddleware
 from src.api.routers import (
     health, 
     kpi_sales,
     kpi_customers,
     kpi_returns,
+    export,
+    metrics,
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_pool()
+    yield
+    await close_pool()
+
+
 app = FastAPI(
     title="Sales Insight Engine API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-app.include_router(health.router, prefix="/health")
-app.include_router(kpi_sales.router, prefix="/kpi")
-app.include_router(kpi_customers.router, prefix="/kpi")
-app.include_router(kpi_returns.router, prefix="/kpi")
\ No newline at end of file
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_exhausted(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+# routers carry their own prefix, so route.path (the /metrics route label)
+# is the full path template whether or not FastAPI mounts included routers
+app.include_router(health.router)
+app.include_router(kpi_sales.router)
+app.include_router(kpi_customers.router)
+app.include_router(kpi_returns.router)
+app.include_router(export.router)
+app.include_router(metrics.router)
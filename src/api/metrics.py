@@ -0,0 +1,118 @@
+import time
+from contextlib import asynccontextmanager
+
+# Prometheus text exposition without a client library: a few histograms
+# rendered by GET /metrics. Route labels use the route template
+# (/export/{dataset}), so label sets stay bounded.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram keyed by a fixed tuple of label names.
+    """
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le=bound)} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le='+Inf')} {series[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {series[-2]}")
+        return lines
+
+
+def sample(name, help, kind, value):
+    """
+    A single-value gauge or counter.
+    """
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds",
+    "HTTP request latency by route (until the last body chunk is sent).",
+    ["method", "route", "status"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "api_db_query_duration_seconds",
+    "Database query duration by query kind.",
+    ["query"],
+)
+
+
+@asynccontextmanager
+async def observe_query(kind):
+    """
+    Time the block as one `kind` database query.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, kind)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording REQUEST_SECONDS for every HTTP request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # set by the router once a route matched
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
@@ -0,0 +1,81 @@
+import base64
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from fastapi import HTTPException
+
+# KPI endpoints page with an opaque keyset cursor: the ORDER BY key of the
+# last row returned, base64-encoded. The next page starts strictly after
+# it, so deep pages cost the same as the first one (no OFFSET scan).
+MAX_LIMIT = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values):
+    payload = json.dumps([v.isoformat() if isinstance(v, date) else str(v) for v in values])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, types):
+    """
+    Decode a cursor into key values of the given types (date, Decimal, str).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong key length")
+        return [
+            date.fromisoformat(v) if t is date else Decimal(v) if t is Decimal else str(v)
+            for v, t in zip(values, types)
+        ]
+    except (ValueError, TypeError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+class KeysetQuery:
+    """
+    SELECT over one KPI source with optional filters and a keyset page.
+
+    `keys` are the ORDER BY expressions (all DESC, last one unique per row);
+    their values travel in the cursor.
+    """
+
+    def __init__(self, keys, key_types):
+        self.keys = keys
+        self.key_types = key_types
+        self.source = None
+        self.where = []
+        self.args = []
+
+    def param(self, value):
+        self.args.append(value)
+        return f"${len(self.args)}"
+
+    def call(self, function, *args):
+        """Read from a set-returning function instead of a view."""
+        self.source = f"{function}({', '.join(self.param(a) for a in args)})"
+
+    def filter(self, clause, value):
+        """Add `clause` (with one {} placeholder) unless value is None."""
+        if value is not None:
+            self.where.append(clause.format(self.param(value)))
+
+    def after(self, cursor):
+        if cursor is not None:
+            values = decode_cursor(cursor, self.key_types)
+            self.where.append(
+                f"({', '.join(self.keys)}) < ({', '.join(self.param(v) for v in values)})"
+            )
+
+    def sql(self, limit):
+        where = f"WHERE {' AND '.join(self.where)}" if self.where else ""
+        order = ", ".join(f"{k} DESC" for k in self.keys)
+        return f"""
+            SELECT *
+            from {self.source}
+            {where}
+            ORDER BY {order}
+            LIMIT {self.param(limit)}
+        """
@@ -0,0 +1,28 @@
+from datetime import date
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+from src.api.export import FORMATS, export_query, require_pyarrow, stream_export
+
+router = APIRouter(prefix="/export")
+
+@router.get("/{dataset}")
+async def export(
+    dataset: str,
+    fmt: Literal["csv", "ndjson", "parquet", "arrow"] = Query("csv", alias="format"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    load_batch_id: Optional[str] = None,
+):
+    sql, args = export_query(dataset, date_from, date_to, load_batch_id)
+    if fmt in ("parquet", "arrow"):
+        # fail before the 200 goes out
+        require_pyarrow()
+
+    media_type, ext = FORMATS[fmt]
+    return StreamingResponse(
+        stream_export(sql, args, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{ext}"'},
+    )
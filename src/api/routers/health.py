@@ -1,7 +1,9 @@
 from fastapi import APIRouter
+from src.api.cache import response_cache
+from src.api.db import pool_stats
 
-router = APIRouter()
+router = APIRouter(prefix="/health")
 
 @router.get("/")
-def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+async def health_check():
+    return {"status": "ok", "db_pool": pool_stats(), "cache": response_cache.stats()}
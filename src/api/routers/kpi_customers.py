@@ -1,16 +1,31 @@
-from fastapi import APIRouter
-from src.api.db import get_conn
+from datetime import date
+from decimal import Decimal
+from typing import Optional
 
-router = APIRouter()
+from fastapi import APIRouter, Query, Request
+from src.api.cache import cached_json_page
+from src.api.paging import MAX_LIMIT, KeysetQuery
+
+router = APIRouter(prefix="/kpi")
 @router.get("/top-customers-month")
-def top_customers_month(limit: int = 50):
-    sql = """
-        SELECT *
-        from kpi_top_customers_month
-        ORDER BY month DESC, net_sales_amount DESC
-        LIMIT %s;
-    """
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, (limit,))
-            return cur.fetchall()
\ No newline at end of file
+async def top_customers_month(
+    request: Request,
+    limit: int = Query(50, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    salesperson_id: Optional[str] = None,
+):
+    query = KeysetQuery(["month", "net_sales_amount", "customer_id"], [date, Decimal, str])
+    if product_id is None and salesperson_id is None:
+        # month / customer filters only: read the aggregate table
+        query.source = "kpi_top_customers_month"
+        query.filter("month >= date_trunc('month', {}::date)::date", date_from)
+        query.filter("month <= {}", date_to)
+        query.filter("customer_id = {}", customer_id)
+    else:
+        query.call("kpi_top_customers_month_for", date_from, date_to, product_id, customer_id, salesperson_id)
+    query.after(cursor)
+    return await cached_json_page(request, query, limit)
@@ -1,16 +1,35 @@
-from fastapi import APIRouter
-from src.api.db import get_conn
+from datetime import date
+from decimal import Decimal
+from typing import Optional
 
-router = APIRouter()
+from fastapi import APIRouter, Query, Request
+from src.api.cache import cached_json_page
+from src.api.paging import MAX_LIMIT, KeysetQuery
+
+router = APIRouter(prefix="/kpi")
 @router.get("/return-rate-by-product-month")
-def return_rate_by_product_month(limit: int = 50):
-    sql = """
-        SELECT *
-        from kpi_return_rate_by_product_month
-        ORDER BY return_rate DESC
-        LIMIT %s;
-    """
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, (limit,))
-            return cur.fetchall()
\ No newline at end of file
+async def return_rate_by_product_month(
+    request: Request,
+    limit: int = Query(50, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    salesperson_id: Optional[str] = None,
+):
+    # NULL rates (no sales) sort first, as with a plain return_rate DESC
+    query = KeysetQuery(
+        ["coalesce(return_rate, 'Infinity'::numeric)", "month", "product_id"],
+        [Decimal, date, str],
+    )
+    if customer_id is None and salesperson_id is None:
+        # month / product filters only: read the aggregate table
+        query.source = "kpi_return_rate_by_product_month"
+        query.filter("month >= date_trunc('month', {}::date)::date", date_from)
+        query.filter("month <= {}", date_to)
+        query.filter("product_id = {}", product_id)
+    else:
+        query.call("kpi_return_rate_by_product_month_for", date_from, date_to, product_id, customer_id, salesperson_id)
+    query.after(cursor)
+    return await cached_json_page(request, query, limit)
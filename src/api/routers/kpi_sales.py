@@ -1,17 +1,30 @@
-from fastapi import APIRouter
-from src.api.db import get_conn
+from datetime import date
+from typing import Optional
 
-router = APIRouter()
+from fastapi import APIRouter, Query, Request
+from src.api.cache import cached_json_page
+from src.api.paging import MAX_LIMIT, KeysetQuery
+
+router = APIRouter(prefix="/kpi")
 
 @router.get("/net-sales-daily")
-def net_sales_daily(limit: int = 30):
-    sql = """
-        SELECT *
-        from kpi_net_sales_daily
-        ORDER BY day DESC
-        LIMIT %s;
-    """
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, (limit,))
-            return cur.fetchall()
\ No newline at end of file
+async def net_sales_daily(
+    request: Request,
+    limit: int = Query(30, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    salesperson_id: Optional[str] = None,
+):
+    query = KeysetQuery(["day"], [date])
+    if product_id is None and customer_id is None and salesperson_id is None:
+        # day filters only: range scan on the aggregate's primary key
+        query.source = "kpi_net_sales_daily"
+        query.filter("day >= {}", date_from)
+        query.filter("day <= {}", date_to)
+    else:
+        query.call("kpi_net_sales_daily_for", date_from, date_to, product_id, customer_id, salesperson_id)
+    query.after(cursor)
+    return await cached_json_page(request, query, limit)
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from src.api.cache import response_cache
+from src.api.db import pool_stats
+from src.api.metrics import DB_QUERY_SECONDS, REQUEST_SECONDS, sample
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    pool = pool_stats()
+    cache = response_cache.stats()
+    lines = (
+        REQUEST_SECONDS.render()
+        + DB_QUERY_SECONDS.render()
+        + sample("api_db_pool_size", "Open pooled connections.", "gauge", pool.get("size", 0))
+        + sample("api_db_pool_in_use", "Pooled connections lent out.", "gauge", pool.get("in_use", 0))
+        + sample("api_db_pool_waiting", "Requests waiting for a connection.", "gauge", pool.get("waiting", 0))
+        + sample("api_cache_hits_total", "Response cache hits.", "counter", cache["hits"])
+        + sample("api_cache_misses_total", "Response cache misses.", "counter", cache["misses"])
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
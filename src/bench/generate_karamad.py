@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Synthetic Karamad exports for tests and benchmarks.
+
+Writes one 61-column CSV per Jalali month with Persian headers,
+comma-formatted amounts and the defects normalize_karamad has to handle:
+returns (برگشت in c29, negative quantity/amounts), missing c54 reference
+dates, unparsable numerics, missing invoice ids and duplicated rows.
+Rows are written as they are generated, so any size fits in memory.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import random
+from pathlib import Path
+
+EXPECTED_COLS = 61
+
+SIZES = {"small": 10_000, "medium": 1_000_000, "large": 10_000_000}
+
+# Persian headers of the mapped columns (see docs/glossary.yml);
+# the rest are filler columns the pipeline never reads.
+HEADERS = {
+    "c03": "کد فروشنده",
+    "c04": "نام فروشنده",
+    "c05": "کد کالا",
+    "c06": "نام کالا",
+    "c29": "نوع فاکتور",
+    "c38": "تاریخ",
+    "c39": "شماره",
+    "c42": "کد مشتری",
+    "c43": "نام مشتری",
+    "c46": "مجموع تعداد",
+    "c47": "فی فروش",
+    "c48": "جمع قبل تخفیف",
+    "c49": "تخفیف حجمی",
+    "c50": "تخفیف نقدی",
+    "c52": "قابل پرداخت",
+    "c54": "تاریخ مرجع",
+}
+
+SALE_TYPE = "فاکتور فروش"
+RETURN_TYPE = "برگشت از فروش"
+BAD_NUMERICS = ["N/A", "-", "12O,000", "1,2a4", "؟"]
+
+# Jalali month lengths (Esfand taken as 29 days)
+MONTH_DAYS = [31] * 6 + [30] * 5 + [29]
+
+# column positions (0-based) in the CSV row
+_IDX = {f"c{i:02d}": i - 1 for i in range(1, EXPECTED_COLS + 1)}
+
+
+def header_row() -> list[str]:
+    return [HEADERS.get(f"c{i:02d}", f"ستون {i}") for i in range(1, EXPECTED_COLS + 1)]
+
+
+def fmt_amount(value: int) -> str:
+    return f"{value:,}"
+
+
+def iter_months(start_year: int, start_month: int, count: int):
+    year, month = start_year, start_month
+    for _ in range(count):
+        yield year, month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+
+class KaramadGenerator:
+    """
+    Generates Karamad rows; `rates` are per-row probabilities of each defect.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        customers: int = 2000,
+        products: int = 500,
+        salespeople: int = 40,
+        return_rate: float = 0.05,
+        missing_ref_rate: float = 0.03,
+        bad_numeric_rate: float = 0.005,
+        missing_invoice_rate: float = 0.002,
+        duplicate_rate: float = 0.01,
+    ):
+        self.rng = random.Random(seed)
+        self.customers = customers
+        self.products = products
+        self.salespeople = salespeople
+        self.return_rate = return_rate
+        self.missing_ref_rate = missing_ref_rate
+        self.bad_numeric_rate = bad_numeric_rate
+        self.missing_invoice_rate = missing_invoice_rate
+        self.duplicate_rate = duplicate_rate
+        self.prices = [self.rng.randrange(5_000, 2_000_000, 500) for _ in range(products)]
+        self.next_invoice = 100_000
+        self.recent: list[list[str]] = []
+
+    def _row(self, year: int, month: int) -> list[str]:
+        rng = self.rng
+        row = [""] * EXPECTED_COLS
+        day = rng.randint(1, MONTH_DAYS[month - 1])
+
+        product = rng.randrange(self.products)
+        salesperson = rng.randrange(self.salespeople)
+        customer = rng.randrange(self.customers)
+        quantity = rng.choice([1, 1, 2, 3, 5, 6, 10, 12, 24, 48])
+        unit_price = self.prices[product]
+        gross = quantity * unit_price
+        discount_volume = gross * rng.choice([0, 0, 0, 2, 5]) // 100
+        discount_cash = gross * rng.choice([0, 0, 1, 3]) // 100
+        net = gross - discount_volume - discount_cash
+
+        is_return = rng.random() < self.return_rate
+        sign = -1 if is_return else 1
+
+        if rng.random() >= self.missing_invoice_rate:
+            row[_IDX["c39"]] = str(self.next_invoice)
+        self.next_invoice += rng.choice([0, 1, 1, 1])
+
+        row[_IDX["c03"]] = f"S{salesperson:03d}"
+        row[_IDX["c04"]] = f"فروشنده {salesperson}"
+        row[_IDX["c05"]] = f"P{product:05d}"
+        row[_IDX["c06"]] = f"کالای {product}"
+        row[_IDX["c29"]] = RETURN_TYPE if is_return else SALE_TYPE
+        row[_IDX["c38"]] = f"{year}/{month:02d}/{day:02d}"
+        row[_IDX["c42"]] = f"C{customer:06d}"
+        row[_IDX["c43"]] = f"مشتری {customer}"
+        row[_IDX["c46"]] = fmt_amount(sign * quantity)
+        row[_IDX["c47"]] = fmt_amount(unit_price)
+        row[_IDX["c48"]] = fmt_amount(sign * gross)
+        row[_IDX["c49"]] = fmt_amount(discount_volume)
+        row[_IDX["c50"]] = fmt_amount(discount_cash)
+        row[_IDX["c52"]] = fmt_amount(sign * net)
+
+        # sales usually carry the pre-invoice date, a few days earlier
+        if not is_return and rng.random() >= self.missing_ref_rate:
+            ref_day = max(1, day - rng.randint(0, 3))
+            row[_IDX["c54"]] = f"{year}/{month:02d}/{ref_day:02d}"
+
+        if rng.random() < self.bad_numeric_rate:
+            row[_IDX[rng.choice(["c46", "c47", "c48", "c52"])]] = rng.choice(BAD_NUMERICS)
+
+        return row
+
+    def rows(self, year: int, month: int, count: int):
+        """
+        Yield `count` rows dated in one Jalali month (duplicates included).
+        """
+        rng = self.rng
+        for _ in range(count):
+            if self.recent and rng.random() < self.duplicate_rate:
+                yield rng.choice(self.recent)
+                continue
+            row = self._row(year, month)
+            # small window of rows that may be repeated
+            if len(self.recent) < 1000:
+                self.recent.append(row)
+            else:
+                self.recent[rng.randrange(1000)] = row
+            yield row
+
+
+def generate(
+    out_dir: Path,
+    rows: int,
+    months: int = 12,
+    start: str = "1402/01",
+    **options,
+) -> dict[str, int]:
+    """
+    Write `rows` rows spread over `months` monthly files; returns
+    {file name: data rows} (also written to manifest.json).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start_year, start_month = map(int, start.split("/"))
+    gen = KaramadGenerator(**options)
+
+    manifest = {}
+    per_month, extra = divmod(rows, months)
+    for n, (year, month) in enumerate(iter_months(start_year, start_month, months)):
+        count = per_month + (1 if n < extra else 0)
+        path = out_dir / f"karamad_{year}_{month:02d}.csv"
+        # utf-8-sig like the real exports (Excel-friendly BOM)
+        with path.open("w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header_row())
+            writer.writerows(gen.rows(year, month, count))
+        manifest[path.name] = count
+
+    with (out_dir / "manifest.json").open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="data/synthetic")
+    size = ap.add_mutually_exclusive_group()
+    size.add_argument("--size", choices=SIZES, default="small", help="10k / 1M / 10M rows")
+    size.add_argument("--rows", type=int)
+    ap.add_argument("--months", type=int, default=12, help="one file per Jalali month")
+    ap.add_argument("--start", default="1402/01", help="first Jalali month (YYYY/MM)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--return-rate", type=float, default=0.05)
+    ap.add_argument("--missing-ref-rate", type=float, default=0.03)
+    ap.add_argument("--bad-numeric-rate", type=float, default=0.005)
+    ap.add_argument("--missing-invoice-rate", type=float, default=0.002)
+    ap.add_argument("--duplicate-rate", type=float, default=0.01)
+    args = ap.parse_args()
+
+    rows = args.rows if args.rows is not None else SIZES[args.size]
+    manifest = generate(
+        Path(args.out),
+        rows,
+        months=args.months,
+        start=args.start,
+        seed=args.seed,
+        return_rate=args.return_rate,
+        missing_ref_rate=args.missing_ref_rate,
+        bad_numeric_rate=args.bad_numeric_rate,
+        missing_invoice_rate=args.missing_invoice_rate,
+        duplicate_rate=args.duplicate_rate,
+    )
+    print(f"Wrote {sum(manifest.values())} rows in {len(manifest)} files to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
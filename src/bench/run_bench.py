@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: inspect -> load_raw -> normalize -> KPI queries.
+
+Each stage runs in a fresh process, so the reported peak RSS belongs to
+that stage alone. Results are printed as a table and can be written as
+JSON to compare runs (e.g. before / after a change to a hot path).
+
+Needs a local Postgres with the DDL, migrations and views_kpi.sql applied;
+--truncate empties the pipeline tables first, for repeatable numbers.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.bench.generate_karamad import SIZES, generate
+
+KPI_QUERIES = {
+    "kpi_net_sales_daily": "select * from kpi_net_sales_daily",
+    "kpi_top_customers_month": "select * from kpi_top_customers_month",
+    "kpi_return_rate_by_product_month": "select * from kpi_return_rate_by_product_month",
+    "kpi_net_sales_daily_live": "select * from kpi_net_sales_daily_live",
+    "kpi_top_customers_month_live": "select * from kpi_top_customers_month_live",
+    "kpi_return_rate_by_product_month_live": "select * from kpi_return_rate_by_product_month_live",
+}
+
+PIPELINE_TABLES = [
+    "raw_karamad_sales",
+    "raw_karamad_row_keys",
+    "raw_load_checkpoints",
+    "canonical_sales",
+    "canonical_row_keys",
+    "dq_issues",
+    "canonical_rejects",
+    "dq_run_stats",
+    "pipeline_run_metrics",
+    "normalize_state",
+    "normalize_shards",
+    "kpi_net_sales_daily_agg",
+    "kpi_top_customers_month_agg",
+    "kpi_return_rate_by_product_month_agg",
+]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# =========================
+# Stages (each runs in its own process)
+# =========================
+def stage_inspect(files: list[str]) -> int:
+    from src.ingestion.inspect_csv import profile
+
+    return sum(profile(Path(f)).get("rows", 0) for f in files)
+
+
+def stage_load_raw(files: list[str], mode: str, chunk_size: int) -> int:
+    from src.ingestion.load_raw import batch_id_for, load_file
+
+    rows = 0
+    for f in files:
+        path = Path(f)
+        rows += load_file(path, batch_id_for(path, "bench"), mode=mode, chunk_size=chunk_size)["rows_read"]
+    return rows
+
+
+def stage_normalize(engine: str, batch_size: int) -> int:
+    from src.transform.normalize_karamad import connect, normalize
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        normalize(batch_size=batch_size, full=True, engine=engine)
+
+    with connect() as conn, conn.cursor() as cur:
+        cur.execute("select processed_count from dq_run_stats order by run_id desc limit 1")
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def stage_kpi(sql: str) -> int:
+    from src.transform.normalize_karamad import connect
+
+    with connect() as conn, conn.cursor() as cur:
+        cur.execute(sql)
+        return len(cur.fetchall())
+
+
+def _run(func, args) -> dict:
+    started = time.perf_counter()
+    rows = func(*args)
+    seconds = time.perf_counter() - started
+    return {"rows": rows, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_stage(name: str, func, *args) -> dict:
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        result = pool.submit(_run, func, args).result()
+    result["stage"] = name
+    result["rows_per_sec"] = result["rows"] / result["seconds"] if result["seconds"] else None
+    print(
+        f"{name:<40} {result['rows']:>10} rows {result['seconds']:>9.2f} s "
+        f"{result['rows_per_sec'] or 0:>12,.0f} rows/s {result['peak_rss_mb']:>9.1f} MB",
+        flush=True,
+    )
+    return result
+
+
+def truncate_pipeline_tables() -> None:
+    from src.transform.normalize_karamad import connect
+
+    with connect() as conn, conn.cursor() as cur:
+        cur.execute(f"truncate {', '.join(PIPELINE_TABLES)} restart identity")
+
+
+# =========================
+# Entry point
+# =========================
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default="data/synthetic", help="directory of Karamad CSVs")
+    ap.add_argument("--generate", choices=SIZES, help="(re)generate --data at this size first")
+    ap.add_argument("--truncate", action="store_true", help="empty the pipeline tables first")
+    ap.add_argument("--stages", default="inspect,load_raw,normalize,kpi")
+    ap.add_argument("--load-mode", choices=["copy", "values"], default="copy")
+    ap.add_argument("--chunk-size", type=int, default=10000)
+    ap.add_argument("--engine", choices=["row", "columnar", "sql"], default="row")
+    ap.add_argument("--batch-size", type=int, default=5000)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    data = Path(args.data)
+    if args.generate:
+        generate(data, SIZES[args.generate])
+    files = [str(p) for p in sorted(data.glob("*.csv"))]
+    if not files:
+        raise SystemExit(f"No CSV files in {data} (use --generate).")
+
+    if args.truncate:
+        truncate_pipeline_tables()
+
+    stages = args.stages.split(",")
+    results = []
+    if "inspect" in stages:
+        results.append(run_stage("inspect_csv", stage_inspect, files))
+    if "load_raw" in stages:
+        results.append(run_stage(f"load_raw ({args.load_mode})", stage_load_raw, files, args.load_mode, args.chunk_size))
+    if "normalize" in stages:
+        results.append(run_stage(f"normalize ({args.engine})", stage_normalize, args.engine, args.batch_size))
+    if "kpi" in stages:
+        for name, sql in KPI_QUERIES.items():
+            results.append(run_stage(name, stage_kpi, sql))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"data": str(data), "files": len(files), "stages": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Per-stage timers and counters for pipeline runs.
+
+A RunMetrics collects wall time, DB round trips, rows and bytes for each
+named stage of one load / normalization run and writes them to
+pipeline_run_metrics (migration 007) next to the run's own data.
+
+Round trips are counted, not estimated: connections opened with
+connection_factory=CountingConnection count every statement they send
+(each page of execute_values), every COPY and every fetch from a
+server-side cursor, per thread. Commits are not counted.
+"""
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+_END = object()
+
+_counter = threading.local()
+
+
+def round_trips():
+    """
+    Round trips of this thread's CountingConnections so far.
+    """
+    return getattr(_counter, "n", 0)
+
+
+def _count(n=1):
+    _counter.n = round_trips() + n
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that adds its round trips to the thread's count.
+    """
+
+    def execute(self, query, vars=None):
+        _count()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        _count(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        _count()
+        return super().copy_expert(sql, file, size)
+
+    # a named (server-side) cursor sends a FETCH for each of these; a
+    # client-side one already holds its rows
+    def fetchone(self):
+        if self.name is not None:
+            _count()
+        return super().fetchone()
+
+    def fetchmany(self, size=None):
+        if self.name is not None:
+            _count()
+        return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        if self.name is not None:
+            _count()
+        return super().fetchall()
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """
+    Connection whose cursors (named ones included) are CountingCursors.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class StageStats:
+    __slots__ = ("seconds", "round_trips", "rows", "bytes", "peak_rss_mb")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.round_trips = 0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_rss_mb = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds and self.rows else None
+
+
+class RunMetrics:
+    """
+    Stage name -> StageStats for one run; stages keep insertion order.
+
+    A stage can be entered many times (once per batch); its numbers add up.
+    Round trips of a stage entered inside another one count for the inner
+    stage only. Peak RSS is the process peak when the stage last finished.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.started_round_trips = round_trips()
+        # round trips of the stages entered inside each open stage
+        self._inner = []
+
+    def __getitem__(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    @contextmanager
+    def stage(self, name, rows=0, nbytes=0):
+        """
+        Time the block as `name` and count its round trips; yields its
+        StageStats for counters only known inside the block.
+        """
+        stats = self[name]
+        started = time.perf_counter()
+        started_round_trips = round_trips()
+        self._inner.append(0)
+        try:
+            yield stats
+        finally:
+            spent = round_trips() - started_round_trips
+            stats.round_trips += spent - self._inner.pop()
+            if self._inner:
+                self._inner[-1] += spent
+            stats.seconds += time.perf_counter() - started
+            stats.rows += rows
+            stats.bytes += nbytes
+            stats.peak_rss_mb = peak_rss_mb()
+
+    def timed(self, name, items, size=len):
+        """
+        Iterate `items`, timing only the time spent producing each item
+        (e.g. CSV parsing behind a generator) as `name`.
+        """
+        it = iter(items)
+        while True:
+            with self.stage(name) as stats:
+                item = next(it, _END)
+                if item is _END:
+                    return
+                stats.rows += size(item)
+            yield item
+
+    def finish(self, started, rows, nbytes=0):
+        """
+        Record the whole run as the "total" stage; `started` is its
+        time.perf_counter() start. Its round trips are all of this thread's
+        since the RunMetrics was created, inside a stage or not.
+        """
+        total = self["total"]
+        total.seconds = time.perf_counter() - started
+        total.rows = rows
+        total.bytes = nbytes
+        total.round_trips = round_trips() - self.started_round_trips
+        total.peak_rss_mb = peak_rss_mb()
+
+    def write(self, cur, *, pipeline, source_system, source_file, load_batch_id, run_id=None):
+        """
+        Insert one pipeline_run_metrics row per stage (one round trip).
+        """
+        if not self.stages:
+            return
+        execute_values(
+            cur,
+            """
+            insert into pipeline_run_metrics (
+                pipeline, source_system, source_file, load_batch_id, run_id,
+                stage, seconds, round_trips, rows, bytes, rows_per_sec, peak_rss_mb
+            )
+            values %s
+            """,
+            [
+                (
+                    pipeline, source_system, source_file, load_batch_id, run_id,
+                    name, s.seconds, s.round_trips, s.rows, s.bytes, s.rows_per_sec, s.peak_rss_mb,
+                )
+                for name, s in self.stages.items()
+            ],
+        )
+
+    def summary(self):
+        """
+        One line per stage, for console output.
+        """
+        lines = []
+        for name, s in self.stages.items():
+            rate = f"{s.rows_per_sec:,.0f} rows/s" if s.rows_per_sec else "-"
+            lines.append(
+                f"  {name:<16} {s.seconds:>9.3f} s {s.rows:>10} rows {rate:>16} "
+                f"{s.round_trips:>7} round trips {s.peak_rss_mb:>8.1f} MB peak"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,14 @@
+-- 003_add_normalize_state.sql
+-- purpose: persist normalization progress per source system (RAW watermark)
+
+create table if not exists normalize_state(
+
+    source_system text primary key,
+
+    -- highest raw_karamad_sales.raw_id already normalized.
+    -- raw_id is a bigserial assigned at load time, so this assumes RAW
+    -- loads are committed before normalization picks them up.
+    last_raw_id bigint not null default 0,
+
+    updated_at timestamptz not null default now()
+);
@@ -0,0 +1,34 @@
+-- 004_add_dim_date.sql
+-- purpose: precomputed calendar dimension + precomputed month key on canonical
+
+-- 1. calendar dimension (populated by src/transform/dim_date.py)
+create table if not exists dim_date(
+
+    date_gregorian date primary key,
+
+    -- Jalali calendar
+    date_jalali text not null unique,   -- 'YYYY/MM/DD', zero-padded
+    jalali_year smallint not null,
+    jalali_month smallint not null,
+    jalali_month_key text not null,     -- 'YYYY/MM'
+
+    -- Gregorian calendar
+    month_gregorian date not null,      -- first day of the month
+    iso_year smallint not null,
+    iso_week smallint not null
+);
+
+create index if not exists ix_dim_date__month_gregorian
+    on dim_date(month_gregorian);
+
+create index if not exists ix_dim_date__jalali_month_key
+    on dim_date(jalali_month_key);
+
+-- 2. month key stored on canonical rows, so KPI views group on a column
+--    instead of recomputing DATE_TRUNC per row
+alter table canonical_sales
+    add column if not exists invoice_month_gregorian date
+    generated always as (date_trunc('month', invoice_date_gregorian::timestamp)::date) stored;
+
+create index if not exists ix_canonical_sales__invoice_month_gregorian
+    on canonical_sales(invoice_month_gregorian);
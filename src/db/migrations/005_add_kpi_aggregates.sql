@@ -0,0 +1,134 @@
+-- 005_add_kpi_aggregates.sql
+-- purpose: materialized KPI tables, refreshed incrementally per day / month
+--
+-- KPI semantics stay in the *_live views (views_kpi.sql).
+-- These tables only store their output; the public kpi_* views read them.
+-- Apply views_kpi.sql after this migration.
+
+-- 1. aggregate tables (same columns as the KPI views)
+create table if not exists kpi_net_sales_daily_agg(
+    day date primary key,
+    net_sales_amount numeric,
+    gross_sales_amount numeric,
+    returns_amount numeric,
+    invoice_count bigint,
+    line_count bigint,
+    refreshed_at timestamptz not null default now()
+);
+
+create table if not exists kpi_return_rate_by_product_month_agg(
+    product_id text not null,
+    month date not null,
+    sale_quantity numeric,
+    return_quantity numeric,
+    return_rate numeric,
+    refreshed_at timestamptz not null default now(),
+    primary key (product_id, month)
+);
+
+create index if not exists ix_kpi_return_rate_by_product_month_agg__month
+    on kpi_return_rate_by_product_month_agg(month);
+
+create table if not exists kpi_top_customers_month_agg(
+    customer_id text not null,
+    month date not null,
+    net_sales_amount numeric,
+    refreshed_at timestamptz not null default now(),
+    primary key (customer_id, month)
+);
+
+create index if not exists ix_kpi_top_customers_month_agg__month
+    on kpi_top_customers_month_agg(month);
+
+-- 2. lookups used to find the days / months of a batch
+create index if not exists ix_canonical_sales__load_batch_id
+    on canonical_sales(load_batch_id);
+
+-- 3. refresh functions
+--    Each one replaces the aggregate rows of the given keys with the
+--    current output of the live view; refreshes are serialized.
+create or replace function refresh_kpi_days(p_days date[])
+returns void
+language plpgsql
+as $$
+begin
+    perform pg_advisory_xact_lock(hashtext('refresh_kpi'));
+
+    delete from kpi_net_sales_daily_agg
+    where day = any(p_days);
+
+    insert into kpi_net_sales_daily_agg (
+        day, net_sales_amount, gross_sales_amount, returns_amount, invoice_count, line_count
+    )
+    select day, net_sales_amount, gross_sales_amount, returns_amount, invoice_count, line_count
+    from kpi_net_sales_daily_live
+    where day = any(p_days);
+end;
+$$;
+
+create or replace function refresh_kpi_months(p_months date[])
+returns void
+language plpgsql
+as $$
+begin
+    perform pg_advisory_xact_lock(hashtext('refresh_kpi'));
+
+    delete from kpi_return_rate_by_product_month_agg
+    where month = any(p_months);
+
+    insert into kpi_return_rate_by_product_month_agg (
+        product_id, month, sale_quantity, return_quantity, return_rate
+    )
+    select product_id, month, sale_quantity, return_quantity, return_rate
+    from kpi_return_rate_by_product_month_live
+    where month = any(p_months);
+
+    delete from kpi_top_customers_month_agg
+    where month = any(p_months);
+
+    insert into kpi_top_customers_month_agg (customer_id, month, net_sales_amount)
+    select customer_id, month, net_sales_amount
+    from kpi_top_customers_month_live
+    where month = any(p_months);
+end;
+$$;
+
+-- refresh everything a set of load batches touched
+create or replace function refresh_kpi_for_batches(p_batch_ids text[])
+returns void
+language plpgsql
+as $$
+declare
+    v_days date[];
+    v_months date[];
+begin
+    select
+        array_agg(distinct invoice_date_gregorian),
+        array_agg(distinct invoice_month_gregorian)
+    into v_days, v_months
+    from canonical_sales
+    where load_batch_id = any(p_batch_ids);
+
+    perform refresh_kpi_days(coalesce(v_days, '{}'));
+    perform refresh_kpi_months(coalesce(v_months, '{}'));
+end;
+$$;
+
+-- full rebuild (initial backfill)
+create or replace function refresh_kpi_all()
+returns void
+language plpgsql
+as $$
+begin
+    perform refresh_kpi_days(array(select distinct invoice_date_gregorian from canonical_sales));
+    perform refresh_kpi_months(array(select distinct invoice_month_gregorian from canonical_sales));
+
+    -- keys that no longer exist in canonical at all
+    delete from kpi_net_sales_daily_agg a
+    where not exists (select 1 from canonical_sales c where c.invoice_date_gregorian = a.day);
+    delete from kpi_return_rate_by_product_month_agg a
+    where not exists (select 1 from canonical_sales c where c.invoice_month_gregorian = a.month);
+    delete from kpi_top_customers_month_agg a
+    where not exists (select 1 from canonical_sales c where c.invoice_month_gregorian = a.month);
+end;
+$$;
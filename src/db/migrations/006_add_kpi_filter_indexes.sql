@@ -0,0 +1,35 @@
+-- 006_add_kpi_filter_indexes.sql
+-- purpose: indexes behind the filtered / keyset-paginated KPI endpoints
+--
+-- Filters on a KPI's own grain (day, month, product, customer) read the
+-- *_agg tables; other filters aggregate canonical_sales through the
+-- kpi_*_for() functions in views_kpi.sql.
+-- Apply views_kpi.sql after this migration.
+
+-- 1. canonical drill-downs: one actor over a date range
+--    (these also cover plain lookups on the actor, so the single-column
+--    indexes from ddl_canonical.sql are dropped)
+create index if not exists ix_canonical_sales__product_id__invoice_date
+    on canonical_sales(product_id, invoice_date_gregorian);
+
+create index if not exists ix_canonical_sales__customer_id__invoice_date
+    on canonical_sales(customer_id, invoice_date_gregorian);
+
+create index if not exists ix_canonical_sales__salesperson_id__invoice_date
+    on canonical_sales(salesperson_id, invoice_date_gregorian);
+
+drop index if exists ix_canonical_sales__product_id;
+drop index if exists ix_canonical_sales__customer_id;
+drop index if exists ix_canonical_sales__salesperson_id;
+
+-- 2. keyset order of the aggregate read surface
+--    (net_sales_daily pages on its primary key)
+create index if not exists ix_kpi_top_customers_month_agg__page
+    on kpi_top_customers_month_agg(month, net_sales_amount, customer_id);
+
+drop index if exists ix_kpi_top_customers_month_agg__month;
+
+-- return_rate pages NULLs first (DESC order), so the key is
+-- coalesce(return_rate, 'Infinity')
+create index if not exists ix_kpi_return_rate_by_product_month_agg__page
+    on kpi_return_rate_by_product_month_agg((coalesce(return_rate, 'Infinity'::numeric)), month, product_id);
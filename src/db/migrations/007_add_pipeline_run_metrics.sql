@@ -0,0 +1,34 @@
+-- 007_add_pipeline_run_metrics.sql
+-- purpose: per-stage timings and counters of load_raw / normalize runs
+
+create table if not exists pipeline_run_metrics(
+
+    metric_id bigserial primary key,
+
+    -- which run
+    pipeline text not null check (pipeline in ('load_raw', 'normalize')),
+    source_system text not null,
+    source_file text,
+    load_batch_id text not null,
+    -- normalize runs: the matching dq_run_stats row
+    run_id bigint references dq_run_stats(run_id),
+
+    -- one row per stage (parse, copy, fetch, transform, dq_write, ...;
+    -- 'total' covers the whole run)
+    stage text not null,
+    seconds double precision not null,
+    round_trips bigint not null,
+    rows bigint not null,
+    bytes bigint not null,
+    rows_per_sec double precision,
+    -- process peak when the stage last finished
+    peak_rss_mb double precision,
+
+    recorded_at timestamptz not null default now()
+);
+
+create index if not exists ix_pipeline_run_metrics__load_batch_id
+    on pipeline_run_metrics(load_batch_id);
+
+create index if not exists ix_pipeline_run_metrics__run_id
+    on pipeline_run_metrics(run_id);
@@ -0,0 +1,243 @@
+-- 008_partition_canonical_and_raw.sql
+-- purpose: monthly range partitions for canonical_sales (by event date)
+--          and raw_karamad_sales (by ingestion month)
+--
+-- Partitions are created on demand by ensure_monthly_partitions():
+-- load_raw calls it before each load, normalize for every month it writes.
+-- Existing rows are copied into the partitioned tables.
+--
+-- Idempotency keys:
+--   canonical: unique (source_system, raw_row_hash, invoice_date_gregorian).
+--     This does NOT keep the old (source_system, raw_row_hash) key: the
+--     event date depends on the rules and on dim_date, so a rule change
+--     can move a raw row to another partition. Migration 015 restores the
+--     old key in canonical_row_keys.
+--   RAW: a unique index on a partitioned table must contain the partition
+--     key (ingested_at), which would let a re-load in a later month through.
+--     (source_system, row_hash) therefore lives in raw_karamad_row_keys,
+--     which load_raw claims before inserting RAW rows.
+
+-- 1. partition helpers
+create or replace function ensure_monthly_partitions(p_table text, p_from date, p_to date)
+returns integer
+language plpgsql
+as $$
+declare
+    v_month date := date_trunc('month', p_from)::date;
+    v_part text;
+    v_created integer := 0;
+begin
+    while v_month <= p_to loop
+        v_part := format('%s_%s', p_table, to_char(v_month, 'YYYY_MM'));
+        if to_regclass(v_part) is null then
+            -- concurrent loaders: the second one waits, then sees the table
+            perform pg_advisory_xact_lock(hashtext(v_part));
+            if to_regclass(v_part) is null then
+                execute format(
+                    'create table %I partition of %I for values from (%L) to (%L)',
+                    v_part, p_table, v_month, (v_month + interval '1 month')::date
+                );
+                v_created := v_created + 1;
+            end if;
+        end if;
+        v_month := (v_month + interval '1 month')::date;
+    end loop;
+    return v_created;
+end;
+$$;
+
+-- replace one canonical month: drop its partition (no DELETE, no vacuum)
+-- and clear its KPI rows; re-normalize the month afterwards
+create or replace function drop_canonical_month(p_month date)
+returns void
+language plpgsql
+as $$
+declare
+    v_month date := date_trunc('month', p_month)::date;
+    v_part text := format('canonical_sales_%s', to_char(v_month, 'YYYY_MM'));
+begin
+    if to_regclass(v_part) is not null then
+        execute format('alter table canonical_sales detach partition %I', v_part);
+        execute format('drop table %I', v_part);
+    end if;
+
+    perform refresh_kpi_days(array(
+        select d::date
+        from generate_series(v_month, (v_month + interval '1 month - 1 day')::date, interval '1 day') d
+    ));
+    perform refresh_kpi_months(array[v_month]);
+end;
+$$;
+
+-- 2. canonical_sales -> partitioned by month of invoice_date_gregorian
+do $$
+declare
+    v_from date;
+    v_to date;
+begin
+    if (select relkind from pg_class where oid = 'canonical_sales'::regclass) = 'p' then
+        raise notice 'canonical_sales is already partitioned';
+        return;
+    end if;
+
+    alter table canonical_sales rename to canonical_sales_unpartitioned;
+
+    create table canonical_sales (
+        like canonical_sales_unpartitioned
+        including defaults including constraints including generated
+    ) partition by range (invoice_date_gregorian);
+
+    -- keep the id sequence when the old table goes
+    alter sequence canonical_sales_canonical_id_seq owned by canonical_sales.canonical_id;
+
+    select min(invoice_date_gregorian), max(invoice_date_gregorian)
+    into v_from, v_to
+    from canonical_sales_unpartitioned;
+    perform ensure_monthly_partitions('canonical_sales', v_from, v_to);
+
+    insert into canonical_sales (
+        canonical_id, source_system, source_file, load_batch_id, raw_row_hash,
+        invoice_id, customer_id, product_id, salesperson_id,
+        invoice_date_jalali, invoice_date_gregorian,
+        transaction_type, sign,
+        quantity, unit_price, gross_amount, discount_amount, net_amount,
+        ingested_at, canonical_loaded_at
+    )
+    select
+        canonical_id, source_system, source_file, load_batch_id, raw_row_hash,
+        invoice_id, customer_id, product_id, salesperson_id,
+        invoice_date_jalali, invoice_date_gregorian,
+        transaction_type, sign,
+        quantity, unit_price, gross_amount, discount_amount, net_amount,
+        ingested_at, canonical_loaded_at
+    from canonical_sales_unpartitioned;
+
+    drop table canonical_sales_unpartitioned;
+
+    -- added after the drop: the old table owned these index names
+    alter table canonical_sales
+        add primary key (canonical_id, invoice_date_gregorian);
+    alter table canonical_sales
+        add constraint canonical_sales_source_system_raw_row_hash_key
+        unique (source_system, raw_row_hash, invoice_date_gregorian);
+end;
+$$;
+
+-- indexes of ddl_canonical.sql and migrations 004-006, now per partition
+create index if not exists ix_canonical__invoice_date_gregorian
+    on canonical_sales(invoice_date_gregorian);
+create index if not exists ix_canonical_sales__invoice_month_gregorian
+    on canonical_sales(invoice_month_gregorian);
+create index if not exists ix_canonical_sales__load_batch_id
+    on canonical_sales(load_batch_id);
+create index if not exists ix_canonical_sales__product_id__invoice_date
+    on canonical_sales(product_id, invoice_date_gregorian);
+create index if not exists ix_canonical_sales__customer_id__invoice_date
+    on canonical_sales(customer_id, invoice_date_gregorian);
+create index if not exists ix_canonical_sales__salesperson_id__invoice_date
+    on canonical_sales(salesperson_id, invoice_date_gregorian);
+
+-- 3. raw_karamad_sales -> partitioned by month of ingested_at
+create table if not exists raw_karamad_row_keys(
+    source_system text not null,
+    row_hash text not null,
+    primary key (source_system, row_hash)
+);
+
+do $$
+declare
+    v_from date;
+    v_to date;
+begin
+    if (select relkind from pg_class where oid = 'raw_karamad_sales'::regclass) = 'p' then
+        raise notice 'raw_karamad_sales is already partitioned';
+        return;
+    end if;
+
+    alter table raw_karamad_sales rename to raw_karamad_sales_unpartitioned;
+
+    create table raw_karamad_sales (
+        like raw_karamad_sales_unpartitioned including defaults
+    ) partition by range (ingested_at);
+
+    alter sequence raw_karamad_sales_raw_id_seq owned by raw_karamad_sales.raw_id;
+
+    select min(ingested_at)::date, max(ingested_at)::date
+    into v_from, v_to
+    from raw_karamad_sales_unpartitioned;
+    perform ensure_monthly_partitions('raw_karamad_sales', v_from, v_to);
+
+    insert into raw_karamad_sales
+    select * from raw_karamad_sales_unpartitioned;
+
+    insert into raw_karamad_row_keys (source_system, row_hash)
+    select source_system, row_hash from raw_karamad_sales_unpartitioned
+    on conflict do nothing;
+
+    drop table raw_karamad_sales_unpartitioned;
+
+    -- raw_id leads, so the normalize watermark scan stays an index range
+    alter table raw_karamad_sales
+        add primary key (raw_id, ingested_at);
+end;
+$$;
+
+create index if not exists ix_raw_karamad_sales__load_batch_id_ingested_at
+    on raw_karamad_sales(load_batch_id, ingested_at);
+
+-- 4. KPI refreshes read canonical through date ranges, so they touch only
+--    the partitions of the refreshed days / months
+create or replace function refresh_kpi_days(p_days date[])
+returns void
+language plpgsql
+as $$
+declare
+    v_from date := (select min(d) from unnest(p_days) d);
+    v_to date := (select max(d) from unnest(p_days) d);
+begin
+    perform pg_advisory_xact_lock(hashtext('refresh_kpi'));
+
+    delete from kpi_net_sales_daily_agg
+    where day = any(p_days);
+
+    if v_from is null then
+        return;
+    end if;
+
+    insert into kpi_net_sales_daily_agg (
+        day, net_sales_amount, gross_sales_amount, returns_amount, invoice_count, line_count
+    )
+    select day, net_sales_amount, gross_sales_amount, returns_amount, invoice_count, line_count
+    from kpi_net_sales_daily_for(v_from, v_to)
+    where day = any(p_days);
+end;
+$$;
+
+create or replace function refresh_kpi_months(p_months date[])
+returns void
+language plpgsql
+as $$
+declare
+    v_month date;
+begin
+    perform pg_advisory_xact_lock(hashtext('refresh_kpi'));
+
+    delete from kpi_return_rate_by_product_month_agg
+    where month = any(p_months);
+
+    delete from kpi_top_customers_month_agg
+    where month = any(p_months);
+
+    foreach v_month in array p_months loop
+        insert into kpi_return_rate_by_product_month_agg (
+            product_id, month, sale_quantity, return_quantity, return_rate
+        )
+        select product_id, month, sale_quantity, return_quantity, return_rate
+        from kpi_return_rate_by_product_month_for(v_month, v_month);
+
+        insert into kpi_top_customers_month_agg (customer_id, month, net_sales_amount)
+        select customer_id, month, net_sales_amount
+        from kpi_top_customers_month_for(v_month, v_month);
+    end loop;
+end;
+$$;
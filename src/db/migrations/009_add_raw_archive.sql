@@ -0,0 +1,41 @@
+-- 009_add_raw_archive.sql
+-- purpose: cold tier for normalized RAW batches (src/ingestion/archive_raw.py)
+--
+-- Archived rows leave raw_karamad_sales for one Parquet file per batch.
+-- Idempotency is unaffected (hashes stay in raw_karamad_row_keys); the
+-- lineage columns of every archived row stay here.
+
+-- 1. one row per archive file
+create table if not exists raw_archive_batches(
+
+    source_system text not null,
+    load_batch_id text not null,
+    -- a batch id loaded again later is archived again as another file
+    min_raw_id bigint not null,
+    max_raw_id bigint not null,
+
+    archive_path text not null,
+    row_count bigint not null,
+    file_bytes bigint not null,
+    file_sha256 text not null,
+
+    archived_at timestamptz not null default now(),
+
+    primary key (source_system, load_batch_id, min_raw_id)
+);
+
+-- 2. lineage of archived rows (everything but the 61 source columns)
+create table if not exists raw_karamad_archived(
+    raw_id bigint primary key,
+    source_system text not null,
+    source_file text not null,
+    load_batch_id text not null,
+    row_hash text not null,
+    ingested_at timestamptz not null
+);
+
+create index if not exists ix_raw_karamad_archived__load_batch_id
+    on raw_karamad_archived(load_batch_id);
+
+create index if not exists ix_raw_karamad_archived__row_hash
+    on raw_karamad_archived(row_hash);
@@ -0,0 +1,34 @@
+-- 010_row_hash_bytea.sql
+-- purpose: store row hashes as 32-byte SHA-256 digests (bytea) instead of
+--          64-character hex text
+--
+-- Covers every column that holds a RAW row hash; the indexes and unique
+-- constraints on them are rebuilt by the type change. Columns that are
+-- already bytea are skipped, so the migration can be re-run.
+
+do $$
+declare
+    v_col record;
+begin
+    for v_col in
+        select c.table_name, c.column_name
+        from information_schema.columns c
+        join pg_class t on t.relname = c.table_name
+        where c.table_schema = current_schema()
+          and (c.table_name, c.column_name) in (
+              ('raw_karamad_row_keys', 'row_hash'),
+              ('raw_karamad_sales', 'row_hash'),
+              ('raw_karamad_archived', 'row_hash'),
+              ('canonical_sales', 'raw_row_hash')
+          )
+          and c.data_type = 'text'
+          -- partitions follow their parent
+          and not t.relispartition
+    loop
+        execute format(
+            'alter table %I alter column %I type bytea using decode(%I, ''hex'')',
+            v_col.table_name, v_col.column_name, v_col.column_name
+        );
+    end loop;
+end;
+$$;
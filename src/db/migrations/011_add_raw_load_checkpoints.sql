@@ -0,0 +1,29 @@
+-- 011_add_raw_load_checkpoints.sql
+-- purpose: resumable RAW loads (load_raw --resume)
+--
+-- load_raw commits every chunk together with its checkpoint row, so a
+-- failed load continues from byte_offset instead of the first row.
+
+create table if not exists raw_load_checkpoints(
+
+    source_system text not null,
+    source_file text not null,
+    load_batch_id text not null,
+
+    -- file size when the load started; a resume against a changed file is refused
+    file_bytes bigint not null,
+
+    -- first byte after the last committed row, and rows up to it
+    byte_offset bigint not null default 0,
+    rows_read bigint not null default 0,
+    rows_inserted bigint not null default 0,
+
+    status text not null default 'running'
+        check (status in ('running', 'done')),
+
+    started_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    finished_at timestamptz,
+
+    primary key (source_file, load_batch_id)
+);
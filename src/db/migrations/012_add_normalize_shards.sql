@@ -0,0 +1,78 @@
+-- 012_add_normalize_shards.sql
+-- purpose: parallel normalization over disjoint raw_id shards
+--          (normalize_karamad --workers N, src/transform/normalize_shards.py)
+--
+-- A sharded run splits the RAW rows above the watermark into raw_id ranges
+-- (from_raw_id, to_raw_id]. Workers claim a shard with an advisory lock and
+-- normalize it in one transaction that also marks it done, so a crashed
+-- worker's shard simply stays pending. The watermark advances to the end of
+-- the done shards below the first pending one.
+
+create table if not exists normalize_shards(
+
+    shard_id bigserial primary key,
+    source_system text not null,
+
+    -- raw_id range: from_raw_id < raw_id <= to_raw_id
+    from_raw_id bigint not null,
+    to_raw_id bigint not null,
+
+    -- combined dq_run_stats row of the sharded run that planned this shard
+    plan_run_id bigint not null references dq_run_stats(run_id),
+
+    status text not null default 'pending'
+        check (status in ('pending', 'done')),
+
+    -- the worker's own dq_run_stats row (null if the shard had no rows)
+    run_id bigint references dq_run_stats(run_id),
+    worker text,
+
+    planned_at timestamptz not null default now(),
+    finished_at timestamptz
+);
+
+create index if not exists ix_normalize_shards__source_system_status_from_raw_id
+    on normalize_shards(source_system, status, from_raw_id);
+
+-- worker rows point at the combined row of their run
+alter table dq_run_stats
+    add column if not exists parent_run_id bigint references dq_run_stats(run_id);
+
+create index if not exists ix_dq_run_stats__parent_run_id
+    on dq_run_stats(parent_run_id);
+
+-- partitions are created while other workers insert into the parent:
+-- create + attach takes share update exclusive on the parent (compatible
+-- with inserts), where create ... partition of takes access exclusive
+create or replace function ensure_monthly_partitions(p_table text, p_from date, p_to date)
+returns integer
+language plpgsql
+as $$
+declare
+    v_month date := date_trunc('month', p_from)::date;
+    v_part text;
+    v_created integer := 0;
+begin
+    while v_month <= p_to loop
+        v_part := format('%s_%s', p_table, to_char(v_month, 'YYYY_MM'));
+        if to_regclass(v_part) is null then
+            -- concurrent loaders: the second one waits, then finds the table
+            -- (an advisory lock does not refresh the catalog cache, so
+            -- to_regclass may still miss it; the create does not)
+            perform pg_advisory_xact_lock(hashtext(v_part));
+            begin
+                execute format('create table %I (like %I including all)', v_part, p_table);
+                execute format(
+                    'alter table %I attach partition %I for values from (%L) to (%L)',
+                    p_table, v_part, v_month, (v_month + interval '1 month')::date
+                );
+                v_created := v_created + 1;
+            exception when duplicate_table then
+                null;
+            end;
+        end if;
+        v_month := (v_month + interval '1 month')::date;
+    end loop;
+    return v_created;
+end;
+$$;
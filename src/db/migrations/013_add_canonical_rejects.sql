@@ -0,0 +1,34 @@
+-- 013_add_canonical_rejects.sql
+-- purpose: quarantine of RAW rows rejected by normalization
+--
+-- replaces skipped_rows.csv: every normalize run upserts its rejects here,
+-- and reprocess_rejects retries only these rows after a rule or mapping fix.
+
+create table if not exists canonical_rejects(
+
+    source_system text not null,
+    raw_row_hash bytea not null,
+    -- missing_invoice_id | invalid_numeric | missing_event_date
+    reason text not null,
+
+    -- the RAW row to retry (raw_karamad_sales, or raw_karamad_archived once archived)
+    raw_id bigint not null,
+    source_file text,
+    load_batch_id text,
+    invoice_id text,
+
+    -- reason-specific values (e.g. the dates of missing_event_date)
+    details jsonb,
+
+    attempts integer not null default 1,
+    first_seen_at timestamptz not null default now(),
+    last_seen_at timestamptz not null default now(),
+
+    primary key (source_system, raw_row_hash, reason)
+);
+
+create index if not exists ix_canonical_rejects__source_system_reason
+    on canonical_rejects (source_system, reason);
+
+create index if not exists ix_canonical_rejects__raw_id
+    on canonical_rejects (raw_id);
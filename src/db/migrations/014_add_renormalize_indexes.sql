@@ -0,0 +1,16 @@
+-- 014_add_renormalize_indexes.sql
+-- purpose: cheap scoped reads for renormalize (one file, load batch or month)
+--
+-- load_batch_id is covered by ix_raw_karamad_sales__load_batch_id_ingested_at
+-- and ix_canonical_sales__load_batch_id, a month by the canonical partitions.
+
+-- 1. --source-file: the RAW rows and the canonical rows of one export
+create index if not exists ix_raw_karamad_sales__source_file
+    on raw_karamad_sales(source_file);
+
+create index if not exists ix_canonical_sales__source_file
+    on canonical_sales(source_file);
+
+-- 2. --month: the RAW rows behind a month's canonical rows, by row hash
+create index if not exists ix_raw_karamad_sales__source_system__row_hash
+    on raw_karamad_sales(source_system, row_hash);
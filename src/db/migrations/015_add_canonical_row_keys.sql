@@ -0,0 +1,65 @@
+-- 015_add_canonical_row_keys.sql
+-- purpose: one canonical row per RAW row again, across partitions
+--
+-- Since 008 the canonical unique key includes invoice_date_gregorian (the
+-- partition key). The event date depends on the rules and on dim_date, so
+-- after a rule change a --full / --from-archive / sql --full run inserted a
+-- second canonical row for every RAW row whose date moved. As
+-- raw_karamad_row_keys does for RAW, (source_system, raw_row_hash) now
+-- lives in canonical_row_keys, claimed in the same statement as the
+-- canonical insert; renormalize is what moves a row to a new date.
+
+create table if not exists canonical_row_keys(
+    source_system text not null,
+    raw_row_hash bytea not null,
+    -- the row's current event date (renormalize --month reads a month's
+    -- RAW rows through it, also after drop_canonical_month)
+    invoice_date_gregorian date not null,
+    primary key (source_system, raw_row_hash)
+);
+
+create index if not exists ix_canonical_row_keys__source_system__invoice_date
+    on canonical_row_keys(source_system, invoice_date_gregorian);
+
+-- backfill; rows already duplicated keep their newest derivation
+do $$
+declare
+    v_days date[];
+begin
+    if exists (select 1 from canonical_row_keys) then
+        raise notice 'canonical_row_keys is already filled';
+        return;
+    end if;
+
+    with ranked as (
+        select
+            canonical_id,
+            invoice_date_gregorian,
+            row_number() over (
+                partition by source_system, raw_row_hash
+                order by canonical_id desc
+            ) as rn
+        from canonical_sales
+    ),
+    gone as (
+        delete from canonical_sales c
+        using ranked r
+        where c.canonical_id = r.canonical_id
+          and c.invoice_date_gregorian = r.invoice_date_gregorian
+          and r.rn > 1
+        returning c.invoice_date_gregorian
+    )
+    select array_agg(distinct invoice_date_gregorian) into v_days from gone;
+
+    insert into canonical_row_keys (source_system, raw_row_hash, invoice_date_gregorian)
+    select source_system, raw_row_hash, invoice_date_gregorian
+    from canonical_sales;
+
+    if v_days is not null then
+        perform refresh_kpi_days(v_days);
+        perform refresh_kpi_months(array(
+            select distinct date_trunc('month', d)::date from unnest(v_days) d
+        ));
+    end if;
+end;
+$$;
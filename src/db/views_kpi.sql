@@ -2,6 +2,13 @@
 -- KPI VIEWS
 -- source: canonical_sales
 -- Semantics: docs/M4_KPI_SEMANTICS.md
+--
+-- kpi_*_for() functions hold the KPI definitions (aggregate canonical_sales,
+-- optionally restricted to a date range / product / customer / salesperson);
+-- kpi_*_live views are the unfiltered calls.
+-- kpi_* views are the read surface: they read the *_agg tables that
+-- refresh_kpi_days() / refresh_kpi_months() fill from the live views
+-- (migration 005).
 -- ===============================
 
 -- =========================================================
@@ -38,7 +45,23 @@
 --       (sanity / volume indicator, not a business KPI)
 -- =========================================================
 
-CREATE OR REPLACE VIEW kpi_net_sales_daily AS
+CREATE OR REPLACE FUNCTION kpi_net_sales_daily_for(
+    p_date_from date DEFAULT NULL,
+    p_date_to date DEFAULT NULL,
+    p_product_id text DEFAULT NULL,
+    p_customer_id text DEFAULT NULL,
+    p_salesperson_id text DEFAULT NULL
+)
+RETURNS TABLE (
+    day date,
+    net_sales_amount numeric,
+    gross_sales_amount numeric,
+    returns_amount numeric,
+    invoice_count bigint,
+    line_count bigint
+)
+LANGUAGE sql STABLE
+AS $$
 SELECT
     invoice_date_gregorian AS day,
 
@@ -59,7 +82,16 @@ SELECT
     COUNT(*) AS line_count
 
 FROM canonical_sales
-GROUP BY invoice_date_gregorian;
+WHERE (p_date_from IS NULL OR invoice_date_gregorian >= p_date_from)
+  AND (p_date_to IS NULL OR invoice_date_gregorian <= p_date_to)
+  AND (p_product_id IS NULL OR product_id = p_product_id)
+  AND (p_customer_id IS NULL OR customer_id = p_customer_id)
+  AND (p_salesperson_id IS NULL OR salesperson_id = p_salesperson_id)
+GROUP BY invoice_date_gregorian
+$$;
+
+CREATE OR REPLACE VIEW kpi_net_sales_daily_live AS
+SELECT * FROM kpi_net_sales_daily_for();
 
 -- =========================================================
 -- KPI: return_rate_by_product_month
@@ -68,7 +100,8 @@ GROUP BY invoice_date_gregorian;
 --   Each row represents one (product_id, calendar month)
 --
 -- Time semantics:
---   Month is derived from invoice_date_gregorian (event date).
+--   Month is derived from invoice_date_gregorian (event date),
+--   precomputed as canonical_sales.invoice_month_gregorian.
 --   Sales and returns are attributed to the month they are recorded.
 --
 -- Numerator:
@@ -86,12 +119,27 @@ GROUP BY invoice_date_gregorian;
 --     (division by zero avoided via NULLIF)
 -- =========================================================
 
-CREATE OR REPLACE VIEW kpi_return_rate_by_product_month AS
+CREATE OR REPLACE FUNCTION kpi_return_rate_by_product_month_for(
+    p_date_from date DEFAULT NULL,
+    p_date_to date DEFAULT NULL,
+    p_product_id text DEFAULT NULL,
+    p_customer_id text DEFAULT NULL,
+    p_salesperson_id text DEFAULT NULL
+)
+RETURNS TABLE (
+    product_id text,
+    month date,
+    sale_quantity numeric,
+    return_quantity numeric,
+    return_rate numeric
+)
+LANGUAGE sql STABLE
+AS $$
 SELECT
-    product_id,
+    canonical_sales.product_id,
 
     -- Calendar month derived from event date
-    DATE_TRUNC('month', invoice_date_gregorian)::date AS month,
+    invoice_month_gregorian AS month,
 
     -- Total quantity sold in the month (denominator)
     SUM(quantity)
@@ -114,9 +162,19 @@ SELECT
     ) AS return_rate
 
 FROM canonical_sales
+-- date range selects whole months
+WHERE (p_date_from IS NULL OR invoice_date_gregorian >= date_trunc('month', p_date_from::timestamp)::date)
+  AND (p_date_to IS NULL OR invoice_date_gregorian < (date_trunc('month', p_date_to::timestamp) + interval '1 month')::date)
+  AND (p_product_id IS NULL OR canonical_sales.product_id = p_product_id)
+  AND (p_customer_id IS NULL OR customer_id = p_customer_id)
+  AND (p_salesperson_id IS NULL OR salesperson_id = p_salesperson_id)
 GROUP BY
-    product_id,
-    DATE_TRUNC('month', invoice_date_gregorian);
+    canonical_sales.product_id,
+    invoice_month_gregorian
+$$;
+
+CREATE OR REPLACE VIEW kpi_return_rate_by_product_month_live AS
+SELECT * FROM kpi_return_rate_by_product_month_for();
 
 -- =========================================================
 -- KPI: top_customers_month
@@ -125,7 +183,8 @@ GROUP BY
 --   Each row represents one (customer_id, calendar month)
 --
 -- Time semantics:
---   Month is derived from invoice_date_gregorian (event date).
+--   Month is derived from invoice_date_gregorian (event date),
+--   precomputed as canonical_sales.invoice_month_gregorian.
 --   Sales and returns are attributed to the month they are recorded.
 --
 -- Metric:
@@ -138,18 +197,74 @@ GROUP BY
 --   (not meaningful for "top customer" ranking)
 -- =========================================================
 
-CREATE OR REPLACE VIEW kpi_top_customers_month AS
+CREATE OR REPLACE FUNCTION kpi_top_customers_month_for(
+    p_date_from date DEFAULT NULL,
+    p_date_to date DEFAULT NULL,
+    p_product_id text DEFAULT NULL,
+    p_customer_id text DEFAULT NULL,
+    p_salesperson_id text DEFAULT NULL
+)
+RETURNS TABLE (
+    customer_id text,
+    month date,
+    net_sales_amount numeric
+)
+LANGUAGE sql STABLE
+AS $$
 SELECT
-    customer_id,
+    canonical_sales.customer_id,
 
-    DATE_TRUNC('month', invoice_date_gregorian)::date AS month,
+    invoice_month_gregorian AS month,
 
     -- Net sales contribution of the customer
     SUM(net_amount * sign) AS net_sales_amount
 
 FROM canonical_sales
+-- date range selects whole months
+WHERE (p_date_from IS NULL OR invoice_date_gregorian >= date_trunc('month', p_date_from::timestamp)::date)
+  AND (p_date_to IS NULL OR invoice_date_gregorian < (date_trunc('month', p_date_to::timestamp) + interval '1 month')::date)
+  AND (p_product_id IS NULL OR product_id = p_product_id)
+  AND (p_customer_id IS NULL OR canonical_sales.customer_id = p_customer_id)
+  AND (p_salesperson_id IS NULL OR salesperson_id = p_salesperson_id)
 GROUP BY
-    customer_id,
-    DATE_TRUNC('month', invoice_date_gregorian)
+    canonical_sales.customer_id,
+    invoice_month_gregorian
+
+HAVING SUM(net_amount * sign) > 0
+$$;
+
+CREATE OR REPLACE VIEW kpi_top_customers_month_live AS
+SELECT * FROM kpi_top_customers_month_for();
+
+-- =========================================================
+-- Read surface (materialized)
+--
+-- Same names and columns as before; reads are index lookups on
+-- the aggregate tables instead of full aggregations.
+-- =========================================================
 
-HAVING SUM(net_amount * sign) > 0;
+CREATE OR REPLACE VIEW kpi_net_sales_daily AS
+SELECT
+    day,
+    net_sales_amount,
+    gross_sales_amount,
+    returns_amount,
+    invoice_count,
+    line_count
+FROM kpi_net_sales_daily_agg;
+
+CREATE OR REPLACE VIEW kpi_return_rate_by_product_month AS
+SELECT
+    product_id,
+    month,
+    sale_quantity,
+    return_quantity,
+    return_rate
+FROM kpi_return_rate_by_product_month_agg;
+
+CREATE OR REPLACE VIEW kpi_top_customers_month AS
+SELECT
+    customer_id,
+    month,
+    net_sales_amount
+FROM kpi_top_customers_month_agg;
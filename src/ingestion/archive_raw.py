@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Cold tier for RAW: move fully normalized batches out of raw_karamad_sales
+into one zstd-compressed Parquet file per load batch (migration 009).
+
+A batch is archived only when all of its rows are at or below the normalize
+watermark and none of them is quarantined in canonical_rejects (retry or
+clear those first with reprocess_rejects). The file is written and read back before anything is deleted;
+then, in one transaction, the lineage columns of its rows are kept in
+raw_karamad_archived, the file is recorded in raw_archive_batches and the
+RAW rows are deleted. RAW partitions left empty are dropped.
+
+Re-loads stay idempotent (row hashes remain in raw_karamad_row_keys), and
+`normalize_karamad --from-archive` re-normalizes straight from the files.
+Needs pyarrow.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.ingestion.load_raw import EXPECTED_COLS, SOURCE_SYSTEM, connect
+
+DEFAULT_ARCHIVE_DIR = "data/archive"
+FETCH_ROWS = 50000
+
+LINEAGE_COLUMNS = ["raw_id", "source_system", "source_file", "load_batch_id", "row_hash", "ingested_at"]
+SOURCE_COLUMNS = [f"c{i:02d}" for i in range(1, EXPECTED_COLS + 1)]
+
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("raw_id", pa.int64()),
+        ("source_system", pa.string()),
+        ("source_file", pa.string()),
+        ("load_batch_id", pa.string()),
+        ("row_hash", pa.binary()),
+        ("ingested_at", pa.timestamp("us", tz="UTC")),
+    ]
+    + [(c, pa.string()) for c in SOURCE_COLUMNS]
+)
+
+ROW_HASH_INDEX = LINEAGE_COLUMNS.index("row_hash")
+
+# columns of normalize_karamad.RAW_SELECT_SQL, in its order
+NORMALIZE_COLUMNS = [
+    "raw_id", "source_system", "source_file", "load_batch_id", "row_hash",
+    "c03", "c05", "c29",
+    "c39", "c42",
+    "c38", "c54",
+    "c46", "c47", "c48", "c49", "c50", "c52",
+    "ingested_at",
+]
+
+# batches whose every row is already normalized, and none quarantined
+# (reprocess_rejects retries those from RAW, without the archive files)
+CANDIDATES_SQL = """
+    select load_batch_id, min(raw_id), max(raw_id), count(*)
+    from raw_karamad_sales
+    where source_system = %s
+      and (%s::text[] is null or load_batch_id = any(%s))
+    group by load_batch_id
+    having max(raw_id) <= (
+        select coalesce(max(last_raw_id), 0) from normalize_state where source_system = %s
+    )
+       and not exists (
+        select 1 from canonical_rejects c
+        where c.source_system = %s and c.load_batch_id = raw_karamad_sales.load_batch_id
+    )
+    order by min(raw_id)
+"""
+
+BATCH_SELECT_SQL = f"""
+    select {", ".join(LINEAGE_COLUMNS + SOURCE_COLUMNS)}
+    from raw_karamad_sales
+    where source_system = %s
+      and load_batch_id = %s
+      and raw_id between %s and %s
+    order by raw_id
+"""
+
+MOVE_LINEAGE_SQL = f"""
+    insert into raw_karamad_archived ({", ".join(LINEAGE_COLUMNS)})
+    select {", ".join(LINEAGE_COLUMNS)}
+    from raw_karamad_sales
+    where source_system = %s
+      and load_batch_id = %s
+      and raw_id between %s and %s
+    on conflict (raw_id) do nothing
+"""
+
+DELETE_RAW_SQL = """
+    delete from raw_karamad_sales
+    where source_system = %s
+      and load_batch_id = %s
+      and raw_id between %s and %s
+"""
+
+RECORD_ARCHIVE_SQL = """
+    insert into raw_archive_batches (
+        source_system, load_batch_id, min_raw_id, max_raw_id,
+        archive_path, row_count, file_bytes, file_sha256
+    )
+    values (%s,%s,%s,%s,%s,%s,%s,%s)
+    on conflict (source_system, load_batch_id, min_raw_id) do update
+    set max_raw_id = excluded.max_raw_id,
+        archive_path = excluded.archive_path,
+        row_count = excluded.row_count,
+        file_bytes = excluded.file_bytes,
+        file_sha256 = excluded.file_sha256,
+        archived_at = now()
+"""
+
+EMPTY_RAW_PARTITIONS_SQL = """
+    select c.relname
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'raw_karamad_sales'::regclass
+      and c.relname < 'raw_karamad_sales_' || to_char(current_date, 'YYYY_MM')
+    order by c.relname
+"""
+
+
+class ArchiveError(Exception):
+    """Raised when an archive file does not match the RAW rows it replaces."""
+
+
+def archive_path(archive_dir: Path, load_batch_id: str, min_raw_id: int, max_raw_id: int) -> Path:
+    # batch ids default to file stems, but --batch-id is free text
+    safe = re.sub(r"[^\w.-]+", "_", load_batch_id)
+    return archive_dir / SOURCE_SYSTEM / f"{safe}__{min_raw_id}-{max_raw_id}.parquet"
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_batches(cur, batch_ids: list[str] | None = None) -> list[tuple]:
+    """
+    (load_batch_id, min_raw_id, max_raw_id, rows) of the batches that are
+    fully normalized, optionally limited to `batch_ids`.
+    """
+    cur.execute(CANDIDATES_SQL, (SOURCE_SYSTEM, batch_ids, batch_ids, SOURCE_SYSTEM, SOURCE_SYSTEM))
+    return cur.fetchall()
+
+
+def write_batch_file(conn, batch: tuple, path: Path) -> int:
+    """
+    Stream one batch into `path` (written to a temp file, then renamed).
+    Returns the number of rows written.
+    """
+    load_batch_id, min_raw_id, max_raw_id, _ = batch
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".parquet.tmp")
+
+    written = 0
+    with conn.cursor(name="raw_karamad_archive") as raw_cur:
+        raw_cur.itersize = FETCH_ROWS
+        raw_cur.execute(BATCH_SELECT_SQL, (SOURCE_SYSTEM, load_batch_id, min_raw_id, max_raw_id))
+        with pq.ParquetWriter(tmp, ARCHIVE_SCHEMA, compression="zstd") as writer:
+            while True:
+                rows = raw_cur.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                # psycopg2 returns bytea as memoryview
+                columns[ROW_HASH_INDEX] = [bytes(h) for h in columns[ROW_HASH_INDEX]]
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, ARCHIVE_SCHEMA)],
+                    schema=ARCHIVE_SCHEMA,
+                ))
+                written += len(rows)
+
+    with tmp.open("rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return written
+
+
+def archive_batch(conn, batch: tuple, archive_dir: Path) -> dict:
+    """
+    Archive one batch and remove its rows from RAW (one transaction).
+    """
+    load_batch_id, min_raw_id, max_raw_id, rows = batch
+    path = archive_path(archive_dir, load_batch_id, min_raw_id, max_raw_id)
+
+    with conn:
+        written = write_batch_file(conn, batch, path)
+        # read back the footer: a truncated or unreadable file fails here
+        meta = pq.ParquetFile(path).metadata
+        if written != rows or meta.num_rows != rows:
+            raise ArchiveError(f"{path}: {meta.num_rows} rows in file, {rows} in RAW")
+
+        with conn.cursor() as cur:
+            key = (SOURCE_SYSTEM, load_batch_id, min_raw_id, max_raw_id)
+            cur.execute(MOVE_LINEAGE_SQL, key)
+            cur.execute(RECORD_ARCHIVE_SQL, key + (str(path), rows, path.stat().st_size, file_sha256(path)))
+            cur.execute(DELETE_RAW_SQL, key)
+            if cur.rowcount != rows:
+                # RAW changed under us: keep it, the file is rewritten next time
+                raise ArchiveError(f"{load_batch_id}: deleted {cur.rowcount} RAW rows, expected {rows}")
+
+    return {"load_batch_id": load_batch_id, "rows": rows, "path": str(path), "bytes": path.stat().st_size}
+
+
+def drop_empty_raw_partitions(conn) -> list[str]:
+    """
+    Drop RAW partitions of past months that archiving has emptied; the
+    current month is kept for loads in progress.
+    """
+    dropped = []
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(EMPTY_RAW_PARTITIONS_SQL)
+            for (part,) in cur.fetchall():
+                cur.execute(f'select exists (select 1 from "{part}")')
+                if cur.fetchone()[0]:
+                    continue
+                cur.execute(f'alter table raw_karamad_sales detach partition "{part}"')
+                cur.execute(f'drop table "{part}"')
+                dropped.append(part)
+    return dropped
+
+
+def archive(archive_dir: Path, batch_ids: list[str] | None = None, dry_run: bool = False) -> list[dict]:
+    conn = connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                batches = find_batches(cur, batch_ids)
+
+        results = []
+        for batch in batches:
+            if dry_run:
+                results.append({"load_batch_id": batch[0], "rows": batch[3], "path": None, "bytes": 0})
+                continue
+            results.append(archive_batch(conn, batch, archive_dir))
+
+        if results and not dry_run:
+            for part in drop_empty_raw_partitions(conn):
+                print(f"Dropped empty partition {part}")
+        return results
+    finally:
+        conn.close()
+
+
+# =========================
+# Reader
+# =========================
+def iter_archive_batches(paths: list[Path], batch_size: int) -> Iterator[list[tuple]]:
+    """
+    Yield rows of archive files in batches of at most `batch_size`, as
+    tuples in RAW_SELECT_SQL order (what the normalize engines expect).
+    """
+    hash_at = NORMALIZE_COLUMNS.index("row_hash")
+    for path in paths:
+        pf = pq.ParquetFile(path)
+        # archives written before migration 010 hold hex strings
+        hex_hashes = pf.schema_arrow.field("row_hash").type == pa.string()
+        for record_batch in pf.iter_batches(batch_size=batch_size, columns=NORMALIZE_COLUMNS):
+            columns = [record_batch.column(name).to_pylist() for name in NORMALIZE_COLUMNS]
+            if hex_hashes:
+                columns[hash_at] = [bytes.fromhex(h) for h in columns[hash_at]]
+            yield list(zip(*columns))
+
+
+def archive_files(paths: list[str]) -> list[Path]:
+    """
+    Expand files and directories into archive files, ordered by first raw_id.
+    """
+    files = []
+    for p in map(Path, paths):
+        files.extend(p.rglob("*.parquet") if p.is_dir() else [p])
+
+    def first_raw_id(f: Path) -> int:
+        m = re.search(r"__(\d+)-\d+\.parquet$", f.name)
+        return int(m.group(1)) if m else 0
+
+    return sorted(files, key=first_raw_id)
+
+
+# =========================
+# Entry point
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Archive normalized RAW batches to Parquet and drop them from Postgres.")
+    ap.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR)
+    ap.add_argument("--batch-id", action="append", help="only this load_batch_id (repeatable)")
+    ap.add_argument("--dry-run", action="store_true", help="list the batches that would be archived")
+    args = ap.parse_args()
+
+    results = archive(Path(args.archive_dir), args.batch_id, args.dry_run)
+    if not results:
+        print("No fully normalized batches to archive.")
+        return
+
+    for r in results:
+        print(f"{r['load_batch_id']:<40} {r['rows']:>10} rows {r['bytes'] / 1e6:>9.1f} MB  {r['path'] or '-'}")
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {sum(r['rows'] for r in results)} rows in {len(results)} batches")
+
+
+if __name__ == "__main__":
+    main()
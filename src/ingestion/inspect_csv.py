@@ -1,74 +1,402 @@
 #!/usr/bin/env python3
+"""
+Column profiler for raw CSV exports, run before loading them.
+
+The file is memory-mapped and cut into chunks on row boundaries (a newline
+outside quotes), and the chunks are profiled in parallel processes. A
+worker streams its chunk and counts values per block of BLOCK_ROWS rows,
+so its memory does not grow with the chunk or the file. Per
+column it reports the null rate, the share of values that parse as numbers
+(parse_numeric) and as Jalali dates (jalali_to_gregorian), an estimate of
+distinct values (HyperLogLog, merged across chunks) and the max width, plus
+the row-shape problems load_raw would reject. Columns in the mapping are
+labelled with their target, so a failing required column shows up here
+instead of in dq_issues.
+"""
 from __future__ import annotations
 
 import argparse
 import csv
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+from src.transform.normalize_karamad import jalali_to_gregorian, parse_numeric
 
-def inspect(file_path: Path, max_examples: int = 5) -> int:
-    with file_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        header = next(reader, None)
-        if header is None:
-            print("ERROR: empty file (no header).")
-            return 2
-
-        expected = len(header)
-        total = 0
-        fixed_short = 0
-        fixed_trailing_empty_extra = 0
-        bad = 0
-        examples = []
-
-        for line_no, row in enumerate(reader, start=2):
-            total += 1
-            original_len = len(row)
-
-            # Fix 1: if row has extra columns but they are ALL empty (common trailing commas)
-            if original_len > expected:
-                extras = row[expected:]
-                if all((c is None) or (str(c).strip() == "") for c in extras):
-                    row = row[:expected]
-                    fixed_trailing_empty_extra += 1
-                else:
-                    bad += 1
-                    if len(examples) < max_examples:
-                        examples.append((line_no, original_len, expected, row[:expected], row[expected:]))
-                    continue
-
-            # Fix 2: if row is short, pad with empty strings
-            if len(row) < expected:
-                row = row + [""] * (expected - len(row))
-                fixed_short += 1
-
-            # Final check (should match)
-            if len(row) != expected:
+BOM = b"\xef\xbb\xbf"
+CHUNK_BYTES = 16 * 1024 * 1024
+# rows a worker holds at once: values are counted per block of rows
+BLOCK_ROWS = 10_000
+MAPPING_PATH = "config/mapping_karamad.yml"
+# 4096 registers: ~1.6% standard error on distinct counts
+HLL_BITS = 12
+
+# plain numbers parse_numeric() accepts without trying Decimal()
+_PLAIN_NUMBER_RE = re.compile(r"-?[0-9][0-9,]*(\.[0-9]+)?")
+
+
+# =========================
+# Value checks (cached per process: columns repeat values a lot)
+# =========================
+@lru_cache(maxsize=1 << 16)
+def is_numeric(value: str) -> bool:
+    return bool(_PLAIN_NUMBER_RE.fullmatch(value)) or parse_numeric(value) is not None
+
+
+@lru_cache(maxsize=1 << 16)
+def is_jalali_date(value: str) -> bool:
+    return value.count("/") == 2 and jalali_to_gregorian(value) is not None
+
+
+def hll_slot(value: str) -> tuple[int, int]:
+    """
+    (register, rank) of a value in a DistinctSketch.
+    """
+    x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+    rest = x & ((1 << (64 - HLL_BITS)) - 1)
+    return x >> (64 - HLL_BITS), (64 - HLL_BITS) - rest.bit_length() + 1
+
+
+@lru_cache(maxsize=1 << 16)
+def value_facts(value: str) -> tuple[int, bool, bool, int, int] | None:
+    """
+    (width, numeric?, Jalali date?, HLL register, HLL rank) of a raw
+    value, or None when it is empty.
+    """
+    # normalization strips values before parsing them
+    v = value.strip()
+    if not v:
+        return None
+    return (len(v), is_numeric(v), is_jalali_date(v)) + hll_slot(v)
+
+
+class DistinctSketch:
+    """
+    HyperLogLog distinct-count estimate; sketches of chunks merge by
+    taking the register-wise max.
+    """
+
+    def __init__(self, registers: bytes | None = None):
+        self.registers = bytearray(registers or bytes(1 << HLL_BITS))
+
+    def add(self, value: str) -> None:
+        i, rank = hll_slot(value)
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other: "DistinctSketch") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range: linear counting
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+# =========================
+# Chunking
+# =========================
+def _next_row_start(mm: mmap.mmap, pos: int, in_quotes: bool) -> int:
+    """
+    First offset >= pos that starts a row, given whether pos is inside a
+    quoted field. Escaped quotes ("") come in pairs, so quote parity is
+    enough to tell.
+    """
+    while True:
+        nl = mm.find(b"\n", pos)
+        if nl == -1:
+            return len(mm)
+        in_quotes ^= mm[pos:nl].count(b'"') % 2 == 1
+        if not in_quotes:
+            return nl + 1
+        pos = nl + 1
+
+
+def _count_quotes(path: str, start: int, end: int) -> int:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[start:end].count(b'"')
+
+
+def split_rows(path: Path, pool: ProcessPoolExecutor, chunk_bytes: int = CHUNK_BYTES) -> list[tuple[int, int]]:
+    """
+    Byte ranges [(start, end), ...] of chunks of whole rows after the header.
+    """
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        data_start = _next_row_start(mm, 3 if mm[:3] == BOM else 0, False)
+        if data_start >= size:
+            return []
+
+        # cut at fixed offsets, count quotes per piece in parallel, then
+        # move each cut forward to the next row start
+        cuts = list(range(data_start, size, chunk_bytes))[1:]
+        pieces = list(zip([data_start] + cuts, cuts + [size]))
+        quotes = list(pool.map(_count_quotes, [str(path)] * len(pieces), *zip(*pieces)))
+
+        bounds = [data_start]
+        seen = 0
+        for cut, q in zip(cuts, quotes):
+            # quotes in [data_start, cut): odd means cut is inside a field
+            seen += q
+            # a long quoted field may have carried the previous cut past this one
+            if cut > bounds[-1]:
+                bounds.append(_next_row_start(mm, cut, seen % 2 == 1))
+        bounds.append(size)
+
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+# =========================
+# Chunk profiling (worker processes)
+# =========================
+def _iter_lines(path: str, start: int, end: int):
+    """
+    Decoded lines of the byte range [start, end), which starts and ends on
+    row boundaries (a quoted field may span lines; csv.reader joins them).
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            yield line.decode("utf-8")
+            pos += len(line)
+            if pos >= end:
+                return
+
+
+def _count_block(block: list[list[str]], columns: list[dict]) -> None:
+    """
+    Add the values of a block of rows to the per-column counters.
+    """
+    for col, values in zip(columns, zip(*block)):
+        nulls = numeric = dates = 0
+        width = col["max_width"]
+        registers = col["sketch"].registers
+        for value, count in Counter(values).items():
+            facts = value_facts(value)
+            if facts is None:
+                nulls += count
+                continue
+            w, is_num, is_date, i, rank = facts
+            if w > width:
+                width = w
+            if is_num:
+                numeric += count
+            if is_date:
+                dates += count
+            if rank > registers[i]:
+                registers[i] = rank
+        col["nulls"] += nulls
+        col["numeric"] += numeric
+        col["dates"] += dates
+        col["max_width"] = width
+
+
+def profile_chunk(path: str, start: int, end: int, expected: int, max_examples: int) -> dict:
+    columns = [{"nulls": 0, "numeric": 0, "dates": 0, "max_width": 0, "sketch": DistinctSketch()}
+               for _ in range(expected)]
+    block = []
+    profiled = 0
+    fixed_short = 0
+    fixed_trailing_empty_extra = 0
+    bad = 0
+    examples = []
+    for n, row in enumerate(csv.reader(_iter_lines(path, start, end)), start=1):
+        original_len = len(row)
+
+        # extra columns that are all empty (trailing commas) are trimmed
+        if original_len > expected:
+            if all(c.strip() == "" for c in row[expected:]):
+                row = row[:expected]
+                fixed_trailing_empty_extra += 1
+            else:
                 bad += 1
                 if len(examples) < max_examples:
-                    examples.append((line_no, original_len, expected, row, []))
+                    examples.append({"row": n, "columns": original_len,
+                                     "extras": [c for c in row[expected:] if c.strip()][:10]})
+                continue
+
+        # short rows are padded with empty strings
+        if original_len < expected:
+            row = row + [""] * (expected - original_len)
+            fixed_short += 1
+
+        block.append(row)
+        if len(block) == BLOCK_ROWS:
+            _count_block(block, columns)
+            profiled += len(block)
+            block = []
+    _count_block(block, columns)
+    profiled += len(block)
+
+    for col in columns:
+        col["sketch"] = bytes(col["sketch"].registers)
+
+    return {
+        "rows": profiled + bad,
+        "profiled": profiled,
+        "fixed_short": fixed_short,
+        "fixed_trailing_empty_extra": fixed_trailing_empty_extra,
+        "bad": bad,
+        "examples": examples,
+        "columns": columns,
+    }
+
+
+def _load_mapping(path: str = MAPPING_PATH) -> dict:
+    try:
+        import yaml
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except (ImportError, OSError):
+        return {}
+
+
+def _share(n: int, total: int) -> float | None:
+    return round(n / total, 6) if total else None
+
+
+def profile(file_path: Path, workers: int | None = None, max_examples: int = 5,
+            chunk_bytes: int = CHUNK_BYTES) -> dict:
+    """
+    Profile one CSV file; returns the JSON-ready profile.
+
+    Shares of numeric / date values are over non-empty values; the null
+    rate is over profiled rows (rows with a bad shape are not profiled).
+    """
+    started = time.perf_counter()
+    with file_path.open("r", encoding="utf-8-sig", newline="") as f:
+        header = next(csv.reader(f), None)
+    if header is None:
+        return {"file": file_path.name, "bytes": file_path.stat().st_size, "error": "empty file (no header)"}
+    expected = len(header)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        ranges = split_rows(file_path, pool, chunk_bytes)
+        parts = list(pool.map(
+            profile_chunk,
+            [str(file_path)] * len(ranges),
+            [a for a, _ in ranges],
+            [b for _, b in ranges],
+            [expected] * len(ranges),
+            [max_examples] * len(ranges),
+        ))
+
+    result = {
+        "file": file_path.name,
+        "bytes": file_path.stat().st_size,
+        "chunks": len(parts),
+        "header_columns": expected,
+        "rows": 0,
+        "fixed_short": 0,
+        "fixed_trailing_empty_extra": 0,
+        "bad_rows": 0,
+        "bad_row_examples": [],
+    }
+    merged = [{"nulls": 0, "numeric": 0, "dates": 0, "max_width": 0, "sketch": DistinctSketch()}
+              for _ in range(expected)]
+    profiled = 0
+    for part in parts:
+        for ex in part["examples"]:
+            if len(result["bad_row_examples"]) < max_examples:
+                # chunk-relative -> data row number in the file
+                result["bad_row_examples"].append({**ex, "row": ex["row"] + result["rows"]})
+        result["rows"] += part["rows"]
+        profiled += part["profiled"]
+        for key in ("fixed_short", "fixed_trailing_empty_extra"):
+            result[key] += part[key]
+        result["bad_rows"] += part["bad"]
+        for total, col in zip(merged, part["columns"]):
+            for key in ("nulls", "numeric", "dates"):
+                total[key] += col[key]
+            total["max_width"] = max(total["max_width"], col["max_width"])
+            total["sketch"].merge(DistinctSketch(col["sketch"]))
+
+    mapping = _load_mapping()
+    result["columns"] = []
+    for i, (name, total) in enumerate(zip(header, merged), start=1):
+        column = f"c{i:02d}"
+        non_null = profiled - total["nulls"]
+        entry = {
+            "column": column,
+            "header": name,
+            "null_rate": _share(total["nulls"], profiled),
+            "numeric_share": _share(total["numeric"], non_null),
+            "jalali_date_share": _share(total["dates"], non_null),
+            "distinct_estimate": total["sketch"].estimate(),
+            "max_width": total["max_width"],
+        }
+        if column in mapping:
+            entry.update({k: mapping[column].get(k) for k in ("target", "type", "required")})
+        result["columns"].append(entry)
+
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _pct(share: float | None) -> str:
+    return "-" if share is None else f"{share * 100:.1f}%"
+
+
+def inspect(file_path: Path, max_examples: int = 5, workers: int | None = None,
+            json_path: str | None = None) -> int:
+    result = profile(file_path, workers=workers, max_examples=max_examples)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if "error" in result:
+        print(f"ERROR: {result['error']}.")
+        return 2
+
+    print(f"File: {result['file']} ({result['bytes'] / 1e6:.1f} MB, {result['chunks']} chunks, {result['seconds']} s)")
+    print(f"Header columns: {result['header_columns']}")
+    print(f"Data rows: {result['rows']}")
+    print(f"Fixed short rows (padded): {result['fixed_short']}")
+    print(f"Fixed trailing-empty extra cols (trimmed): {result['fixed_trailing_empty_extra']}")
+    print(f"Bad rows (not auto-fixable): {result['bad_rows']}")
+
+    if result["bad_row_examples"]:
+        print("\nExamples of bad rows (first few):")
+        for ex in result["bad_row_examples"]:
+            print(f"- Row {ex['row']}: had {ex['columns']} cols, expected {result['header_columns']}. "
+                  f"Extras (non-empty): {ex['extras']}")
 
-        print(f"File: {file_path.name}")
-        print(f"Header columns: {expected}")
-        print(f"Data rows: {total}")
-        print(f"Fixed short rows (padded): {fixed_short}")
-        print(f"Fixed trailing-empty extra cols (trimmed): {fixed_trailing_empty_extra}")
-        print(f"Bad rows (not auto-fixable): {bad}")
+    print(f"\n{'column':<7} {'target':<22} {'null':>7} {'numeric':>8} {'date':>7} {'distinct':>10} {'width':>6}")
+    for c in result["columns"]:
+        target = f"{c['target']} ({c['type']})" if c.get("target") else ""
+        print(f"{c['column']:<7} {target:<22} {_pct(c['null_rate']):>7} {_pct(c['numeric_share']):>8} "
+              f"{_pct(c['jalali_date_share']):>7} {c['distinct_estimate']:>10} {c['max_width']:>6}")
 
-        if examples:
-            print("\nExamples of bad rows (first few):")
-            for ex in examples:
-                line_no, orig_len, exp, left, extras = ex
-                print(f"- Line {line_no}: had {orig_len} cols, expected {exp}. Extras (non-empty): {extras[:10]}")
+    # what normalization will reject: empty required columns, unparsable numerics
+    for c in result["columns"]:
+        if c.get("required") and c["null_rate"]:
+            print(f"WARNING: {c['column']} ({c['target']}) is required but {_pct(c['null_rate'])} empty")
+        if c.get("type") == "numeric" and c["numeric_share"] is not None and c["numeric_share"] < 1:
+            print(f"WARNING: {c['column']} ({c['target']}) has {_pct(1 - c['numeric_share'])} non-numeric values")
 
-        return 0 if bad == 0 else 1
+    return 0 if result["bad_rows"] == 0 else 1
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--file", required=True)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="profiling processes")
+    ap.add_argument("--json", help="also write the profile to this file")
     args = ap.parse_args()
-    raise SystemExit(inspect(Path(args.file)))
+    raise SystemExit(inspect(Path(args.file), workers=args.workers, json_path=args.json))
 
 
 if __name__ == "__main__":
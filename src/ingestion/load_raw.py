@@ -3,21 +3,42 @@ from __future__ import annotations
 
 import argparse
 import csv
+import glob
 import hashlib
+import io
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Iterator
 #from typing import List
 
 import psycopg2
 from psycopg2.extras import execute_values
 
+from src.common.telemetry import CountingConnection, RunMetrics
+from src.transform.partitions import ensure_raw_partition
+
 EXPECTED_COLS = 61
+SOURCE_SYSTEM = "karamad"
+BOM = b"\xef\xbb\xbf"
+# held shared by every chunk transaction that writes RAW, until it commits;
+# normalize takes it exclusively to read a raw_id ceiling (committed_raw_ceiling)
+RAW_WRITE_LOCK = "raw_karamad_write"
+
+# columns written by the loader: source_file, load_batch_id, row_hash, c01..c61
+RAW_COLUMNS = ["source_file", "load_batch_id", "row_hash"] + [f"c{i:02d}" for i in range(1, EXPECTED_COLS + 1)]
+
+
+class LoadError(Exception):
+    """Raised when a CSV file does not satisfy the RAW contract."""
 
-# Compute a hash for a row of values
-def row_hash(values: list[str]) -> str:
+
+# Compute a hash for a row of values (32-byte SHA-256 digest, stored as bytea)
+def row_hash(values: list[str]) -> bytes:
     # minimal normalization: strip spaces, keep content as-is
     payload = "\x1f".join([(v or "").strip() for v in values])
-    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return hashlib.sha256(payload.encode("utf-8")).digest()
 
 # Connect to the Postgres database
 def connect():
@@ -27,84 +48,393 @@ def connect():
         dbname=os.getenv("DB_NAME", "sales_engine"),
         user=os.getenv("DB_USER", "postgres"),
         password=os.getenv("DB_PASSWORD", "postgres"),
+        connection_factory=CountingConnection,
     )
 
-# Main function
-def main():
-    # Parse arguments
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--file", required=True)
-    ap.add_argument("--batch-id", required=True)
-    ap.add_argument("--chunk-size", type=int, default=2000)
-    args = ap.parse_args()
+# Stream validated rows from a CSV file (never holds the whole file).
+# The file is read as bytes, so `offset` (the byte after the last row
+# yielded) can be checkpointed and `start` resumes from it; `rows` counts
+# data rows, including those before `start`.
+class CsvRows:
+    def __init__(self, file_path: Path, start: int = 0, rows: int = 0):
+        self.file_path = file_path
+        self.start = start
+        self.offset = start
+        self.rows = rows
 
-    # Validate file path
-    file_path = Path(args.file)
-    if not file_path.exists():
-        raise SystemExit(f"File not found: {file_path}")
+    def _lines(self, f) -> Iterator[str]:
+        # csv.reader pulls lines lazily, so after it yields a row `offset`
+        # is the end of that row (quoted newlines included)
+        for line in f:
+            self.offset += len(line)
+            yield line.decode("utf-8")
 
-    # Get source file name
-    source_file = file_path.name
+    def __iter__(self) -> Iterator[list[str]]:
+        with self.file_path.open("rb") as f:
+            if f.read(len(BOM)) != BOM:
+                f.seek(0)
+            self.offset = f.tell()
+            reader = csv.reader(self._lines(f))
+            header = next(reader, None)
+            if header is None:
+                raise LoadError("CSV is empty (no header).")
+            if len(header) != EXPECTED_COLS:
+                raise LoadError(f"Header has {len(header)} columns, expected {EXPECTED_COLS}.")
 
-    # Read rows from CSV
-    rows: list[list[str]] = []
-    with file_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        header = next(reader, None)
-        if header is None:
-            raise SystemExit("CSV is empty (no header).")
-        if len(header) != EXPECTED_COLS:
-            raise SystemExit(f"Header has {len(header)} columns, expected {EXPECTED_COLS}.")
-
-        for line_no, r in enumerate(reader, start=2):
-            if len(r) != EXPECTED_COLS:
-                raise SystemExit(f"Row {line_no} has {len(r)} columns, expected {EXPECTED_COLS}.")
-            rows.append(r)
-
-    if not rows:
-        print("No data rows found.")
-        return
+            if self.start > self.offset:
+                f.seek(self.start)
+                self.offset = self.start
+                reader = csv.reader(self._lines(f))
+            else:
+                self.rows = 0
+
+            for r in reader:
+                self.rows += 1
+                if len(r) != EXPECTED_COLS:
+                    # data row n is line n + 1 unless fields span lines
+                    raise LoadError(f"Row {self.rows + 1} has {len(r)} columns, expected {EXPECTED_COLS}.")
+                yield r
 
-    # Prepare insert payload
-    # columns: source_file, load_batch_id, row_hash, c01..c61
-    payload = []
+# Drop rows whose hash is already in raw_karamad_row_keys (one bulk lookup
+# per chunk), so duplicates of earlier loads are never sent. The merge still
+# claims keys with ON CONFLICT, which covers concurrent loads.
+def drop_known(cur, chunk: list[list[str]], hashes: list[bytes], metrics: RunMetrics) -> tuple[list, list]:
+    with metrics.stage("prefilter", rows=len(chunk)):
+        cur.execute(
+            "select row_hash from raw_karamad_row_keys where source_system = %s and row_hash = any(%s)",
+            (SOURCE_SYSTEM, list(set(hashes))),
+        )
+        known = {bytes(h) for (h,) in cur.fetchall()}
+    if not known:
+        return chunk, hashes
+    kept = [(r, h) for r, h in zip(chunk, hashes) if h not in known]
+    return [r for r, _ in kept], [h for _, h in kept]
+
+# Group rows into lists of at most `size` rows
+def iter_chunks(rows: Iterator[list[str]], size: int) -> Iterator[list[list[str]]]:
+    chunk: list[list[str]] = []
     for r in rows:
-        payload.append([source_file, args.batch_id, row_hash(r)] + r)
+        chunk.append(r)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-    cols = ["source_file", "load_batch_id", "row_hash"] + [f"c{i:02d}" for i in range(1, EXPECTED_COLS + 1)]
+# VALUES path: one multi-row INSERT per chunk
+def insert_values(cur, source_file: str, batch_id: str, chunk: list[list[str]], hashes: list[bytes],
+                  metrics: RunMetrics) -> int:
+    cols = ", ".join(RAW_COLUMNS)
+    # rows whose hash is new claim it in raw_karamad_row_keys first
     sql = f"""
-        insert into raw_karamad_sales ({", ".join(cols)})
-        values %s
-        on conflict (source_system, row_hash) do nothing;
+        with v ({cols}) as (values %s),
+        new_keys as (
+            insert into raw_karamad_row_keys (source_system, row_hash)
+            select distinct '{SOURCE_SYSTEM}', row_hash from v
+            on conflict do nothing
+            returning row_hash
+        )
+        insert into raw_karamad_sales ({cols})
+        select distinct on (v.row_hash) v.*
+        from v
+        join new_keys k on k.row_hash = v.row_hash
+        returning 1;
     """
+    payload = [[source_file, batch_id, h] + r for h, r in zip(hashes, chunk)]
+    with metrics.stage("insert", rows=len(payload)):
+        return len(execute_values(cur, sql, payload, page_size=len(payload), fetch=True))
+
+# COPY path: a temp staging table, emptied at every commit
+def create_stage_table(cur, metrics: RunMetrics) -> None:
+    with metrics.stage("stage_table"):
+        cur.execute(f"""
+            create temp table if not exists raw_karamad_stage on commit delete rows as
+            select {", ".join(RAW_COLUMNS)} from raw_karamad_sales with no data;
+        """)
+
+# COPY path: stream one chunk into the staging table, then merge it
+def insert_copy(cur, source_file: str, batch_id: str, chunk: list[list[str]], hashes: list[bytes],
+                metrics: RunMetrics) -> int:
+    cols = ", ".join(RAW_COLUMNS)
+    with metrics.stage("copy", rows=len(chunk)):
+        buf = io.StringIO()
+        # QUOTE_ALL keeps empty strings as '' (unquoted empty would be NULL);
+        # bytea goes in its hex text form
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        for h, r in zip(hashes, chunk):
+            writer.writerow([source_file, batch_id, "\\x" + h.hex()] + r)
+        buf.seek(0)
+        cur.copy_expert(f"copy raw_karamad_stage ({cols}) from stdin with (format csv)", buf)
+
+    # claim new hashes in raw_karamad_row_keys, then insert the first
+    # occurrence of each in file order
+    with metrics.stage("merge", rows=len(chunk)):
+        cur.execute(f"""
+            with new_keys as (
+                insert into raw_karamad_row_keys (source_system, row_hash)
+                select distinct %s, row_hash from raw_karamad_stage
+                on conflict do nothing
+                returning row_hash
+            )
+            insert into raw_karamad_sales ({cols})
+            select {cols}
+            from (
+                select distinct on (s.row_hash) s.*, s.ctid as pos
+                from raw_karamad_stage s
+                join new_keys k on k.row_hash = s.row_hash
+                order by s.row_hash, s.ctid
+            ) first_seen
+            order by pos;
+        """, (SOURCE_SYSTEM,))
+    return cur.rowcount
+
+# Checkpoint of one (source_file, load_batch_id) load; returns
+# (byte offset, rows read, rows inserted, status) to continue from
+def start_checkpoint(cur, source_file: str, batch_id: str, file_bytes: int, resume: bool) -> tuple[int, int, int, str]:
+    if resume:
+        cur.execute(
+            """
+            select file_bytes, byte_offset, rows_read, rows_inserted, status
+            from raw_load_checkpoints
+            where source_file = %s and load_batch_id = %s
+            """,
+            (source_file, batch_id),
+        )
+        row = cur.fetchone()
+        if row is not None:
+            if row[0] != file_bytes:
+                raise LoadError(
+                    f"{source_file} is {file_bytes} bytes but was {row[0]} when its checkpoint was taken; "
+                    "load it again without --resume."
+                )
+            return row[1], row[2], row[3], row[4]
+
+    cur.execute(
+        """
+        insert into raw_load_checkpoints (source_system, source_file, load_batch_id, file_bytes)
+        values (%s, %s, %s, %s)
+        on conflict (source_file, load_batch_id) do update
+        set file_bytes = excluded.file_bytes,
+            byte_offset = 0,
+            rows_read = 0,
+            rows_inserted = 0,
+            status = 'running',
+            started_at = now(),
+            updated_at = now(),
+            finished_at = null
+        """,
+        (SOURCE_SYSTEM, source_file, batch_id, file_bytes),
+    )
+    return 0, 0, 0, "running"
+
+# Record progress; committed together with the chunk it describes
+def save_checkpoint(cur, source_file: str, batch_id: str, byte_offset: int, rows_read: int,
+                    rows_inserted: int, done: bool = False) -> None:
+    cur.execute(
+        """
+        update raw_load_checkpoints
+        set byte_offset = %s,
+            rows_read = %s,
+            rows_inserted = %s,
+            status = case when %s then 'done' else 'running' end,
+            updated_at = now(),
+            finished_at = case when %s then now() end
+        where source_file = %s and load_batch_id = %s
+        """,
+        (byte_offset, rows_read, rows_inserted, done, done, source_file, batch_id),
+    )
+
+# Load one file; every chunk commits on its own with the checkpoint, so a
+# failed load can continue from the last committed chunk (resume=True).
+# Returns a summary dict of this attempt.
+def load_file(file_path: Path, batch_id: str, mode: str = "copy", chunk_size: int = 10000,
+              prefilter: bool = True, resume: bool = False) -> dict:
+    if not file_path.exists():
+        raise LoadError(f"File not found: {file_path}")
+
+    insert_chunk = insert_copy if mode == "copy" else insert_values
+    source_file = file_path.name
+    file_bytes = file_path.stat().st_size
+    metrics = RunMetrics()
 
+    rows_read = 0
+    inserted = 0
     conn = connect()
     try:
-
+        ensure_raw_partition(conn)
         with conn:
             with conn.cursor() as cur:
-                for start in range(0, len(payload), args.chunk_size):
-                    chunk = payload[start : start + args.chunk_size]
-                    execute_values(cur, sql, chunk, page_size=len(chunk))
+                # one loader per file and batch at a time (released on close)
+                cur.execute("select pg_try_advisory_lock(hashtext(%s), hashtext(%s))", (source_file, batch_id))
+                if not cur.fetchone()[0]:
+                    raise LoadError(f"{source_file} ({batch_id}) is being loaded by another process.")
+                offset, rows_before, inserted_before, status = start_checkpoint(
+                    cur, source_file, batch_id, file_bytes, resume
+                )
+
+        if status != "done":
+            started = time.perf_counter()
+            reader = CsvRows(file_path, start=offset, rows=rows_before)
+            with conn.cursor() as cur:
+                if mode == "copy":
+                    create_stage_table(cur, metrics)
+                for chunk in metrics.timed("parse", iter_chunks(reader, chunk_size)):
+                    with metrics.stage("hash", rows=len(chunk)):
+                        hashes = [row_hash(r) for r in chunk]
+                    rows_read += len(chunk)
+                    if prefilter:
+                        chunk, hashes = drop_known(cur, chunk, hashes, metrics)
+                    if chunk:
+                        with metrics.stage("write_lock"):
+                            cur.execute("select pg_advisory_xact_lock_shared(hashtext(%s))", (RAW_WRITE_LOCK,))
+                        inserted += insert_chunk(cur, source_file, batch_id, chunk, hashes, metrics)
+                    with metrics.stage("checkpoint"):
+                        save_checkpoint(cur, source_file, batch_id, reader.offset, reader.rows,
+                                        inserted_before + inserted)
+                        conn.commit()
 
-                cur.execute(
-                    "select count(*) from raw_karamad_sales where load_batch_id=%s and source_file=%s",
-                    (args.batch_id, source_file),
+                nbytes = metrics["parse"].bytes = file_bytes - offset
+                metrics.finish(started, rows_read, nbytes)
+                save_checkpoint(cur, source_file, batch_id, reader.offset, reader.rows,
+                                inserted_before + inserted, done=True)
+                # committed with the checkpoint that closes the load
+                metrics.write(
+                    cur,
+                    pipeline="load_raw",
+                    source_system=SOURCE_SYSTEM,
+                    source_file=source_file,
+                    load_batch_id=batch_id,
                 )
-                
-                row = cur.fetchone()
-                if row is None:
-                    raise SystemExit("Unexpected: SELECT count(*) returned no row")
-                inserted = row[0]
-
-        print(f"File: {source_file}")
-        print(f"Rows read: {len(rows)}")
-        print(f"Rows present in RAW for this batch/file: {inserted}")
-        if inserted < len(rows):
-            print(f"Skipped as duplicates: {len(rows) - inserted}")
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
+    return {
+        "source_file": source_file,
+        "load_batch_id": batch_id,
+        "rows_read": rows_read,
+        "inserted": inserted,
+        "skipped": rows_read - inserted,
+        "resumed_at_row": rows_before if offset else None,
+        "already_done": status == "done",
+        "metrics": metrics,
+    }
+
+# Batch id for one file of a multi-file load
+def batch_id_for(file_path: Path, prefix: str | None) -> str:
+    return f"{prefix}_{file_path.stem}" if prefix else file_path.stem
+
+# Process-pool entry point: never raises, so one bad file cannot stop the rest
+def _load_file_task(file_path: Path, batch_id: str, mode: str, chunk_size: int, prefilter: bool,
+                    resume: bool) -> dict:
+    try:
+        return load_file(file_path, batch_id, mode=mode, chunk_size=chunk_size, prefilter=prefilter,
+                         resume=resume)
+    except Exception as e:
+        return {"source_file": file_path.name, "load_batch_id": batch_id, "error": f"{type(e).__name__}: {e}"}
+
+# Load many files in parallel; each worker process hashes its own file and
+# uses its own DB connection
+def load_files(files: list[Path], batch_prefix: str | None, mode: str, chunk_size: int, workers: int,
+               prefilter: bool = True, resume: bool = False) -> list[dict]:
+    results: dict[Path, dict] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_load_file_task, f, batch_id_for(f, batch_prefix), mode, chunk_size, prefilter, resume): f
+            for f in files
+        }
+        for fut in as_completed(futures):
+            f = futures[fut]
+            results[f] = fut.result()
+            if "error" in results[f]:
+                status = results[f]["error"]
+            elif results[f]["already_done"]:
+                status = "already loaded (checkpoint)"
+            else:
+                status = f"{results[f]['inserted']} inserted"
+            print(f"  done {f.name}: {status}", flush=True)
+    return [results[f] for f in files]
+
+def print_summary(results: list[dict]) -> None:
+    print(f"{'file':<40} {'batch':<30} {'read':>10} {'inserted':>10} {'skipped':>10}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['source_file']:<40} {r['load_batch_id']:<30} FAILED: {r['error']}")
+        else:
+            print(f"{r['source_file']:<40} {r['load_batch_id']:<30} {r['rows_read']:>10} {r['inserted']:>10} {r['skipped']:>10}")
+
+    ok = [r for r in results if "error" not in r]
+    print(
+        f"Files: {len(results)} (failed: {len(results) - len(ok)}) | "
+        f"rows read: {sum(r['rows_read'] for r in ok)} | "
+        f"inserted: {sum(r['inserted'] for r in ok)} | "
+        f"skipped: {sum(r['skipped'] for r in ok)}"
+    )
+
+# Main function
+def main():
+    # Parse arguments
+    ap = argparse.ArgumentParser()
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--file")
+    src.add_argument("--dir", help="load every *.csv file in this directory")
+    src.add_argument("--glob", help="load every file matching this pattern, e.g. 'data/karamad/14*.csv'")
+    ap.add_argument("--batch-id", help="batch id (--file), or batch id prefix (--dir/--glob; default: file stem)")
+    ap.add_argument("--chunk-size", type=int, default=10000)
+    ap.add_argument("--mode", choices=["copy", "values"], default="copy",
+                    help="copy: COPY into a staging table (default); values: multi-row INSERTs")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="parallel worker processes for --dir/--glob")
+    ap.add_argument("--no-prefilter", action="store_true",
+                    help="send every row and let the merge drop duplicates (skips the per-chunk hash lookup)")
+    ap.add_argument("--resume", action="store_true",
+                    help="continue each file from its last committed chunk (raw_load_checkpoints)")
+    args = ap.parse_args()
+
+    if not args.file:
+        if args.dir:
+            files = sorted(Path(args.dir).glob("*.csv"))
+        else:
+            files = sorted(Path(p) for p in glob.glob(args.glob))
+        if not files:
+            raise SystemExit("No CSV files matched.")
+
+        results = load_files(files, args.batch_id, args.mode, args.chunk_size, args.workers,
+                             prefilter=not args.no_prefilter, resume=args.resume)
+        print_summary(results)
+        if any("error" in r for r in results):
+            raise SystemExit(1)
+        return
+
+    if not args.batch_id:
+        ap.error("--batch-id is required with --file")
+
+    try:
+        summary = load_file(Path(args.file), args.batch_id, mode=args.mode, chunk_size=args.chunk_size,
+                            prefilter=not args.no_prefilter, resume=args.resume)
+    except LoadError as e:
+        raise SystemExit(str(e))
+
+    if summary["already_done"]:
+        print(f"{summary['source_file']} ({summary['load_batch_id']}) is already loaded (checkpoint).")
+        return
+    if summary["resumed_at_row"] is not None:
+        print(f"Resumed after row {summary['resumed_at_row']}")
+    if summary["rows_read"] == 0:
+        print("No data rows found.")
+        return
+
+    print(f"File: {summary['source_file']}")
+    print(f"Rows read: {summary['rows_read']}")
+    print(f"Rows inserted into RAW: {summary['inserted']}")
+    if summary["skipped"]:
+        print(f"Skipped as duplicates: {summary['skipped']}")
+    print("Stages:")
+    print(summary["metrics"].summary())
+
 
 if __name__ == "__main__":
     main()
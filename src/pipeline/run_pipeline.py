@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Load -> normalize -> KPI refresh as one overlapped pipeline.
+
+A loader thread feeds files to load_raw in its own process and queues each
+loaded batch; the normalizer (another process) takes everything queued so
+far and runs one incremental normalize(), which also refreshes the KPI
+days those rows touched. So batch N is normalized while batch N+1 loads,
+and KPIs are fresh after every batch, not after the whole backlog. The
+queue is bounded: when normalization falls behind, loading waits.
+
+There is a single loader; normalize never reads past raw_ids that a load
+(this one or a separate load_raw) has not committed yet
+(committed_raw_ceiling), so other loaders may run alongside.
+
+With --watch, new files in the directory are picked up as they arrive
+(once their size stops changing). Loads run with resume, so a restart
+continues interrupted files and skips finished ones.
+"""
+from __future__ import annotations
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from src.ingestion.load_raw import batch_id_for, load_file
+from src.transform.normalize_karamad import DEFAULT_BATCH_SIZE, normalize
+
+_STOP = object()
+
+
+class FileWatcher:
+    """
+    New CSV files of a directory; a file is reported once its size is the
+    same on two polls in a row (a file still being copied is not).
+    """
+
+    def __init__(self, directory: Path, pattern: str = "*.csv"):
+        self.directory = directory
+        self.pattern = pattern
+        self.sizes: dict[Path, int] = {}
+        self.seen: set[Path] = set()
+
+    def poll(self) -> list[Path]:
+        ready = []
+        for path in sorted(self.directory.glob(self.pattern)):
+            if path in self.seen:
+                continue
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            if self.sizes.get(path) == size:
+                ready.append(path)
+                self.seen.add(path)
+                del self.sizes[path]
+            else:
+                self.sizes[path] = size
+        return ready
+
+
+def iter_files(directory: Path, watch: bool, poll_seconds: float, stop: threading.Event) -> Iterator[Path]:
+    if not watch:
+        yield from sorted(directory.glob("*.csv"))
+        return
+    watcher = FileWatcher(directory)
+    while not stop.is_set():
+        yield from watcher.poll()
+        stop.wait(poll_seconds)
+
+
+def produce(files: Iterator[Path], load_pool: ProcessPoolExecutor, loaded: queue.Queue, stop: threading.Event,
+            batch_prefix: str | None, mode: str, chunk_size: int) -> None:
+    """
+    Loader thread: load each file in the loader process, then queue it
+    (blocks while the queue is full). Ends the queue with _STOP.
+    """
+    try:
+        for path in files:
+            if stop.is_set():
+                break
+            started = time.monotonic()
+            batch_id = batch_id_for(path, batch_prefix)
+            try:
+                summary = load_pool.submit(
+                    load_file, path, batch_id, mode=mode, chunk_size=chunk_size, resume=True
+                ).result()
+            except Exception as e:
+                print(f"[load] {path.name}: FAILED {type(e).__name__}: {e}", flush=True)
+                continue
+
+            if summary["already_done"]:
+                print(f"[load] {path.name}: already loaded (checkpoint)", flush=True)
+                continue
+            print(
+                f"[load] {path.name}: {summary['inserted']} of {summary['rows_read']} rows inserted "
+                f"in {time.monotonic() - started:.1f} s",
+                flush=True,
+            )
+            loaded.put((path.name, batch_id, started))
+    finally:
+        loaded.put(_STOP)
+
+
+def run_normalize(norm_pool: ProcessPoolExecutor, engine: str, batch_size: int) -> dict | None:
+    return norm_pool.submit(normalize, batch_size=batch_size, engine=engine, refresh=True).result()
+
+
+def run_pipeline(directory: Path, watch: bool = False, poll_seconds: float = 10.0, queue_size: int = 2,
+                 batch_prefix: str | None = None, mode: str = "copy", chunk_size: int = 10000,
+                 engine: str = "row", batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+    stop = threading.Event()
+    loaded: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    with ProcessPoolExecutor(max_workers=1) as load_pool, ProcessPoolExecutor(max_workers=1) as norm_pool:
+        loader = threading.Thread(
+            target=produce,
+            args=(iter_files(directory, watch, poll_seconds, stop), load_pool, loaded, stop,
+                  batch_prefix, mode, chunk_size),
+            name="loader",
+            daemon=True,
+        )
+        loader.start()
+
+        try:
+            # RAW left behind by an earlier run, while the first file loads
+            run_normalize(norm_pool, engine, batch_size)
+
+            done = False
+            while not done:
+                items = [loaded.get()]
+                # everything queued meanwhile goes into the same normalize run
+                while True:
+                    try:
+                        items.append(loaded.get_nowait())
+                    except queue.Empty:
+                        break
+                done = _STOP in items
+                items = [i for i in items if i is not _STOP]
+                if not items:
+                    continue
+
+                summary = run_normalize(norm_pool, engine, batch_size)
+                now = time.monotonic()
+                processed = summary["processed"] if summary else 0
+                for source_file, batch_id, started in items:
+                    print(f"[kpi] {source_file} ({batch_id}): KPIs fresh {now - started:.1f} s after its load started "
+                          f"({processed} rows normalized in this run)", flush=True)
+        except KeyboardInterrupt:
+            # loads are checkpointed per chunk: the next run resumes them
+            print("Stopping; interrupted loads resume on the next run.", flush=True)
+            raise
+        finally:
+            # whatever ended the loop (done, Ctrl-C, a failed normalize), the
+            # loader must stop picking up files for pools that are shutting down
+            stop.set()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load, normalize and refresh KPIs as one overlapped pipeline.")
+    ap.add_argument("--dir", default="data/karamad", help="directory of Karamad CSV exports")
+    ap.add_argument("--watch", action="store_true", help="keep running and process files as they arrive")
+    ap.add_argument("--poll", type=float, default=10.0, help="seconds between directory polls (--watch)")
+    ap.add_argument("--queue", type=int, default=2, help="loaded batches waiting for normalization, at most")
+    ap.add_argument("--batch-id", help="batch id prefix (default: file stem)")
+    ap.add_argument("--mode", choices=["copy", "values"], default="copy")
+    ap.add_argument("--chunk-size", type=int, default=10000)
+    ap.add_argument("--engine", choices=["row", "columnar", "sql"], default="row")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = ap.parse_args()
+
+    try:
+        run_pipeline(
+            Path(args.dir),
+            watch=args.watch,
+            poll_seconds=args.poll,
+            queue_size=args.queue,
+            batch_prefix=args.batch_id,
+            mode=args.mode,
+            chunk_size=args.chunk_size,
+            engine=args.engine,
+            batch_size=args.batch_size,
+        )
+    except KeyboardInterrupt:
+        raise SystemExit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Calendar dimension (dim_date) and an in-process Jalali date lookup.
+
+The date domain of the sales data is a few thousand days, so every
+Jalali string is converted once (from dim_date, or on first sight) and
+then served from a dict.
+"""
+import argparse
+from collections import namedtuple
+
+import jdatetime
+from psycopg2.extras import execute_values
+
+DateInfo = namedtuple(
+    "DateInfo",
+    [
+        "date_gregorian",
+        "date_jalali",
+        "jalali_year",
+        "jalali_month",
+        "jalali_month_key",
+        "month_gregorian",
+        "iso_year",
+        "iso_week",
+    ],
+)
+
+
+def date_info(jdate):
+    """
+    All dim_date attributes of one jdatetime.date.
+    """
+    g = jdate.togregorian()
+    iso_year, iso_week, _ = g.isocalendar()
+    return DateInfo(
+        date_gregorian=g,
+        date_jalali=f"{jdate.year:04d}/{jdate.month:02d}/{jdate.day:02d}",
+        jalali_year=jdate.year,
+        jalali_month=jdate.month,
+        jalali_month_key=f"{jdate.year:04d}/{jdate.month:02d}",
+        month_gregorian=g.replace(day=1),
+        iso_year=iso_year,
+        iso_week=iso_week,
+    )
+
+
+def iter_dim_date(from_jalali_year, to_jalali_year):
+    """
+    DateInfo for every day of the Jalali years [from, to].
+    """
+    day = jdatetime.date(from_jalali_year, 1, 1)
+    end = jdatetime.date(to_jalali_year + 1, 1, 1)
+    while day < end:
+        yield date_info(day)
+        day += jdatetime.timedelta(days=1)
+
+
+def load_dim_date(cur, from_jalali_year, to_jalali_year):
+    """
+    Insert missing days into dim_date. Returns the number of new rows.
+    """
+    rows = list(iter_dim_date(from_jalali_year, to_jalali_year))
+    result = execute_values(
+        cur,
+        f"""
+        insert into dim_date ({", ".join(DateInfo._fields)})
+        values %s
+        on conflict (date_gregorian) do nothing
+        returning 1
+        """,
+        rows,
+        page_size=1000,
+        fetch=True,
+    )
+    return len(result)
+
+
+class DateLookup:
+    """
+    Jalali string -> DateInfo, seeded from dim_date.
+
+    Strings that are not in dim_date (unpadded, out of range, invalid) go
+    through `parse` once and the result (or None) is cached, so each
+    distinct string is converted at most once per process.
+    """
+
+    def __init__(self, parse):
+        # parse: jalali string -> datetime.date or None
+        self.parse = parse
+        self._cache = {}
+
+    def load(self, cur):
+        cur.execute(f"select {', '.join(DateInfo._fields)} from dim_date")
+        for row in cur.fetchall():
+            info = DateInfo(*row)
+            self._cache[info.date_jalali] = info
+        return len(self._cache)
+
+    def get(self, jalali_str):
+        try:
+            return self._cache[jalali_str]
+        except (KeyError, TypeError):
+            pass
+
+        g = self.parse(jalali_str)
+        info = None
+        if g is not None:
+            jdate = jdatetime.date.fromgregorian(date=g)
+            info = date_info(jdate)
+        if isinstance(jalali_str, str):
+            self._cache[jalali_str] = info
+        return info
+
+    def to_gregorian(self, jalali_str):
+        info = self.get(jalali_str)
+        return info.date_gregorian if info is not None else None
+
+
+def main():
+    from src.transform.normalize_karamad import connect
+
+    ap = argparse.ArgumentParser(description="Populate dim_date for a range of Jalali years.")
+    ap.add_argument("--from-year", type=int, default=1390)
+    ap.add_argument("--to-year", type=int, default=1410)
+    args = ap.parse_args()
+
+    with connect() as conn:
+        with conn.cursor() as cur:
+            inserted = load_dim_date(cur, args.from_year, args.to_year)
+    conn.close()
+
+    print(f"dim_date: {inserted} new days ({args.from_year}..{args.to_year})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 from typing import Optional 
+from psycopg2.extras import Json, execute_values
+
 from src.transform.dq_contract import DQSeverity, DQIssueCode
 
 def log_dq_issue(
@@ -53,3 +55,182 @@ def log_dq_issue(
             raw_value,
         ),
     )
+
+
+class DQWriter:
+    """
+    Buffered sink for dq_issues.
+
+    Same contract as log_dq_issue (severity validation, no business logic),
+    but issues are written in bulk every `flush_size` issues and counted in
+    memory, so a run summary does not need to query dq_issues again.
+    """
+
+    def __init__(self, cur, flush_size: int = 1000, metrics=None):
+        self.cur = cur
+        self.flush_size = flush_size
+        # optional RunMetrics: flushes are timed as the "dq_write" stage
+        self.metrics = metrics
+        self.error_count = 0
+        self.warning_count = 0
+        self._buffer = []
+
+    def log(
+        self,
+        *,
+        source_system: str,
+        source_file: Optional[str],
+        load_batch_id: Optional[str],
+        table_stage: str,
+        issue_code: str,
+        issue_severity: str,
+        record_business_key: Optional[str] = None,
+        column_name: Optional[str] = None,
+        raw_value: Optional[str] = None,
+        issue_description: Optional[str] = None,
+    ):
+        if issue_severity not in (DQSeverity.ERROR, DQSeverity.WARNING):
+            raise ValueError(f"Invalid issue_severity: {issue_severity}")
+
+        self._buffer.append((
+            source_system,
+            source_file,
+            load_batch_id,
+            table_stage,
+            record_business_key,
+            issue_code,
+            issue_severity,
+            issue_description,
+            column_name,
+            raw_value,
+        ))
+
+        if issue_severity == DQSeverity.ERROR:
+            self.error_count += 1
+        else:
+            self.warning_count += 1
+
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self.metrics is not None:
+            with self.metrics.stage("dq_write", rows=len(self._buffer)):
+                self._write()
+        else:
+            self._write()
+        self._buffer.clear()
+
+    def _write(self):
+        execute_values(
+            self.cur,
+            """
+            insert into dq_issues (
+                source_system,
+                source_file,
+                load_batch_id,
+                table_stage,
+                record_business_key,
+                issue_code,
+                issue_severity,
+                issue_description,
+                column_name,
+                raw_value
+            )
+            values %s
+            """,
+            self._buffer,
+            page_size=len(self._buffer),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # on error the surrounding transaction is rolled back anyway
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+# keys of a reject dict that have their own canonical_rejects column
+REJECT_KEYS = ("source_system", "row_hash", "reason", "raw_id", "source_file", "load_batch_id", "invoice_id")
+
+# shared by RejectWriter and the set-based engine (normalize_sql)
+REJECT_UPSERT_SQL = """
+    insert into canonical_rejects (
+        source_system,
+        raw_row_hash,
+        reason,
+        raw_id,
+        source_file,
+        load_batch_id,
+        invoice_id,
+        details
+    )
+    {rows}
+    on conflict (source_system, raw_row_hash, reason) do update
+    set raw_id = excluded.raw_id,
+        source_file = excluded.source_file,
+        load_batch_id = excluded.load_batch_id,
+        invoice_id = excluded.invoice_id,
+        details = excluded.details,
+        attempts = canonical_rejects.attempts + 1,
+        last_seen_at = now()
+"""
+
+
+class RejectWriter:
+    """
+    Buffered sink for canonical_rejects (migration 013).
+
+    The normalize engines append one dict per rejected row, as they did to
+    the in-memory list it replaces; rejects are upserted every
+    `flush_size` rows. A row rejected again for the same reason keeps its
+    first_seen_at and counts one more attempt.
+    """
+
+    def __init__(self, cur, flush_size: int = 1000, metrics=None):
+        self.cur = cur
+        self.flush_size = flush_size
+        # optional RunMetrics: flushes are timed as the "reject_write" stage
+        self.metrics = metrics
+        self.count = 0
+        self._buffer = []
+
+    def append(self, reject: dict):
+        details = {k: v for k, v in reject.items() if k not in REJECT_KEYS}
+        self._buffer.append((
+            reject["source_system"],
+            reject["row_hash"],
+            reject["reason"],
+            reject["raw_id"],
+            reject.get("source_file"),
+            reject.get("load_batch_id"),
+            reject.get("invoice_id"),
+            Json(details) if details else None,
+        ))
+        self.count += 1
+
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self.metrics is not None:
+            with self.metrics.stage("reject_write", rows=len(self._buffer)):
+                self._write()
+        else:
+            self._write()
+        self._buffer.clear()
+
+    def _write(self):
+        execute_values(
+            self.cur,
+            REJECT_UPSERT_SQL.format(rows="values %s"),
+            self._buffer,
+            page_size=len(self._buffer),
+        )
@@ -0,0 +1,51 @@
+"""
+Incremental refresh of the materialized KPI tables (migration 005).
+
+Only the given days / months are recomputed; the KPI definitions stay in
+the kpi_*_live views.
+"""
+import argparse
+
+
+def refresh_kpis(cur, days):
+    """
+    Recompute the daily KPIs of `days` and the monthly KPIs of their months.
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    months = sorted({d.replace(day=1) for d in days})
+
+    cur.execute("select refresh_kpi_days(%s::date[])", (days,))
+    cur.execute("select refresh_kpi_months(%s::date[])", (months,))
+
+
+def refresh_kpis_for_batches(cur, batch_ids):
+    """
+    Recompute every day / month that has canonical rows from `batch_ids`.
+    """
+    cur.execute("select refresh_kpi_for_batches(%s::text[])", (list(batch_ids),))
+
+
+def main():
+    from src.transform.normalize_karamad import connect
+
+    ap = argparse.ArgumentParser(description="Refresh the materialized KPI tables.")
+    scope = ap.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--batch-id", action="append", help="refresh what this load batch touched (repeatable)")
+    scope.add_argument("--all", action="store_true", help="rebuild every KPI table")
+    args = ap.parse_args()
+
+    with connect() as conn:
+        with conn.cursor() as cur:
+            if args.all:
+                cur.execute("select refresh_kpi_all()")
+            else:
+                refresh_kpis_for_batches(cur, args.batch_id)
+    conn.close()
+
+    print("KPI tables refreshed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Columnar (vectorized) normalization engine for Karamad RAW rows.
+
+Applies the same rules as normalize_karamad.normalize_row(), but on whole
+columns of a batch at once with pyarrow compute kernels and NumPy masks.
+The output must match the row-wise engine exactly: same canonical rows,
+same DQ issues (in the same order), same rejected rows.
+
+Values that the fast path cannot decide on its own (decimals, Persian
+digits, exponents, ...) fall back to parse_numeric() cell by cell, so the
+two engines never disagree on a value.
+"""
+from decimal import Decimal
+from operator import itemgetter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.transform.dq_contract import DQIssueCode, DQSeverity
+from src.transform.normalize_karamad import date_lookup, parse_numeric
+
+# plain ASCII integers that fit int64 and print the same as Decimal(value)
+# ('-0' and '+5' are left to parse_numeric: str(Decimal('-0')) == '-0')
+_FAST_INT_RE = r"^[ \t]*(0+|-?0*[1-9][0-9]{0,17})[ \t]*$"
+# what parse_numeric() turns into None without looking further
+_BLANK_RE = r"^[ \t]*$"
+
+(
+    _RAW_ID,
+    _SOURCE_SYSTEM,
+    _SOURCE_FILE,
+    _LOAD_BATCH_ID,
+    _ROW_HASH,
+    _SALESPERSON_ID,
+    _PRODUCT_ID,
+    _TRANSACTION_TYPE_RAW,
+    _INVOICE_ID,
+    _CUSTOMER_ID,
+    _SYSTEM_DATE_JALALI,
+    _REFERENCE_DATE_JALALI,
+    _QUANTITY,
+    _UNIT_PRICE,
+    _GROSS_AMOUNT,
+    _DISCOUNT_VOLUME,
+    _DISCOUNT_CASH,
+    _NET_AMOUNT,
+    _INGESTED_AT,
+) = range(19)
+
+
+def _mask(arr, null_value=False):
+    # arrow boolean array -> numpy bool array
+    return pc.fill_null(arr, null_value).to_numpy(zero_copy_only=False)
+
+
+class _NumericColumn:
+    """
+    A parsed numeric column: values (int or Decimal or None) plus sign masks.
+    """
+
+    def __init__(self, raw):
+        n = len(raw)
+        cleaned = pc.replace_substring(pa.array(raw, type=pa.string()), ",", "")
+        self.fast = _mask(pc.match_substring_regex(cleaned, _FAST_INT_RE))
+        self.isnull = _mask(pc.match_substring_regex(cleaned, _BLANK_RE), null_value=True)
+
+        self.ints = np.zeros(n, dtype=np.int64)
+        if self.fast.any():
+            digits = pc.utf8_trim(cleaned.filter(pa.array(self.fast)), " \t")
+            self.ints[self.fast] = pc.cast(digits, pa.int64()).to_numpy()
+
+        self.values = self.ints.astype(object)
+        self.values[self.isnull] = None
+        self.neg = self.ints < 0
+        self.pos = self.ints > 0
+
+        # everything else goes through the row engine's parser
+        for i in np.flatnonzero(~(self.fast | self.isnull)).tolist():
+            v = parse_numeric(raw[i])
+            self.values[i] = v
+            if v is None:
+                self.isnull[i] = True
+            else:
+                self.neg[i] = v < 0
+                self.pos[i] = v > 0
+
+        self.zero = ~self.isnull & ~self.neg & ~self.pos
+
+
+def _pick(values, idx):
+    # values[i] for every i in idx (idx=None means all rows)
+    if idx is None:
+        return values
+    if len(idx) == 1:
+        return [values[idx[0]]]
+    return itemgetter(*idx)(values)
+
+
+def normalize_batch(batch, dq, skipped_rows):
+    """
+    Columnar equivalent of normalize_rows(): returns the canonical rows of
+    `batch` and logs DQ issues / rejected rows in the same order.
+    """
+    n = len(batch)
+    if n == 0:
+        return []
+
+    # lineage columns are passed through as Python lists; only the columns
+    # the rules look at become arrays
+    columns = list(zip(*batch))
+    source_system = columns[_SOURCE_SYSTEM]
+    source_file = columns[_SOURCE_FILE]
+    load_batch_id = columns[_LOAD_BATCH_ID]
+    raw_row_hash = columns[_ROW_HASH]
+    invoice_id = columns[_INVOICE_ID]
+    system_date = pa.array(columns[_SYSTEM_DATE_JALALI], type=pa.string())
+    reference_date = pa.array(columns[_REFERENCE_DATE_JALALI], type=pa.string())
+
+    # -------------------------
+    # Rule masks
+    # -------------------------
+    # str.strip() semantics (Unicode whitespace) are kept exactly here
+    missing_invoice = np.array([v is None or v.strip() == "" for v in invoice_id], dtype=bool)
+    ok = ~missing_invoice
+
+    quantity = _NumericColumn(columns[_QUANTITY])
+    unit_price = _NumericColumn(columns[_UNIT_PRICE])
+    gross_amount = _NumericColumn(columns[_GROSS_AMOUNT])
+    net_amount = _NumericColumn(columns[_NET_AMOUNT])
+    discount_volume = _NumericColumn(columns[_DISCOUNT_VOLUME])
+    discount_cash = _NumericColumn(columns[_DISCOUNT_CASH])
+
+    invalid_numeric = ok & (quantity.isnull | unit_price.isnull | gross_amount.isnull | net_amount.isnull)
+    ok &= ~invalid_numeric
+
+    # quantity and net_amount are both present here, so only the sign decides
+    # (the transaction_type_raw hint is never reached, as in the row engine)
+    is_return = net_amount.neg | quantity.neg
+    sale = ok & ~is_return
+    # `not reference_date_jalali`: None or ""
+    reference_blank = _mask(pc.equal(pc.utf8_length(reference_date), 0), null_value=True)
+
+    positive_qty_on_return = ok & is_return & quantity.pos
+    fallback_event_date = sale & reference_blank
+    negative_qty_on_sale = sale & quantity.neg
+    sign_mismatch = ok & ~quantity.zero & ~net_amount.zero & (quantity.pos != net_amount.pos)
+
+    event_date_arr = pc.if_else(pa.array(is_return | reference_blank), system_date, reference_date)
+    event_date = event_date_arr.to_numpy(zero_copy_only=False)
+
+    # the date domain is tiny: convert each distinct string once, then map
+    # every row to its converted value by index
+    distinct = pc.unique(event_date_arr.filter(pa.array(ok)))
+    converted = np.array([date_lookup.to_gregorian(d) for d in distinct.to_pylist()] + [None], dtype=object)
+    positions = pc.fill_null(pc.index_in(event_date_arr, value_set=distinct), len(distinct))
+    invoice_date_gregorian = converted[positions.to_numpy()]
+    invoice_date_gregorian[~ok] = None
+
+    invalid_date = ok & np.equal(invoice_date_gregorian, None)
+    ok &= ~invalid_date
+
+    # -------------------------
+    # DQ issues + rejected rows, in row-engine order
+    # -------------------------
+    events = []
+
+    def lineage(i):
+        return dict(
+            source_system=source_system[i],
+            source_file=source_file[i],
+            load_batch_id=load_batch_id[i],
+            table_stage="CANONICAL",
+        )
+
+    def key(i):
+        return str(invoice_id[i]) if invoice_id[i] else None
+
+    def rejected(i, reason, **details):
+        return dict(
+            source_system=source_system[i],
+            source_file=source_file[i],
+            load_batch_id=load_batch_id[i],
+            raw_id=columns[_RAW_ID][i],
+            row_hash=raw_row_hash[i],
+            invoice_id=invoice_id[i],
+            reason=reason,
+            **details,
+        )
+
+    for i in np.flatnonzero(missing_invoice).tolist():
+        events.append((i, 0, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.MISSING_INVOICE_ID,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=None,
+            column_name="invoice_id",
+            raw_value=str(invoice_id[i]) if invoice_id[i] is not None else None,
+            issue_description="invoice_id is missing or empty.",
+        ), rejected(i, "missing_invoice_id")))
+
+    for i in np.flatnonzero(invalid_numeric).tolist():
+        bad_cols = [
+            name
+            for name, col in (
+                ("quantity", quantity),
+                ("unit_price", unit_price),
+                ("gross_amount", gross_amount),
+                ("net_amount", net_amount),
+            )
+            if col.isnull[i]
+        ]
+        events.append((i, 0, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.INVALID_NUMERIC,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=key(i),
+            column_name=",".join(bad_cols) if bad_cols else None,
+            raw_value=None,
+            issue_description="One or more numeric fields failed to parse to Decimal.",
+        ), rejected(i, "invalid_numeric")))
+
+    for i in np.flatnonzero(positive_qty_on_return).tolist():
+        events.append((i, 1, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.POSITIVE_QTY_ON_RETURN,
+            issue_severity=DQSeverity.WARNING,
+            record_business_key=key(i),
+            column_name="quantity",
+            raw_value=str(quantity.values[i]),
+            issue_description="Transaction type is RETURN but quantity is positive.",
+        ), None))
+
+    for i in np.flatnonzero(fallback_event_date).tolist():
+        events.append((i, 1, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.FALLBACK_EVENT_DATE,
+            issue_severity=DQSeverity.WARNING,
+            record_business_key=key(i),
+            column_name="reference_date_jalali",
+            raw_value=None,
+            issue_description="Falling back to system_date_jalali for event_date_jalali because reference_date_jalali is missing.",
+        ), None))
+
+    for i in np.flatnonzero(negative_qty_on_sale).tolist():
+        events.append((i, 2, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.NEGATIVE_QTY_ON_SALE,
+            issue_severity=DQSeverity.WARNING,
+            record_business_key=key(i),
+            column_name="quantity",
+            raw_value=str(quantity.values[i]),
+            issue_description="Transaction type is SALE but quantity is negative.",
+        ), None))
+
+    for i in np.flatnonzero(sign_mismatch).tolist():
+        events.append((i, 3, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.SIGN_MISMATCH_QTY_AMOUNT,
+            issue_severity=DQSeverity.WARNING,
+            record_business_key=key(i),
+            column_name="quantity, net_amount",
+            raw_value=f"quantity={quantity.values[i]}, net_amount={net_amount.values[i]}",
+            issue_description="Quantity and Net Amount have opposite signs.",
+        ), None))
+
+    for i in np.flatnonzero(invalid_date).tolist():
+        events.append((i, 4, dict(
+            **lineage(i),
+            issue_code=DQIssueCode.INVALID_DATE,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=key(i),
+            column_name="event_date_jalali",
+            raw_value=str(event_date[i]) if event_date[i] else None,
+            issue_description="event_date_jalali could not be parsed (jalali_to_gregorian returned None)",
+        ), rejected(
+            i,
+            "missing_event_date",
+            transaction_type="RETURN" if is_return[i] else "SALE",
+            system_date_jalali=columns[_SYSTEM_DATE_JALALI][i],
+            reference_date_jalali=columns[_REFERENCE_DATE_JALALI][i],
+        )))
+
+    events.sort(key=lambda e: (e[0], e[1]))
+    for _, _, issue, skipped in events:
+        dq.log(**issue)
+        if skipped is not None:
+            skipped_rows.append(skipped)
+
+    # -------------------------
+    # Canonical rows
+    # -------------------------
+    rows = np.flatnonzero(ok)
+    if len(rows) == 0:
+        return []
+
+    # empty discounts count as 0; int + int covers the common case exactly
+    discount_ints = (discount_volume.fast | discount_volume.isnull) & (discount_cash.fast | discount_cash.isnull)
+    discount_amount = (discount_volume.ints + discount_cash.ints).astype(object)
+    for i in np.flatnonzero(ok & ~discount_ints).tolist():
+        discount_amount[i] = (discount_volume.values[i] or Decimal(0)) + (discount_cash.values[i] or Decimal(0))
+
+    idx = None if len(rows) == n else rows.tolist()
+    return list(zip(
+        _pick(source_system, idx),
+        _pick(source_file, idx),
+        _pick(load_batch_id, idx),
+        _pick(raw_row_hash, idx),
+
+        _pick(invoice_id, idx),
+        _pick(columns[_CUSTOMER_ID], idx),
+        _pick(columns[_PRODUCT_ID], idx),
+        _pick(columns[_SALESPERSON_ID], idx),
+
+        event_date[rows].tolist(),
+        invoice_date_gregorian[rows].tolist(),
+
+        np.where(is_return[rows], "RETURN", "SALE").tolist(),
+        np.where(is_return[rows], -1, 1).tolist(),
+
+        quantity.values[rows].tolist(),
+        unit_price.values[rows].tolist(),
+        gross_amount.values[rows].tolist(),
+        discount_amount[rows].tolist(),
+        net_amount.values[rows].tolist(),
+
+        _pick(columns[_INGESTED_AT], idx),
+    ))
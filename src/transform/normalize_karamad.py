@@ -1,11 +1,19 @@
+import argparse
 import os
+import time
 from decimal import Decimal
 import psycopg2
+from psycopg2.extras import execute_values
 import yaml
 import jdatetime
 from datetime import datetime, timezone
 
-from src.transform.dq import log_dq_issue
+from src.common.telemetry import CountingConnection, RunMetrics
+from src.ingestion.load_raw import RAW_WRITE_LOCK
+from src.transform.dq import DQWriter, RejectWriter
+from src.transform.dim_date import DateLookup
+from src.transform.kpi_refresh import refresh_kpis
+from src.transform.partitions import CanonicalPartitions
 from src.transform.dq_contract import DQIssueCode, DQSeverity
 
 
@@ -20,6 +28,7 @@ def connect():
         dbname=os.getenv("DB_NAME", "sales_engine"),
         user=os.getenv("DB_USER", "postgres"),
         password=os.getenv("DB_PASSWORD", "postgres"),
+        connection_factory=CountingConnection,
     )
 
 
@@ -72,418 +81,729 @@ def jalali_to_gregorian(jalali_str):
         return None
 
 
+# Jalali -> Gregorian lookup, seeded from dim_date by normalize();
+# unknown strings fall back to jalali_to_gregorian (cached)
+date_lookup = DateLookup(jalali_to_gregorian)
+
+
+# =========================
+# RAW -> Canonical contract
+# =========================
+SOURCE_SYSTEM = "karamad"
+DEFAULT_BATCH_SIZE = 5000
+
+# RAW columns in the order the normalize engines expect
+RAW_COLUMNS_SQL = """
+        raw_id,
+        source_system,
+        source_file,
+        load_batch_id,
+        row_hash,
+
+        c03, -- salesperson_id
+        c05, -- product_id
+        c29, -- transaction_type_raw (فارسی/انگلیسی)
+
+        c39, -- invoice_id
+        c42, -- customer_id
+
+        c38, -- system_date_jalali
+        c54, -- reference_date_jalali
+
+        c46, -- quantity
+        c47, -- unit_price
+        c48, -- gross_amount
+        c49, -- discount_volume
+        c50, -- discount_cash
+        c52, -- net_amount
+
+        ingested_at
+"""
+
+RAW_SELECT_SQL = f"""
+    select{RAW_COLUMNS_SQL}    from raw_karamad_sales
+    where source_system = %s
+      and raw_id > %s
+      and (%s::bigint is null or raw_id <= %s)
+    order by raw_id
+"""
+
+CANONICAL_COLUMNS = [
+    "source_system",
+    "source_file",
+    "load_batch_id",
+    "raw_row_hash",
+
+    "invoice_id",
+    "customer_id",
+    "product_id",
+    "salesperson_id",
+
+    "invoice_date_jalali",
+    "invoice_date_gregorian",
+
+    "transaction_type",
+    "sign",
+
+    "quantity",
+    "unit_price",
+    "gross_amount",
+    "discount_amount",
+    "net_amount",
+
+    "ingested_at",
+]
+
+INVOICE_DATE_INDEX = CANONICAL_COLUMNS.index("invoice_date_gregorian")
+
+# rows whose raw row has no canonical row yet claim it in canonical_row_keys
+# first (migration 015); the unique key of canonical_sales includes the
+# event date, so on its own it would let a re-derived date in twice. Every
+# non-text canonical column is non-null, so VALUES infers the right types.
+CANONICAL_INSERT_SQL = f"""
+    with v ({", ".join(CANONICAL_COLUMNS)}) as (values %s),
+    new_keys as (
+        insert into canonical_row_keys (source_system, raw_row_hash, invoice_date_gregorian)
+        select source_system, raw_row_hash, invoice_date_gregorian from v
+        on conflict do nothing
+        returning source_system, raw_row_hash
+    )
+    insert into canonical_sales ({", ".join(CANONICAL_COLUMNS)})
+    select v.*
+    from v
+    join new_keys k
+      on k.source_system = v.source_system
+     and k.raw_row_hash = v.raw_row_hash
+    on conflict (source_system, raw_row_hash, invoice_date_gregorian) do nothing
+"""
+
+
 # =========================
 # Normalize logic
 # =========================
-def normalize():
+def normalize_row(r, dq, skipped_rows):
+    """
+    Apply the canonical rules to one RAW row (in RAW_SELECT_SQL order).
+
+    Returns the canonical row (in CANONICAL_COLUMNS order), or None if the
+    row was rejected. DQ issues are logged through `dq` (a DQWriter), and
+    rejected rows are appended to `skipped_rows` (a RejectWriter).
+    """
+    (
+        raw_id,
+        source_system,
+        source_file,
+        load_batch_id,
+        raw_row_hash,
+
+        salesperson_id,
+        product_id,
+        transaction_type_raw,
+
+        invoice_id,
+        customer_id,
+
+        system_date_jalali,
+        reference_date_jalali,
+
+        quantity,
+        unit_price,
+        gross_amount,
+        discount_volume,
+        discount_cash,
+        net_amount,
+
+        ingested_at,
+    ) = r
+
+    if invoice_id is None or str(invoice_id).strip() == "":
+        # DQ: MISSING_INVOICE_ID (ERROR)
+        dq.log(
+            source_system=source_system,
+            source_file=source_file,
+            load_batch_id=load_batch_id,
+            table_stage="CANONICAL",
+            issue_code=DQIssueCode.MISSING_INVOICE_ID,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=None,
+            column_name="invoice_id",
+            raw_value=str(invoice_id) if invoice_id is not None else None,
+            issue_description="invoice_id is missing or empty.",
+        )
+
+        skipped_rows.append({
+            "source_system": source_system,
+            "source_file": source_file,
+            "load_batch_id": load_batch_id,
+            "raw_id": raw_id,
+            "row_hash": raw_row_hash,
+            "invoice_id": invoice_id,
+            "reason": "missing_invoice_id",
+        })
+        return None
+
+    # -------------------------
+    # Numeric cleanup (truth source)
+    # -------------------------
+    quantity = parse_numeric(quantity)
+    unit_price = parse_numeric(unit_price)
+    gross_amount = parse_numeric(gross_amount)
+    discount_volume = parse_numeric(discount_volume) or Decimal(0)
+    discount_cash = parse_numeric(discount_cash) or Decimal(0)
+    net_amount = parse_numeric(net_amount)
+
+    if None in (quantity, unit_price, gross_amount, net_amount):
+        # DQ: INVALID_NUMERIC (ERROR)
+        # define which columns become None
+        bad_cols = []
+        if quantity is None: bad_cols.append("quantity")
+        if unit_price is None: bad_cols.append("unit_price")
+        if gross_amount is None: bad_cols.append("gross_amount")
+        if net_amount is None: bad_cols.append("net_amount")
+
+        dq.log(
+            source_system=source_system,
+            source_file=source_file,
+            load_batch_id=load_batch_id,
+            table_stage="CANONICAL",
+            issue_code=DQIssueCode.INVALID_NUMERIC,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=str(invoice_id) if invoice_id else None,
+            column_name=",".join(bad_cols) if bad_cols else None,
+            raw_value=None, # we don't have exact raw_value here, because we did it after parse
+            issue_description="One or more numeric fields failed to parse to Decimal.",
+        )
+
+        skipped_rows.append({
+            "source_system": source_system,
+            "source_file": source_file,
+            "load_batch_id": load_batch_id,
+            "raw_id": raw_id,
+            "row_hash": raw_row_hash,
+            "invoice_id": invoice_id,
+            "reason": "invalid_numeric",
+        })
+        return None
+
+    discount_amount = discount_volume + discount_cash
+
+    # -------------------------
+    # Robust transaction type detection
+    # -------------------------
+    is_return = False
+
+    if net_amount is not None and quantity is not None:
+        if net_amount < 0 or quantity < 0:
+            is_return = True
+    elif transaction_type_raw and "برگشت" in transaction_type_raw:
+        is_return = True
+
+
+    if is_return:
+        transaction_type = "RETURN"
+        sign = -1
+        event_date_jalali = system_date_jalali
+
+        if quantity is not None and quantity > 0:
+            # DQ: POSITIVE_QTY_ON_RETURN (WARNING)
+            dq.log(
+                source_system=source_system,
+                source_file=source_file,
+                load_batch_id=load_batch_id,
+                table_stage="CANONICAL",
+                issue_code=DQIssueCode.POSITIVE_QTY_ON_RETURN,
+                issue_severity=DQSeverity.WARNING,
+                record_business_key=str(invoice_id) if invoice_id else None,
+                column_name="quantity",
+                raw_value=str(quantity),
+                issue_description="Transaction type is RETURN but quantity is positive.",
+            )
+
+    else:
+        transaction_type = "SALE"
+        sign = 1
+        # fallback: if we don't have reference date, use date (تاریخ مرجع - تاریخ)
+        event_date_jalali = reference_date_jalali or system_date_jalali
+
+        if not reference_date_jalali:
+            # DQ: FALLBACK_EVENT_DATE (WARNING)
+            dq.log(
+                source_system=source_system,
+                source_file=source_file,
+                load_batch_id=load_batch_id,
+                table_stage="CANONICAL",
+                issue_code=DQIssueCode.FALLBACK_EVENT_DATE,
+                issue_severity=DQSeverity.WARNING,
+                record_business_key=str(invoice_id) if invoice_id else None,
+                column_name="reference_date_jalali",
+                raw_value=str(reference_date_jalali) if reference_date_jalali else None,
+                issue_description="Falling back to system_date_jalali for event_date_jalali because reference_date_jalali is missing.",
+            )
+
+
+        if quantity is not None and quantity < 0: 
+            # DQ: NEGATIVE_QTY_ON_SALE (WARNING)
+            dq.log(
+                source_system=source_system,
+                source_file=source_file,
+                load_batch_id=load_batch_id,
+                table_stage="CANONICAL",
+                issue_code=DQIssueCode.NEGATIVE_QTY_ON_SALE,
+                issue_severity=DQSeverity.WARNING,
+                record_business_key=str(invoice_id) if invoice_id else None,
+                column_name="quantity",
+                raw_value=str(quantity),
+                issue_description="Transaction type is SALE but quantity is negative.",
+            )
+
+    # DQ: SIGN_MISMATCH_QTY_AMOUNT (WARNING)
+    if quantity is not None and net_amount is not None:
+        if quantity != 0 and net_amount != 0:
+            if (quantity > 0) != (net_amount > 0):
+                dq.log(
+                    source_system=source_system,
+                    source_file=source_file,
+                    load_batch_id=load_batch_id,
+                    table_stage="CANONICAL",
+                    issue_code=DQIssueCode.SIGN_MISMATCH_QTY_AMOUNT,
+                    issue_severity=DQSeverity.WARNING,
+                    record_business_key=str(invoice_id) if invoice_id else None,
+                    column_name="quantity, net_amount",
+                    raw_value=f"quantity={quantity}, net_amount={net_amount}",
+                    issue_description="Quantity and Net Amount have opposite signs.",
+                )
+
+    # -------------------------
+    # Date handling
+    # -------------------------
+    invoice_date_gregorian = date_lookup.to_gregorian(event_date_jalali)
+    if invoice_date_gregorian is None:
+
+        dq.log(
+            source_system=source_system,
+            source_file=source_file,
+            load_batch_id=load_batch_id,
+            table_stage="CANONICAL",
+            issue_code=DQIssueCode.INVALID_DATE,
+            issue_severity=DQSeverity.ERROR,
+            record_business_key=str(invoice_id) if invoice_id else None,
+            column_name="event_date_jalali",
+            raw_value=str(event_date_jalali) if event_date_jalali else None,
+            issue_description="event_date_jalali could not be parsed (jalali_to_gregorian returned None)",
+        )
+
+
+        skipped_rows.append({
+            "source_system": source_system,
+            "source_file": source_file,
+            "load_batch_id": load_batch_id,
+            "raw_id": raw_id,
+            "row_hash": raw_row_hash,
+            "invoice_id": invoice_id,
+            "transaction_type": transaction_type,
+            "system_date_jalali": system_date_jalali,
+            "reference_date_jalali": reference_date_jalali,
+            "reason": "missing_event_date",
+        })
+        return None
+
+    return (
+        source_system,
+        source_file,
+        load_batch_id,
+        raw_row_hash,
+
+        invoice_id,
+        customer_id,
+        product_id,
+        salesperson_id,
+
+        event_date_jalali,
+        invoice_date_gregorian,
+
+        transaction_type,
+        sign,
+
+        quantity,
+        unit_price,
+        gross_amount,
+        discount_amount,
+        net_amount,
+
+        ingested_at,
+    )
+
+
+def normalize_rows(batch, dq, skipped_rows):
+    """
+    Row-wise engine: normalize_row() over a batch of RAW rows.
+    """
+    canonical_rows = []
+    for r in batch:
+        row = normalize_row(r, dq, skipped_rows)
+        if row is not None:
+            canonical_rows.append(row)
+    return canonical_rows
+
+
+def get_engine(name):
+    """
+    Return the batch transform for an engine name ("row" or "columnar").
+
+    Both engines have the same signature and produce the same output;
+    "columnar" needs numpy and pyarrow.
+    """
+    if name == "columnar":
+        from src.transform.normalize_columnar import normalize_batch
+        return normalize_batch
+    if name == "row":
+        return normalize_rows
+    raise ValueError(f"Unknown engine: {name}")
+
+
+def write_canonical(cur, rows):
+    """
+    Bulk insert canonical rows (one multi-row INSERT per call).
+    """
+    if not rows:
+        return
+    execute_values(cur, CANONICAL_INSERT_SQL, rows, page_size=len(rows))
+
+
+def get_watermark(cur, source_system):
+    """
+    Highest raw_id already normalized for `source_system` (0 if none).
+    """
+    cur.execute(
+        "select last_raw_id from normalize_state where source_system = %s",
+        (source_system,),
+    )
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def committed_raw_ceiling(cur):
+    """
+    Highest raw_id at or below which every RAW row is committed (0 before
+    the first load). raw_ids are handed out at insert time, so parallel
+    loads commit them out of order; each load chunk holds RAW_WRITE_LOCK
+    shared until it commits, so taking it here waits for the chunks in
+    flight, and raw_ids handed out after it is released are higher.
+    """
+    cur.execute("select pg_advisory_lock(hashtext(%s))", (RAW_WRITE_LOCK,))
+    try:
+        cur.execute("select last_value, is_called from raw_karamad_sales_raw_id_seq")
+        last_value, is_called = cur.fetchone()
+    finally:
+        cur.execute("select pg_advisory_unlock(hashtext(%s))", (RAW_WRITE_LOCK,))
+    return last_value if is_called else 0
+
+
+def set_watermark(cur, source_system, last_raw_id):
+    """
+    Advance the watermark. It never moves backwards.
+    """
+    cur.execute(
+        """
+        insert into normalize_state (source_system, last_raw_id, updated_at)
+        values (%s, %s, now())
+        on conflict (source_system) do update
+        set last_raw_id = greatest(normalize_state.last_raw_id, excluded.last_raw_id),
+            updated_at = excluded.updated_at
+        """,
+        (source_system, last_raw_id),
+    )
+
+
+def write_run_stats(cur, *, source_system, source_file, load_batch_id, processed, inserted,
+                    skipped, error_count, warning_count, started_at, finished_at, parent_run_id=None):
+    """
+    Insert the dq_run_stats summary of one run; returns its run_id.
+    `parent_run_id` links a shard worker's row to its sharded run.
+    """
+    cur.execute(
+        """
+        insert into dq_run_stats (
+            source_system,
+            source_file,
+            load_batch_id,
+            processed_count,
+            inserted_count,
+            skipped_count,
+            error_count,
+            warning_count,
+            started_at,
+            finished_at,
+            parent_run_id
+        )
+        values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        returning run_id
+        """,
+        (
+            source_system,
+            source_file,
+            load_batch_id,
+            processed,
+            inserted,
+            skipped,
+            error_count,
+            warning_count,
+            started_at,
+            finished_at,
+            parent_run_id,
+        )
+    )
+    return cur.fetchone()[0]
+
+
+def add_run_stats(cur, run_id, *, processed, inserted, skipped, error_count, warning_count, finished_at):
+    """
+    Add one more run's counts to an existing dq_run_stats row.
+    """
+    cur.execute(
+        """
+        update dq_run_stats
+        set processed_count = processed_count + %s,
+            inserted_count = inserted_count + %s,
+            skipped_count = skipped_count + %s,
+            error_count = error_count + %s,
+            warning_count = warning_count + %s,
+            finished_at = %s
+        where run_id = %s
+        """,
+        (processed, inserted, skipped, error_count, warning_count, finished_at, run_id),
+    )
+
+
+def transform_batches(cur, batches, transform, dq, rejects, metrics, partitions):
+    """
+    Transform RAW batches (lists of rows in RAW_SELECT_SQL order, in raw_id
+    order) and write their canonical rows.
+
+    Returns the counts of the run; "lineage" is (source_system,
+    source_file, load_batch_id) of the first row, None if there were none.
+    """
+    run = {"processed": 0, "inserted": 0, "skipped": 0, "last_raw_id": None,
+           "touched_days": set(), "lineage": None}
+
+    while True:
+        with metrics.stage("fetch") as fetch:
+            batch = next(batches, [])
+            fetch.rows += len(batch)
+        if not batch:
+            break
+
+        if run["lineage"] is None:
+            run["lineage"] = (batch[0][1], batch[0][2], batch[0][3])
+
+        with metrics.stage("transform", rows=len(batch)):
+            canonical_rows = transform(batch, dq, rejects)
+        run["processed"] += len(batch)
+        run["skipped"] += len(batch) - len(canonical_rows)
+
+        # -------------------------
+        # Insert canonical (idempotent, one statement per batch)
+        # -------------------------
+        batch_days = {row[INVOICE_DATE_INDEX] for row in canonical_rows}
+        with metrics.stage("canonical_write", rows=len(canonical_rows)):
+            partitions.ensure(batch_days)
+            write_canonical(cur, canonical_rows)
+        run["inserted"] += len(canonical_rows)
+        run["touched_days"] |= batch_days
+
+        # rows arrive ordered by raw_id
+        run["last_raw_id"] = batch[-1][0]
+
+    return run
+
+
+def finish_run(cur, run, dq, rejects, metrics, *, refresh, started_at, clock, parent_run_id=None, run_id=None):
+    """
+    Flush the DQ issues and rejects, refresh the KPIs of the touched days and
+    write the run's dq_run_stats and pipeline_run_metrics rows (all in the
+    caller's transaction). Returns the run_id.
+
+    With `run_id`, the counts are added to that dq_run_stats row instead (a
+    shard worker's row, see normalize_shards); `metrics` and `clock` then
+    cover every run added to it, and its pipeline_run_metrics rows are
+    replaced.
+    """
+    dq.flush()
+    rejects.flush()
+    if refresh:
+        with metrics.stage("kpi_refresh"):
+            refresh_kpis(cur, run["touched_days"])
+
+    source_system, source_file, load_batch_id = run["lineage"]
+    # DQ summary for this run (counted in memory by the writer)
+    counts = {
+        "processed": run["processed"],
+        "inserted": run["inserted"],
+        "skipped": run["skipped"],
+        "error_count": dq.error_count,
+        "warning_count": dq.warning_count,
+        "finished_at": datetime.now(tz=timezone.utc),
+    }
+    if run_id is None:
+        run_id = write_run_stats(
+            cur,
+            source_system=source_system,
+            source_file=source_file,
+            load_batch_id=load_batch_id,
+            started_at=started_at,
+            parent_run_id=parent_run_id,
+            **counts,
+        )
+        total_rows = run["processed"]
+    else:
+        add_run_stats(cur, run_id, **counts)
+        cur.execute("delete from pipeline_run_metrics where run_id = %s", (run_id,))
+        # the rows of the runs added before, from the last finish()
+        total_rows = metrics["total"].rows + run["processed"]
+
+    metrics.finish(clock, total_rows)
+    metrics.write(
+        cur,
+        pipeline="normalize",
+        source_system=source_system,
+        source_file=source_file,
+        load_batch_id=load_batch_id,
+        run_id=run_id,
+    )
+    return run_id
+
+
+def pending_shards(cur, source_system):
+    """
+    Number of shards of a sharded run (normalize_shards) not done yet.
+    """
+    cur.execute(
+        "select count(*) from normalize_shards where source_system = %s and status = 'pending'",
+        (source_system,),
+    )
+    return cur.fetchone()[0]
+
+
+def normalize(batch_size=DEFAULT_BATCH_SIZE, full=False, dq_flush_size=1000, engine="row", refresh=True,
+              archive=None, workers=1):
+    """
+    Normalize RAW rows added since the last run (or all of RAW when `full`).
+
+    With `refresh`, the KPI tables of the days touched by this run are
+    recomputed in the same transaction. engine="sql" runs the whole
+    normalization inside Postgres (normalize_sql); workers > 1 splits the
+    new rows into shards normalized in parallel (normalize_shards).
+
+    `archive` (a list of archive_raw Parquet files) re-normalizes archived
+    RAW rows instead; canonical rows that already exist are left as they
+    are and the watermark does not move.
+
+    Rejected rows are quarantined in canonical_rejects (reprocess_rejects
+    retries them).
+
+    Returns the run's counts, or None when there was nothing to normalize.
+    """
+    if engine == "sql":
+        if archive or workers > 1:
+            raise ValueError("engine='sql' runs in one Postgres transaction: no archives, no workers")
+        from src.transform.normalize_sql import normalize_in_db
+        return normalize_in_db(SOURCE_SYSTEM, full=full, refresh=refresh)
+    if workers > 1:
+        if archive or full:
+            raise ValueError("workers > 1 shards the rows above the watermark: no archives, no full rescan")
+        from src.transform.normalize_shards import normalize_sharded
+        return normalize_sharded(workers, batch_size=batch_size, dq_flush_size=dq_flush_size,
+                                 engine=engine, refresh=refresh)
 
     run_started_at = datetime.now(tz=timezone.utc)
 
     # mapping is a documented contract (not dynamic yet)
     mapping = load_mapping()
 
-    processed = 0
-    inserted = 0
-    skipped = 0
-
-    skipped_rows = []
+    transform = get_engine(engine)
+    metrics = RunMetrics()
+    run_clock = time.perf_counter()
 
     with connect() as conn:
-        with conn.cursor() as cur:
-
-            cur.execute("""
-                select
-                    source_system,
-                    source_file,
-                    load_batch_id,
-                    row_hash,
-
-                    c03, -- salesperson_id
-                    c05, -- product_id
-                    c29, -- transaction_type_raw (فارسی/انگلیسی)
-
-                    c39, -- invoice_id
-                    c42, -- customer_id
-
-                    c38, -- system_date_jalali
-                    c54, -- reference_date_jalali
-
-                    c46, -- quantity
-                    c47, -- unit_price
-                    c48, -- gross_amount
-                    c49, -- discount_volume
-                    c50, -- discount_cash
-                    c52, -- net_amount
-
-                    ingested_at
-                from raw_karamad_sales
-            """)
-
-            run_load_batch_id = None
-            run_source_system = None
-            run_source_file = None
-
-            for r in cur.fetchall():             
-
-                processed += 1
-
-                (
-                    source_system,
-                    source_file,
-                    load_batch_id,
-                    raw_row_hash,
-
-                    salesperson_id,
-                    product_id,
-                    transaction_type_raw,
-
-                    invoice_id,
-                    customer_id,
-
-                    system_date_jalali,
-                    reference_date_jalali,
-
-                    quantity,
-                    unit_price,
-                    gross_amount,
-                    discount_volume,
-                    discount_cash,
-                    net_amount,
-
-                    ingested_at,
-                ) = r
-
-                if run_load_batch_id is None:
-                    run_source_system = source_system
-                    run_source_file = source_file
-                    run_load_batch_id = load_batch_id
-
-                if invoice_id is None or str(invoice_id).strip() == "":
-                    # DQ: MISSING_INVOICE_ID (ERROR)
-                    log_dq_issue(
-                        cur,
-                        source_system=source_system,
-                        source_file=source_file,
-                        load_batch_id=load_batch_id,
-                        table_stage="CANONICAL",
-                        issue_code=DQIssueCode.MISSING_INVOICE_ID,
-                        issue_severity=DQSeverity.ERROR,
-                        record_business_key=None,
-                        column_name="invoice_id",
-                        raw_value=str(invoice_id) if invoice_id is not None else None,
-                        issue_description="invoice_id is missing or empty.",
-                    )
-
-                    skipped += 1
-                    skipped_rows.append({
-                        "row_hash": raw_row_hash,
-                        "invoice_id": invoice_id,
-                        "reason": "missing_invoice_id",
-                    })
-                    continue
-
-                # -------------------------
-                # Numeric cleanup (truth source)
-                # -------------------------
-                quantity = parse_numeric(quantity)
-                unit_price = parse_numeric(unit_price)
-                gross_amount = parse_numeric(gross_amount)
-                discount_volume = parse_numeric(discount_volume) or Decimal(0)
-                discount_cash = parse_numeric(discount_cash) or Decimal(0)
-                net_amount = parse_numeric(net_amount)
-
-                if None in (quantity, unit_price, gross_amount, net_amount):
-                    # DQ: INVALID_NUMERIC (ERROR)
-                    # define which columns become None
-                    bad_cols = []
-                    if quantity is None: bad_cols.append("quantity")
-                    if unit_price is None: bad_cols.append("unit_price")
-                    if gross_amount is None: bad_cols.append("gross_amount")
-                    if net_amount is None: bad_cols.append("net_amount")
-
-                    log_dq_issue(
-                        cur,
-                        source_system=source_system,
-                        source_file=source_file,
-                        load_batch_id=load_batch_id,
-                        table_stage="CANONICAL",
-                        issue_code=DQIssueCode.INVALID_NUMERIC,
-                        issue_severity=DQSeverity.ERROR,
-                        record_business_key=str(invoice_id) if invoice_id else None,
-                        column_name=",".join(bad_cols) if bad_cols else None,
-                        raw_value=None, # we don't have exact raw_value here, because we did it after parse
-                        issue_description="One or more numeric fields failed to parse to Decimal.",
-                    )
-
-                    skipped += 1
-                    skipped_rows.append({
-                        "row_hash": raw_row_hash,
-                        "invoice_id": invoice_id,
-                        "reason": "invalid_numeric",
-                    })
-                    continue
-
-                discount_amount = discount_volume + discount_cash
-
-                # -------------------------
-                # Robust transaction type detection
-                # -------------------------
-                is_return = False
-
-                if net_amount is not None and quantity is not None:
-                    if net_amount < 0 or quantity < 0:
-                        is_return = True
-                elif transaction_type_raw and "برگشت" in transaction_type_raw:
-                    is_return = True
-
-
-                if is_return:
-                    transaction_type = "RETURN"
-                    sign = -1
-                    event_date_jalali = system_date_jalali
-
-                    if quantity is not None and quantity > 0:
-                        # DQ: POSITIVE_QTY_ON_RETURN (WARNING)
-                        log_dq_issue(
-                            cur,
-                            source_system=source_system,
-                            source_file=source_file,
-                            load_batch_id=load_batch_id,
-                            table_stage="CANONICAL",
-                            issue_code=DQIssueCode.POSITIVE_QTY_ON_RETURN,
-                            issue_severity=DQSeverity.WARNING,
-                            record_business_key=str(invoice_id) if invoice_id else None,
-                            column_name="quantity",
-                            raw_value=str(quantity),
-                            issue_description="Transaction type is RETURN but quantity is positive.",
-                        )
-
-                else:
-                    transaction_type = "SALE"
-                    sign = 1
-                    # fallback: if we don't have reference date, use date (تاریخ مرجع - تاریخ)
-                    event_date_jalali = reference_date_jalali or system_date_jalali
-
-                    if not reference_date_jalali:
-                        # DQ: FALLBACK_EVENT_DATE (WARNING)
-                        log_dq_issue(
-                            cur,
-                            source_system=source_system,
-                            source_file=source_file,
-                            load_batch_id=load_batch_id,
-                            table_stage="CANONICAL",
-                            issue_code=DQIssueCode.FALLBACK_EVENT_DATE,
-                            issue_severity=DQSeverity.WARNING,
-                            record_business_key=str(invoice_id) if invoice_id else None,
-                            column_name="reference_date_jalali",
-                            raw_value=str(reference_date_jalali) if reference_date_jalali else None,
-                            issue_description="Falling back to system_date_jalali for event_date_jalali because reference_date_jalali is missing.",
-                        )
-
-                    
-                    if quantity is not None and quantity < 0: 
-                        # DQ: NEGATIVE_QTY_ON_SALE (WARNING)
-                        log_dq_issue(
-                            cur,
-                            source_system=source_system,
-                            source_file=source_file,
-                            load_batch_id=load_batch_id,
-                            table_stage="CANONICAL",
-                            issue_code=DQIssueCode.NEGATIVE_QTY_ON_SALE,
-                            issue_severity=DQSeverity.WARNING,
-                            record_business_key=str(invoice_id) if invoice_id else None,
-                            column_name="quantity",
-                            raw_value=str(quantity),
-                            issue_description="Transaction type is SALE but quantity is negative.",
-                        )
-
-                # DQ: SIGN_MISMATCH_QTY_AMOUNT (WARNING)
-                if quantity is not None and net_amount is not None:
-                    if quantity != 0 and net_amount != 0:
-                        if (quantity > 0) != (net_amount > 0):
-                            log_dq_issue(
-                                cur,
-                                source_system=source_system,
-                                source_file=source_file,
-                                load_batch_id=load_batch_id,
-                                table_stage="CANONICAL",
-                                issue_code=DQIssueCode.SIGN_MISMATCH_QTY_AMOUNT,
-                                issue_severity=DQSeverity.WARNING,
-                                record_business_key=str(invoice_id) if invoice_id else None,
-                                column_name="quantity, net_amount",
-                                raw_value=f"quantity={quantity}, net_amount={net_amount}",
-                                issue_description="Quantity and Net Amount have opposite signs.",
-                            )
-
-                # -------------------------
-                # Date handling
-                # -------------------------
-                invoice_date_gregorian = jalali_to_gregorian(event_date_jalali)
-                if invoice_date_gregorian is None:
-
-                    log_dq_issue(
-                        cur,
-                        source_system=source_system,
-                        source_file=source_file,
-                        load_batch_id=load_batch_id,
-                        table_stage="CANONICAL",
-                        issue_code=DQIssueCode.INVALID_DATE,
-                        issue_severity=DQSeverity.ERROR,
-                        record_business_key=str(invoice_id) if invoice_id else None,
-                        column_name="event_date_jalali",
-                        raw_value=str(event_date_jalali) if event_date_jalali else None,
-                        issue_description="event_date_jalali could not be parsed (jalali_to_gregorian returned None)",
-                    )
-
-
-                    skipped += 1
-                    skipped_rows.append({
-                        "row_hash": raw_row_hash,
-                        "invoice_id": invoice_id,
-                        "transaction_type": transaction_type,
-                        "system_date_jalali": system_date_jalali,
-                        "reference_date_jalali": reference_date_jalali,
-                        "reason": "missing_event_date",
-                    })
-                    continue
-
-                # -------------------------
-                # Insert canonical (idempotent)
-                # -------------------------
-                cur.execute("""
-                    insert into canonical_sales (
-                        source_system,
-                        source_file,
-                        load_batch_id,
-                        raw_row_hash,
-
-                        invoice_id,
-                        customer_id,
-                        product_id,
-                        salesperson_id,
-
-                        invoice_date_jalali,
-                        invoice_date_gregorian,
-
-                        transaction_type,
-                        sign,
-
-                        quantity,
-                        unit_price,
-                        gross_amount,
-                        discount_amount,
-                        net_amount,
-
-                        ingested_at
-                    )
-                    values (
-                        %s,%s,%s,%s,
-                        %s,%s,%s,%s,
-                        %s,%s,
-                        %s,%s,
-                        %s,%s,%s,%s,%s,
-                        %s
-                    )
-                    on conflict (source_system, raw_row_hash) do nothing
-                """, (
-                    source_system,
-                    source_file,
-                    load_batch_id,
-                    raw_row_hash,
-
-                    invoice_id,
-                    customer_id,
-                    product_id,
-                    salesperson_id,
-
-                    event_date_jalali,
-                    invoice_date_gregorian,
-
-                    transaction_type,
-                    sign,
-
-                    quantity,
-                    unit_price,
-                    gross_amount,
-                    discount_amount,
-                    net_amount,
-
-                    ingested_at
-                ))
-
-                inserted += 1
-
-            if run_load_batch_id is None:
-                print("No rows processed, skipping DQ run stats logging.")
-                return
-            
-            # calculate DQ summary for this run
-            cur.execute(
-                """
-                select 
-                    count(*) filter (where issue_severity = 'ERROR') as error_count,
-                    count(*) filter (where issue_severity = 'WARNING') as warning_count
-                from dq_issues
-                where load_batch_id = %s
-                and table_stage = 'CANONICAL' and detected_at >= %s
-                """,
-                (run_load_batch_id, run_started_at) # type: ignore
-            )
-            error_count, warning_count = cur.fetchone() # type: ignore
-
-            run_finished_at = datetime.now(tz=timezone.utc)
-            # insert DQ run summary
-            cur.execute(
-                """
-                insert into dq_run_stats (
-                    source_system,
-                    source_file,
-                    load_batch_id,
-                    processed_count,
-                    inserted_count,
-                    skipped_count,
-                    error_count,
-                    warning_count,
-                    started_at,
-                    finished_at
-                )
-                values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """,
-                (
-                    run_source_system, # type: ignore
-                    run_source_file, # type: ignore
-                    run_load_batch_id, # type: ignore
-                    processed,
-                    inserted,
-                    skipped,
-                    error_count,
-                    warning_count,
-                    run_started_at,
-                    run_finished_at,
-                )
-            )
+        # RAW is streamed through a server-side cursor, so only `batch_size`
+        # rows are held in memory; writes go through a separate cursor.
+        with conn.cursor() as cur, conn.cursor(name="raw_karamad_stream") as raw_cur:
+
+            dq = DQWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            rejects = RejectWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            partitions = CanonicalPartitions(cur)
+            with metrics.stage("setup"):
+                date_lookup.load(cur)
+                since_raw_id = 0 if full or archive else get_watermark(cur, SOURCE_SYSTEM)
+                if not archive and pending_shards(cur, SOURCE_SYSTEM):
+                    # the watermark is behind rows that sharded workers own
+                    print("A sharded run is still in progress; finish it with --workers.")
+                    return None
+                # rows above it may sit behind uncommitted lower raw_ids of a
+                # parallel load; the watermark must not pass those
+                until_raw_id = None if archive else committed_raw_ceiling(cur)
+
+            if archive:
+                from src.ingestion.archive_raw import iter_archive_batches
+                batches = iter_archive_batches(archive, batch_size)
+            else:
+                raw_cur.itersize = batch_size
+                with metrics.stage("fetch"):
+                    raw_cur.execute(RAW_SELECT_SQL, (SOURCE_SYSTEM, since_raw_id, until_raw_id, until_raw_id))
+                batches = iter(lambda: raw_cur.fetchmany(batch_size), [])
+
+            run = transform_batches(cur, batches, transform, dq, rejects, metrics, partitions)
+            if run["lineage"] is None:
+                print("No new rows to normalize, skipping DQ run stats logging.")
+                return None
+
+            # committed together with the canonical rows
+            if not archive:
+                set_watermark(cur, SOURCE_SYSTEM, run["last_raw_id"])
+            run_id = finish_run(cur, run, dq, rejects, metrics, refresh=refresh, started_at=run_started_at,
+                                clock=run_clock)
     # -------------------------
     # Reporting
     # -------------------------
-    print(f"Processed: {processed}")
-    print(f"Inserted (attempted): {inserted}")
-    print(f"Skipped: {skipped}")
+    print(f"Processed: {run['processed']}")
+    print(f"Inserted (attempted): {run['inserted']}")
+    print(f"Skipped: {run['skipped']}")
+    print("Stages:")
+    print(metrics.summary())
 
-    if skipped_rows:
-        import csv
-        with open("skipped_rows.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=skipped_rows[0].keys())
-            writer.writeheader()
-            writer.writerows(skipped_rows)
+    if rejects.count:
+        print(f"Rejected rows quarantined in canonical_rejects ({rejects.count})")
 
-        print(f"Skipped rows written to skipped_rows.csv ({len(skipped_rows)})")
+    return {"run_id": run_id, "processed": run["processed"], "inserted": run["inserted"],
+            "skipped": run["skipped"], "last_raw_id": run["last_raw_id"]}
 
 
 # =========================
 # Entry point
 # =========================
 def main():
-    normalize()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--full", action="store_true", help="ignore the watermark and rescan all of RAW")
+    ap.add_argument("--engine", choices=["row", "columnar", "sql"], default="row",
+                    help="row: per-row rules; columnar: same rules on whole columns (numpy/pyarrow); "
+                         "sql: set-based, inside Postgres, compiled from the mapping")
+    ap.add_argument("--no-refresh", action="store_true", help="do not refresh the KPI tables")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="normalize new rows in N parallel processes over raw_id shards (row / columnar)")
+    ap.add_argument("--from-archive", nargs="+", metavar="PATH",
+                    help="re-normalize archived RAW (Parquet files or directories from archive_raw)")
+    args = ap.parse_args()
+
+    archive = None
+    if args.from_archive:
+        from src.ingestion.archive_raw import archive_files
+        archive = archive_files(args.from_archive)
+        if not archive:
+            raise SystemExit("No archive files found.")
+
+    normalize(batch_size=args.batch_size, full=args.full, engine=args.engine, refresh=not args.no_refresh,
+              archive=archive, workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,330 @@
+"""
+Parallel normalization over disjoint raw_id shards (migration 012).
+
+`normalize_karamad --workers N` plans the RAW rows above the watermark as
+raw_id ranges in normalize_shards, then runs N worker processes. A worker
+claims a shard with a session advisory lock, re-checks that it is still
+pending and normalizes it in one transaction that also marks it done and
+adds its counts to the worker's own dq_run_stats row (parent_run_id -> the
+combined row of the run; created with the worker's first shard of the run)
+and to the combined row. Workers on other machines running the same command pick
+up pending shards the same way, so no shard is normalized twice, and a
+shard whose worker died is taken over once its connection is gone.
+
+The watermark moves to the end of the done shards below the first pending
+one, so the plain single-process normalize() can follow a sharded run.
+"""
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from src.common.telemetry import RunMetrics
+from src.transform.dq import DQWriter, RejectWriter
+from src.transform.normalize_karamad import (
+    DEFAULT_BATCH_SIZE,
+    RAW_SELECT_SQL,
+    SOURCE_SYSTEM,
+    committed_raw_ceiling,
+    connect,
+    date_lookup,
+    finish_run,
+    get_engine,
+    get_watermark,
+    set_watermark,
+    transform_batches,
+    write_run_stats,
+)
+from src.transform.partitions import CanonicalPartitions
+
+# bounds one shard's transaction (and what a crashed worker loses)
+MAX_SHARD_ROWS = 500_000
+# first key of the two-key advisory locks on shards
+SHARD_LOCK_KEY = "normalize_shard"
+
+
+def plan_shards(cur, source_system, workers, max_shard_rows=MAX_SHARD_ROWS):
+    """
+    Split the RAW rows above the watermark (and above earlier shards) into
+    about `workers` shards of at most `max_shard_rows` raw_ids. Returns the
+    combined run's run_id, or None when there is nothing new.
+    """
+    # two planners must not cut the same range
+    cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (f"normalize_plan:{source_system}",))
+
+    cur.execute("select max(to_raw_id) from normalize_shards where source_system = %s", (source_system,))
+    planned = cur.fetchone()[0]
+    since = max(get_watermark(cur, source_system), planned or 0)
+
+    # not past uncommitted raw_ids of loads in flight
+    ceiling = committed_raw_ceiling(cur)
+    cur.execute(
+        """
+        select max(raw_id) from raw_karamad_sales
+        where source_system = %s and raw_id > %s and raw_id <= %s
+        """,
+        (source_system, since, ceiling),
+    )
+    until = cur.fetchone()[0]
+    if until is None:
+        return None
+
+    cur.execute(
+        """
+        select source_file, load_batch_id from raw_karamad_sales
+        where source_system = %s and raw_id > %s
+        order by raw_id
+        limit 1
+        """,
+        (source_system, since),
+    )
+    source_file, load_batch_id = cur.fetchone()
+
+    # the combined row: zeros until the shards report in
+    now = datetime.now(tz=timezone.utc)
+    plan_run_id = write_run_stats(
+        cur,
+        source_system=source_system,
+        source_file=source_file,
+        load_batch_id=load_batch_id,
+        processed=0,
+        inserted=0,
+        skipped=0,
+        error_count=0,
+        warning_count=0,
+        started_at=now,
+        finished_at=now,
+    )
+
+    width = min(max(-(-(until - since) // workers), 1), max_shard_rows)
+    cur.execute(
+        """
+        insert into normalize_shards (source_system, from_raw_id, to_raw_id, plan_run_id)
+        select %s, lo, least(lo + %s, %s), %s
+        from generate_series(%s::bigint, %s::bigint - 1, %s) lo
+        """,
+        (source_system, width, until, plan_run_id, since, until, width),
+    )
+    return plan_run_id
+
+
+def claim_shard(conn, source_system):
+    """
+    Lock the first pending shard nobody holds; returns (shard_id,
+    from_raw_id, to_raw_id, plan_run_id) with the session lock held, or
+    None when no shard is left.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            select shard_id, from_raw_id, to_raw_id, plan_run_id
+            from normalize_shards
+            where source_system = %s and status = 'pending'
+            order by from_raw_id
+            """,
+            (source_system,),
+        )
+        for shard in cur.fetchall():
+            cur.execute("select pg_try_advisory_lock(hashtext(%s), %s::integer)", (SHARD_LOCK_KEY, shard[0] % 2**31))
+            if not cur.fetchone()[0]:
+                continue
+            # another worker may have finished it after our first read
+            cur.execute("select status from normalize_shards where shard_id = %s", (shard[0],))
+            if cur.fetchone()[0] == "pending":
+                conn.commit()
+                return shard
+            release_shard(cur, shard[0])
+    conn.commit()
+    return None
+
+
+def release_shard(cur, shard_id):
+    cur.execute("select pg_advisory_unlock(hashtext(%s), %s::integer)", (SHARD_LOCK_KEY, shard_id % 2**31))
+
+
+def advance_watermark(cur, source_system):
+    """
+    Move the watermark to the end of the done shards below the first
+    pending one (never backwards), and forget the shards it passed.
+    """
+    cur.execute(
+        """
+        select coalesce(
+            (select min(from_raw_id) from normalize_shards where source_system = %s and status = 'pending'),
+            (select max(to_raw_id) from normalize_shards where source_system = %s)
+        )
+        """,
+        (source_system, source_system),
+    )
+    watermark = cur.fetchone()[0]
+    if watermark is None:
+        return
+    set_watermark(cur, source_system, watermark)
+    cur.execute(
+        "delete from normalize_shards where source_system = %s and status = 'done' and to_raw_id <= %s",
+        (source_system, watermark),
+    )
+
+
+def update_combined_run(cur, plan_run_id):
+    """
+    Recompute the combined dq_run_stats row from its workers' rows.
+    """
+    # workers finishing together would each sum without the other's
+    # uncommitted row; the row lock makes the later one wait, and its sum
+    # (a new statement, a new snapshot) then sees the earlier commit. Not
+    # FOR UPDATE: each worker's own row (parent_run_id) already holds a key
+    # share lock on this row, and the two would deadlock.
+    cur.execute("select 1 from dq_run_stats where run_id = %s for no key update", (plan_run_id,))
+    cur.execute(
+        """
+        update dq_run_stats p
+        set processed_count = s.processed,
+            inserted_count = s.inserted,
+            skipped_count = s.skipped,
+            error_count = s.errors,
+            warning_count = s.warnings,
+            finished_at = s.finished_at
+        from (
+            select sum(processed_count) as processed,
+                   sum(inserted_count) as inserted,
+                   sum(skipped_count) as skipped,
+                   sum(error_count) as errors,
+                   sum(warning_count) as warnings,
+                   max(finished_at) as finished_at
+            from dq_run_stats
+            where parent_run_id = %s
+        ) s
+        where p.run_id = %s and s.processed is not null
+        """,
+        (plan_run_id, plan_run_id),
+    )
+
+
+def normalize_shard(conn, partitions_conn, shard, transform, worker_run, *, worker, batch_size, dq_flush_size,
+                    refresh):
+    """
+    Normalize one claimed shard in one transaction; returns its counts.
+    `worker_run` is the worker's run of this shard's sharded run (see
+    run_worker): the shard's counts go into the worker's dq_run_stats row,
+    which the worker's first shard creates.
+    """
+    shard_id, from_raw_id, to_raw_id, plan_run_id = shard
+    metrics = worker_run["metrics"]
+
+    with conn:
+        with conn.cursor() as cur, conn.cursor(name=f"raw_karamad_shard_{shard_id}") as raw_cur:
+            dq = DQWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            rejects = RejectWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            partitions = CanonicalPartitions(cur, conn=partitions_conn)
+
+            raw_cur.itersize = batch_size
+            with metrics.stage("fetch"):
+                raw_cur.execute(RAW_SELECT_SQL, (SOURCE_SYSTEM, from_raw_id, to_raw_id, to_raw_id))
+            batches = iter(lambda: raw_cur.fetchmany(batch_size), [])
+
+            run = transform_batches(cur, batches, transform, dq, rejects, metrics, partitions)
+            run_id = worker_run["run_id"]
+            if run["lineage"] is not None:
+                run_id = finish_run(cur, run, dq, rejects, metrics, refresh=refresh,
+                                    started_at=worker_run["started_at"], clock=worker_run["clock"],
+                                    parent_run_id=plan_run_id, run_id=run_id)
+
+            cur.execute(
+                """
+                update normalize_shards
+                set status = 'done', run_id = %s, worker = %s, finished_at = now()
+                where shard_id = %s
+                """,
+                (run_id, worker, shard_id),
+            )
+            update_combined_run(cur, plan_run_id)
+            advance_watermark(cur, SOURCE_SYSTEM)
+
+    # committed: later shards of this run add to the same row
+    worker_run["run_id"] = run_id
+    return {"shard_id": shard_id, "run_id": run_id, "processed": run["processed"],
+            "inserted": run["inserted"], "skipped": run["skipped"]}
+
+
+def run_worker(engine="row", batch_size=DEFAULT_BATCH_SIZE, dq_flush_size=1000, refresh=True):
+    """
+    Worker process: normalize pending shards until none is left. The
+    worker keeps one dq_run_stats row (and one set of pipeline_run_metrics
+    rows) per sharded run it worked on, updated with each shard.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    transform = get_engine(engine)
+    conn = connect()
+    partitions_conn = connect()
+    done = []
+    # plan_run_id -> this worker's run of it
+    worker_runs = {}
+    try:
+        with conn.cursor() as cur:
+            date_lookup.load(cur)
+        conn.commit()
+
+        while True:
+            shard = claim_shard(conn, SOURCE_SYSTEM)
+            if shard is None:
+                break
+            worker_run = worker_runs.setdefault(shard[3], {
+                "run_id": None,
+                "metrics": RunMetrics(),
+                "started_at": datetime.now(tz=timezone.utc),
+                "clock": time.perf_counter(),
+            })
+            try:
+                done.append(normalize_shard(
+                    conn, partitions_conn, shard, transform, worker_run,
+                    worker=worker, batch_size=batch_size, dq_flush_size=dq_flush_size, refresh=refresh,
+                ))
+            finally:
+                with conn.cursor() as cur:
+                    release_shard(cur, shard[0])
+                conn.commit()
+    finally:
+        partitions_conn.close()
+        conn.close()
+    return done
+
+
+def normalize_sharded(workers, batch_size=DEFAULT_BATCH_SIZE, dq_flush_size=1000, engine="row", refresh=True):
+    """
+    Plan new RAW rows as shards and normalize them with `workers` processes
+    (shards left by an earlier or concurrent run are worked on too).
+    Returns the counts of the shards this call normalized.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            plan_run_id = plan_shards(cur, SOURCE_SYSTEM, workers)
+    conn.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_worker, engine, batch_size, dq_flush_size, refresh) for _ in range(workers)]
+        shards = [s for f in futures for s in f.result()]
+
+    # shards that finished together may each have seen the other pending
+    with connect() as conn:
+        with conn.cursor() as cur:
+            advance_watermark(cur, SOURCE_SYSTEM)
+            if plan_run_id is not None:
+                update_combined_run(cur, plan_run_id)
+    conn.close()
+
+    if not shards:
+        print("No new rows to normalize.")
+        return None
+
+    processed = sum(s["processed"] for s in shards)
+    inserted = sum(s["inserted"] for s in shards)
+    skipped = sum(s["skipped"] for s in shards)
+    combined = f" (combined run_id: {plan_run_id})" if plan_run_id else ""
+    print(f"Shards: {len(shards)} on {workers} workers{combined}")
+    print(f"Processed: {processed}")
+    print(f"Inserted (attempted): {inserted}")
+    print(f"Skipped: {skipped} (quarantined in canonical_rejects)")
+    return {"run_id": plan_run_id, "processed": processed, "inserted": inserted, "skipped": skipped,
+            "shards": shards}
@@ -0,0 +1,521 @@
+"""
+Set-based, in-database normalization compiled from a mapping file.
+
+The mapping (config/mapping_<source>.yml: source column -> target, type,
+required) is compiled into a few SQL statements that run entirely inside
+Postgres: one builds a temp stage of the new RAW rows with every value
+parsed and every rule evaluated, one inserts the DQ issues, one quarantines
+the rejected rows, one inserts the canonical rows. No RAW row is pulled
+into Python.
+
+The rules are those of normalize_karamad.normalize_row(), with two
+documented limits: numbers with exponents beyond three digits, NaN /
+Infinity and underscore digit groups are INVALID_NUMERIC here, and Jalali
+dates resolve through dim_date only (load it for the whole data range).
+DQ issues are the same set as the row engine, not in the same dq_id order.
+"""
+import argparse
+import re
+import time
+from datetime import datetime, timezone
+
+import yaml
+
+from src.common.telemetry import RunMetrics
+from src.transform.dq import REJECT_UPSERT_SQL
+from src.transform.dq_contract import DQIssueCode, DQSeverity
+from src.transform.kpi_refresh import refresh_kpis
+from src.transform.normalize_karamad import (
+    CANONICAL_COLUMNS,
+    committed_raw_ceiling,
+    connect,
+    get_watermark,
+    pending_shards,
+    set_watermark,
+    write_run_stats,
+)
+
+# canonical roles the rules need, by value type
+TEXT_TARGETS = [
+    "invoice_id",
+    "customer_id",
+    "product_id",
+    "salesperson_id",
+    "transaction_type",
+    "system_date_jalali",
+    "reference_date_jalali",
+]
+NUMERIC_TARGETS = [
+    "quantity",
+    "unit_price",
+    "gross_amount",
+    "discount_volume",
+    "discount_cash",
+    "net_amount",
+]
+
+RETURN_MARKER = "برگشت"
+
+_IDENTIFIER_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+# what Decimal() accepts, minus NaN / Infinity / '_' (see module docstring)
+NUMERIC_RE = r"^[+-]?([0-9]+(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]{1,3})?$"
+JALALI_RE = r"^\s*0*([0-9]{1,4})/0*([0-9]{1,2})/0*([0-9]{1,2})\s*$"
+# Persian and Arabic-Indic digits (Decimal() / int() read them as digits)
+_EASTERN_DIGITS = "۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩"
+_ASCII_DIGITS = "0123456789" * 2
+
+
+class MappingError(ValueError):
+    """The mapping file does not describe every role the rules need."""
+
+
+class CompiledMapping:
+    """
+    SQL pieces of one source's mapping.
+
+    `text` / `numeric`: target -> RAW column; `required_numeric`: numeric
+    targets whose parse failure rejects the row (INVALID_NUMERIC), in
+    mapping order.
+    """
+
+    def __init__(self, source_system, text, numeric, required_numeric):
+        self.source_system = source_system
+        self.raw_table = f"raw_{source_system}_sales"
+        self.text = text
+        self.numeric = numeric
+        self.required_numeric = required_numeric
+
+
+def load_mapping(source_system, path=None):
+    path = path or f"config/mapping_{source_system}.yml"
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def compile_mapping(source_system, mapping):
+    """
+    Validate a mapping and resolve each canonical role to its RAW column.
+    """
+    if not _IDENTIFIER_RE.match(source_system):
+        raise MappingError(f"Invalid source system name: {source_system!r}")
+
+    text, numeric, required_numeric = {}, {}, []
+    for column, spec in mapping.items():
+        if not _IDENTIFIER_RE.match(column):
+            raise MappingError(f"Invalid RAW column name: {column!r}")
+        target, kind = spec.get("target"), spec.get("type", "text")
+        if kind == "numeric":
+            if target not in NUMERIC_TARGETS:
+                raise MappingError(f"{column}: {target!r} is not a numeric target")
+            numeric[target] = column
+            if spec.get("required"):
+                required_numeric.append(target)
+        elif kind == "text":
+            if target not in TEXT_TARGETS:
+                raise MappingError(f"{column}: {target!r} is not a text target")
+            text[target] = column
+        else:
+            raise MappingError(f"{column}: unknown type {kind!r}")
+
+    missing = [t for t in TEXT_TARGETS if t not in text] + [t for t in NUMERIC_TARGETS if t not in numeric]
+    if missing:
+        raise MappingError(f"Mapping for {source_system} has no column for: {', '.join(missing)}")
+
+    return CompiledMapping(source_system, text, numeric, required_numeric)
+
+
+# =========================
+# SQL compilation
+# =========================
+def _clean_numeric(column):
+    # parse_numeric(): drop thousands separators, strip whitespace
+    return (
+        f"regexp_replace(translate(replace(r.{column}, ',', ''), "
+        f"'{_EASTERN_DIGITS}', '{_ASCII_DIGITS}'), '^\\s+|\\s+$', '', 'g')"
+    )
+
+
+def stage_sql(m):
+    """
+    CREATE TEMP TABLE normalize_stage: one row per new RAW row, with parsed
+    values, rule flags, the event date and its Gregorian date.
+
+    Parameters: source_system, since_raw_id, until_raw_id, return_marker.
+    """
+    cleaned = ",\n                ".join(
+        f"{_clean_numeric(col)} as {target}" for target, col in m.numeric.items()
+    )
+    text_cols = ",\n            ".join(f"r.{col} as {target}" for target, col in m.text.items())
+
+    numerics = []
+    for target in NUMERIC_TARGETS:
+        parsed = f"case when c.{target} ~ '{NUMERIC_RE}' then c.{target}::numeric end"
+        if target in m.required_numeric:
+            numerics.append(f"{parsed} as {target}")
+        else:
+            # `parse_numeric(x) or Decimal(0)`
+            numerics.append(f"coalesce({parsed}, 0) as {target}")
+    numerics = ",\n            ".join(numerics)
+
+    invalid_numeric = " or ".join(f"p.{t} is null" for t in m.required_numeric) or "false"
+
+    return f"""
+        create temp table normalize_stage on commit drop as
+        select
+            v.*,
+            d.date_gregorian as invoice_date_gregorian,
+            v.numeric_ok and d.date_gregorian is null as invalid_date,
+            v.numeric_ok and d.date_gregorian is not null as ok
+        from (
+            select
+                p.*,
+                not p.missing_invoice and ({invalid_numeric}) as invalid_numeric,
+                not p.missing_invoice and not ({invalid_numeric}) as numeric_ok,
+                case
+                    when p.is_return then p.system_date_jalali
+                    else coalesce(nullif(p.reference_date_jalali, ''), p.system_date_jalali)
+                end as event_date_jalali
+            from (
+                select
+                    q.*,
+                    q.invoice_id is null or q.invoice_id ~ '^\\s*$' as missing_invoice,
+                    case
+                        when q.net_amount is not null and q.quantity is not null
+                            then q.net_amount < 0 or q.quantity < 0
+                        else coalesce(strpos(q.transaction_type, %(return_marker)s) > 0, false)
+                    end as is_return
+                from (
+                    select
+                        r.raw_id,
+                        r.source_system,
+                        r.source_file,
+                        r.load_batch_id,
+                        r.row_hash,
+                        r.ingested_at,
+                        {text_cols},
+                        {numerics}
+                    from {m.raw_table} r
+                    cross join lateral (
+                        select
+                            {cleaned}
+                    ) c
+                    where r.source_system = %(source_system)s
+                      and r.raw_id > %(since_raw_id)s
+                      and r.raw_id <= %(until_raw_id)s
+                ) q
+            ) p
+        ) v
+        left join lateral (
+            select
+                lpad(j[1], 4, '0') || '/' || lpad(j[2], 2, '0') || '/' || lpad(j[3], 2, '0') as date_jalali
+            from (
+                select regexp_match(
+                    translate(v.event_date_jalali, '{_EASTERN_DIGITS}', '{_ASCII_DIGITS}'),
+                    '{JALALI_RE}'
+                ) as j
+            ) jm
+        ) k on true
+        left join dim_date d on d.date_jalali = k.date_jalali
+    """
+
+
+def _issue(code, severity, where, record_key, column_name, raw_value, description):
+    return f"""
+            select
+                source_system, source_file, load_batch_id, 'CANONICAL',
+                {record_key}, '{code}', '{severity}', '{description}',
+                {column_name}, {raw_value}
+            from normalize_stage
+            where {where}"""
+
+
+def dq_sql(m):
+    """
+    INSERT INTO dq_issues ... SELECT for every rule over normalize_stage.
+    """
+    bad_cols = ", ".join(f"case when {t} is null then '{t}' end" for t in m.required_numeric)
+    rules = [
+        _issue(
+            DQIssueCode.MISSING_INVOICE_ID, DQSeverity.ERROR, "missing_invoice",
+            "null", "'invoice_id'", "invoice_id",
+            "invoice_id is missing or empty.",
+        ),
+        _issue(
+            DQIssueCode.INVALID_NUMERIC, DQSeverity.ERROR, "invalid_numeric",
+            "invoice_id", f"nullif(concat_ws(',', {bad_cols or 'null'}), '')", "null",
+            "One or more numeric fields failed to parse to Decimal.",
+        ),
+        _issue(
+            DQIssueCode.POSITIVE_QTY_ON_RETURN, DQSeverity.WARNING, "numeric_ok and is_return and quantity > 0",
+            "invoice_id", "'quantity'", "quantity::text",
+            "Transaction type is RETURN but quantity is positive.",
+        ),
+        _issue(
+            DQIssueCode.FALLBACK_EVENT_DATE, DQSeverity.WARNING,
+            "numeric_ok and not is_return and coalesce(reference_date_jalali, '') = ''",
+            "invoice_id", "'reference_date_jalali'", "null",
+            "Falling back to system_date_jalali for event_date_jalali because reference_date_jalali is missing.",
+        ),
+        _issue(
+            DQIssueCode.NEGATIVE_QTY_ON_SALE, DQSeverity.WARNING, "numeric_ok and not is_return and quantity < 0",
+            "invoice_id", "'quantity'", "quantity::text",
+            "Transaction type is SALE but quantity is negative.",
+        ),
+        _issue(
+            DQIssueCode.SIGN_MISMATCH_QTY_AMOUNT, DQSeverity.WARNING,
+            "numeric_ok and quantity <> 0 and net_amount <> 0 and (quantity > 0) <> (net_amount > 0)",
+            "invoice_id", "'quantity, net_amount'",
+            "'quantity=' || quantity || ', net_amount=' || net_amount",
+            "Quantity and Net Amount have opposite signs.",
+        ),
+        _issue(
+            DQIssueCode.INVALID_DATE, DQSeverity.ERROR, "invalid_date",
+            "invoice_id", "'event_date_jalali'", "nullif(event_date_jalali, '')",
+            "event_date_jalali could not be parsed (jalali_to_gregorian returned None)",
+        ),
+    ]
+    return f"""
+        insert into dq_issues (
+            source_system,
+            source_file,
+            load_batch_id,
+            table_stage,
+            record_business_key,
+            issue_code,
+            issue_severity,
+            issue_description,
+            column_name,
+            raw_value
+        )
+        {" union all".join(rules)}
+    """
+
+
+def rejects_sql(m):
+    """
+    Upsert the rejected stage rows into canonical_rejects (same reasons and
+    details as the row engine).
+    """
+    return REJECT_UPSERT_SQL.format(rows="""
+    select
+        source_system,
+        row_hash,
+        case
+            when missing_invoice then 'missing_invoice_id'
+            when invalid_numeric then 'invalid_numeric'
+            else 'missing_event_date'
+        end,
+        raw_id,
+        source_file,
+        load_batch_id,
+        invoice_id,
+        case when invalid_date then jsonb_build_object(
+            'transaction_type', case when is_return then 'RETURN' else 'SALE' end,
+            'system_date_jalali', system_date_jalali,
+            'reference_date_jalali', reference_date_jalali
+        ) end
+    from normalize_stage
+    where not ok""")
+
+
+def canonical_sql(m):
+    """
+    INSERT INTO canonical_sales ... SELECT of the accepted stage rows whose
+    raw row claims its canonical_row_keys entry (as CANONICAL_INSERT_SQL).
+    """
+    return f"""
+        with new_keys as (
+            insert into canonical_row_keys (source_system, raw_row_hash, invoice_date_gregorian)
+            select source_system, row_hash, invoice_date_gregorian
+            from normalize_stage
+            where ok
+            on conflict do nothing
+            returning source_system, raw_row_hash
+        )
+        insert into canonical_sales ({", ".join(CANONICAL_COLUMNS)})
+        select
+            source_system,
+            source_file,
+            load_batch_id,
+            row_hash,
+
+            invoice_id,
+            customer_id,
+            product_id,
+            salesperson_id,
+
+            event_date_jalali,
+            invoice_date_gregorian,
+
+            case when is_return then 'RETURN' else 'SALE' end,
+            case when is_return then -1 else 1 end,
+
+            quantity,
+            unit_price,
+            gross_amount,
+            discount_volume + discount_cash,
+            net_amount,
+
+            ingested_at
+        from normalize_stage
+        where ok
+          and (source_system, row_hash) in (select source_system, raw_row_hash from new_keys)
+        order by raw_id
+        on conflict (source_system, raw_row_hash, invoice_date_gregorian) do nothing
+    """
+
+
+SUMMARY_SQL = """
+    select
+        first.source_system,
+        first.source_file,
+        first.load_batch_id,
+        s.processed,
+        s.inserted,
+        s.last_raw_id,
+        s.error_count,
+        s.warning_count
+    from (
+        select
+            count(*) as processed,
+            count(*) filter (where ok) as inserted,
+            max(raw_id) as last_raw_id,
+            count(*) filter (where missing_invoice or invalid_numeric or invalid_date) as error_count,
+            count(*) filter (where numeric_ok and is_return and quantity > 0)
+              + count(*) filter (where numeric_ok and not is_return and coalesce(reference_date_jalali, '') = '')
+              + count(*) filter (where numeric_ok and not is_return and quantity < 0)
+              + count(*) filter (
+                    where numeric_ok and quantity <> 0 and net_amount <> 0 and (quantity > 0) <> (net_amount > 0)
+                ) as warning_count
+        from normalize_stage
+    ) s
+    cross join lateral (
+        select source_system, source_file, load_batch_id
+        from normalize_stage
+        order by raw_id
+        limit 1
+    ) first
+"""
+
+ENSURE_PARTITIONS_SQL = """
+    select ensure_monthly_partitions('canonical_sales', min(invoice_date_gregorian), max(invoice_date_gregorian))
+    from normalize_stage
+    where ok
+"""
+
+TOUCHED_DAYS_SQL = "select distinct invoice_date_gregorian from normalize_stage where ok"
+
+
+# =========================
+# Run
+# =========================
+def normalize_in_db(source_system, mapping_path=None, full=False, refresh=True):
+    """
+    Normalize new RAW rows of `source_system` inside Postgres (one
+    transaction). Same watermark, KPI refresh and run bookkeeping as
+    normalize_karamad.normalize().
+    """
+    m = compile_mapping(source_system, load_mapping(source_system, mapping_path))
+    run_started_at = datetime.now(tz=timezone.utc)
+    metrics = RunMetrics()
+    run_clock = time.perf_counter()
+
+    with connect() as conn:
+        with conn.cursor() as cur:
+            since_raw_id = 0 if full else get_watermark(cur, source_system)
+            if pending_shards(cur, source_system):
+                print("A sharded run is still in progress; finish it with normalize_karamad --workers.")
+                return None
+            # not past uncommitted raw_ids of loads in flight
+            until_raw_id = committed_raw_ceiling(cur)
+
+            with metrics.stage("stage") as stage:
+                cur.execute(stage_sql(m), {
+                    "source_system": source_system,
+                    "since_raw_id": since_raw_id,
+                    "until_raw_id": until_raw_id,
+                    "return_marker": RETURN_MARKER,
+                })
+                stage.rows = cur.rowcount
+
+            with metrics.stage("summary"):
+                cur.execute(SUMMARY_SQL)
+                row = cur.fetchone()
+            if row is None:
+                print("No new rows to normalize, skipping DQ run stats logging.")
+                return
+            (
+                run_source_system, run_source_file, run_load_batch_id,
+                processed, inserted, last_raw_id, error_count, warning_count,
+            ) = row
+
+            with metrics.stage("dq_write") as dq_stage:
+                cur.execute(dq_sql(m))
+                dq_stage.rows = cur.rowcount
+            with metrics.stage("reject_write", rows=processed - inserted):
+                cur.execute(rejects_sql(m))
+            with metrics.stage("canonical_write", rows=inserted):
+                cur.execute(ENSURE_PARTITIONS_SQL)
+                cur.execute(canonical_sql(m))
+
+            set_watermark(cur, source_system, last_raw_id)
+            if refresh:
+                with metrics.stage("kpi_refresh"):
+                    cur.execute(TOUCHED_DAYS_SQL)
+                    refresh_kpis(cur, [d for (d,) in cur.fetchall()])
+
+            run_id = write_run_stats(
+                cur,
+                source_system=run_source_system,
+                source_file=run_source_file,
+                load_batch_id=run_load_batch_id,
+                processed=processed,
+                inserted=inserted,
+                skipped=processed - inserted,
+                error_count=error_count,
+                warning_count=warning_count,
+                started_at=run_started_at,
+                finished_at=datetime.now(tz=timezone.utc),
+            )
+
+            metrics.finish(run_clock, processed)
+            metrics.write(
+                cur,
+                pipeline="normalize",
+                source_system=run_source_system,
+                source_file=run_source_file,
+                load_batch_id=run_load_batch_id,
+                run_id=run_id,
+            )
+
+    print(f"Processed: {processed}")
+    print(f"Inserted (attempted): {inserted}")
+    print(f"Skipped: {processed - inserted} (quarantined in canonical_rejects)")
+    print("Stages:")
+    print(metrics.summary())
+
+    return {"run_id": run_id, "processed": processed, "inserted": inserted, "skipped": processed - inserted,
+            "last_raw_id": last_raw_id}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Normalize RAW rows inside Postgres, compiled from a mapping file.")
+    ap.add_argument("--source", default="karamad", help="source system (RAW table raw_<source>_sales)")
+    ap.add_argument("--mapping", help="mapping file (default: config/mapping_<source>.yml)")
+    ap.add_argument("--full", action="store_true", help="ignore the watermark and rescan all of RAW")
+    ap.add_argument("--no-refresh", action="store_true", help="do not refresh the KPI tables")
+    ap.add_argument("--print-sql", action="store_true", help="print the compiled statements and exit")
+    args = ap.parse_args()
+
+    if args.print_sql:
+        m = compile_mapping(args.source, load_mapping(args.source, args.mapping))
+        for sql in (stage_sql(m), dq_sql(m), rejects_sql(m), canonical_sql(m)):
+            print(sql.strip(), end=";\n\n")
+        return
+
+    normalize_in_db(args.source, mapping_path=args.mapping, full=args.full, refresh=not args.no_refresh)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Monthly partitions of canonical_sales and raw_karamad_sales (migration 008).
+
+Partitions are created on demand (since migration 012 by create + attach,
+which takes a share update exclusive lock on the parent); callers ensure
+partitions before their first write and only for months they have not
+seen yet in the run.
+"""
+import argparse
+from datetime import date
+
+
+def month_of(d):
+    return d.replace(day=1)
+
+
+def ensure_partitions(cur, table, months):
+    """
+    Create the monthly partitions of `table` for `months` (first days) that
+    do not exist yet. Returns the number created.
+    """
+    created = 0
+    for m in sorted(set(months)):
+        cur.execute("select ensure_monthly_partitions(%s, %s, %s)", (table, m, m))
+        created += cur.fetchone()[0]
+    return created
+
+
+class CanonicalPartitions:
+    """
+    Remembers which canonical months a run already ensured, so each batch
+    only costs a round trip when it brings a new month.
+
+    With `conn`, partitions are created in their own short transactions on
+    that connection: concurrent writers (normalize_shards) would otherwise
+    hold the parent lock until their commit and queue up behind each other.
+    """
+
+    def __init__(self, cur, conn=None):
+        self.cur = cur
+        self.conn = conn
+        self.seen = set()
+
+    def ensure(self, days):
+        months = {month_of(d) for d in days} - self.seen
+        if not months:
+            return
+        if self.conn is None:
+            ensure_partitions(self.cur, "canonical_sales", months)
+        else:
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    ensure_partitions(cur, "canonical_sales", months)
+        self.seen |= months
+
+
+def ensure_raw_partition(conn):
+    """
+    Ensure the RAW partitions of this and next month, in their own short
+    transaction (a load transaction must not hold the parent lock).
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "select ensure_monthly_partitions('raw_karamad_sales', current_date, "
+                "(current_date + interval '1 month')::date)"
+            )
+
+
+def main():
+    from src.transform.normalize_karamad import connect
+
+    ap = argparse.ArgumentParser(description="Manage canonical_sales month partitions.")
+    ap.add_argument("--drop-month", required=True, metavar="YYYY-MM",
+                    help="drop one Gregorian month of canonical_sales and clear its KPI rows")
+    args = ap.parse_args()
+
+    year, month = map(int, args.drop_month.split("-"))
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("select drop_canonical_month(%s)", (date(year, month, 1),))
+    conn.close()
+
+    # canonical_row_keys still lists the month's rows, which renormalize reads
+    print(f"canonical_sales {args.drop_month} dropped; reload it with "
+          f"`python -m src.transform.renormalize --month {args.drop_month}`.")
+
+
+if __name__ == "__main__":
+    main()
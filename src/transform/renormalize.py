@@ -0,0 +1,304 @@
+"""
+Scoped re-normalization: re-derive the canonical rows of one source file,
+load batch or (Gregorian) invoice month after a rule or mapping fix,
+without truncating canonical_sales.
+
+The RAW rows of the scope go through the usual transform into a temp
+stage, then, in the same transaction:
+
+- canonical rows of those RAW rows that no longer match the stage (now
+  rejected, or moved to another invoice date) are deleted;
+- canonical_row_keys follows: keys of rows now rejected are dropped, keys
+  of moved rows get their new date;
+- the stage is upserted: new rows are inserted, existing rows are updated
+  only where a derived value differs;
+- the KPIs of the days that actually changed are refreshed.
+
+Rows that pass now leave canonical_rejects; rows rejected now are
+quarantined there. DQ issues of the re-derived rows are logged again under
+this run. The normalize watermark does not move. RAW rows that were
+archived are out of scope, and their canonical rows are kept.
+"""
+import argparse
+import time
+from datetime import date, datetime, timezone
+
+from psycopg2.extras import execute_values
+
+from src.common.telemetry import RunMetrics
+from src.transform.dq import DQWriter, RejectWriter
+from src.transform.normalize_karamad import (
+    CANONICAL_COLUMNS,
+    DEFAULT_BATCH_SIZE,
+    INVOICE_DATE_INDEX,
+    RAW_COLUMNS_SQL,
+    SOURCE_SYSTEM,
+    connect,
+    date_lookup,
+    finish_run,
+    get_engine,
+)
+from src.transform.partitions import CanonicalPartitions
+
+SCOPES = ("source_file", "load_batch_id", "month")
+
+# position of row_hash in RAW_COLUMNS_SQL
+_ROW_HASH = 4
+
+# the upsert key, never updated
+KEY_COLUMNS = ("source_system", "raw_row_hash", "invoice_date_gregorian")
+UPDATE_COLUMNS = [c for c in CANONICAL_COLUMNS if c not in KEY_COLUMNS]
+
+STAGE_SQL = f"""
+    create temp table renormalize_stage on commit drop as
+    select {", ".join(CANONICAL_COLUMNS)} from canonical_sales limit 0;
+
+    create temp table renormalize_hashes (raw_row_hash bytea primary key) on commit drop;
+"""
+
+SCOPE_RAW_SQL = f"""
+    select{RAW_COLUMNS_SQL}    from raw_karamad_sales
+    where source_system = %s
+      and {{raw_where}}
+    order by raw_id
+"""
+
+STAGE_INSERT_SQL = f"insert into renormalize_stage ({', '.join(CANONICAL_COLUMNS)}) values %s"
+HASHES_INSERT_SQL = "insert into renormalize_hashes (raw_row_hash) values %s"
+
+# canonical rows of the re-derived RAW rows that the stage no longer has
+DELETE_STALE_SQL = """
+    with gone as (
+        delete from canonical_sales c
+        using renormalize_hashes h
+        where c.source_system = %s
+          and {canonical_where}
+          and c.raw_row_hash = h.raw_row_hash
+          and not exists (
+              select 1 from renormalize_stage s
+              where s.source_system = c.source_system
+                and s.raw_row_hash = c.raw_row_hash
+                and s.invoice_date_gregorian = c.invoice_date_gregorian
+          )
+        returning c.invoice_date_gregorian
+    )
+    select invoice_date_gregorian, count(*) from gone group by invoice_date_gregorian
+"""
+
+# one key per re-derived row that passed, with its (new) date
+SYNC_KEYS_SQL = """
+    delete from canonical_row_keys k
+    using renormalize_hashes h
+    where k.source_system = %(source_system)s
+      and k.raw_row_hash = h.raw_row_hash
+      and not exists (select 1 from renormalize_stage s where s.raw_row_hash = k.raw_row_hash);
+
+    insert into canonical_row_keys (source_system, raw_row_hash, invoice_date_gregorian)
+    select source_system, raw_row_hash, invoice_date_gregorian from renormalize_stage
+    on conflict (source_system, raw_row_hash) do update
+    set invoice_date_gregorian = excluded.invoice_date_gregorian
+    where canonical_row_keys.invoice_date_gregorian <> excluded.invoice_date_gregorian;
+"""
+
+# only rows whose derived values differ are rewritten; updates and inserts
+# are separate statements because xmax (inserted or not?) cannot be
+# returned from the partitioned table. The insert skips rows the update
+# sees, as both run on the statement's snapshot.
+UPSERT_SQL = f"""
+    with updated as (
+        update canonical_sales c
+        set {", ".join(f"{col} = s.{col}" for col in UPDATE_COLUMNS)},
+            canonical_loaded_at = now()
+        from renormalize_stage s
+        where {" and ".join(f"c.{col} = s.{col}" for col in KEY_COLUMNS)}
+          and ({", ".join(f"c.{col}" for col in UPDATE_COLUMNS)})
+              is distinct from ({", ".join(f"s.{col}" for col in UPDATE_COLUMNS)})
+        returning c.invoice_date_gregorian
+    ),
+    inserted as (
+        insert into canonical_sales ({", ".join(CANONICAL_COLUMNS)})
+        select {", ".join(f"s.{col}" for col in CANONICAL_COLUMNS)} from renormalize_stage s
+        where not exists (
+            select 1 from canonical_sales c
+            where {" and ".join(f"c.{col} = s.{col}" for col in KEY_COLUMNS)}
+        )
+        on conflict ({", ".join(KEY_COLUMNS)}) do nothing
+        returning invoice_date_gregorian
+    ),
+    written as (
+        select invoice_date_gregorian, true as inserted from inserted
+        union all
+        select invoice_date_gregorian, false from updated
+    )
+    select invoice_date_gregorian, count(*) filter (where inserted), count(*) filter (where not inserted)
+    from written
+    group by invoice_date_gregorian
+"""
+
+RELEASE_SQL = """
+    delete from canonical_rejects c
+    using renormalize_hashes h
+    where c.source_system = %s
+      and c.raw_row_hash = h.raw_row_hash
+      and c.last_seen_at < now()
+"""
+
+
+def month_range(value):
+    """
+    'YYYY-MM' -> (first day, first day of the next month).
+    """
+    try:
+        year, month = map(int, value.split("-"))
+        first = date(year, month, 1)
+    except ValueError:
+        raise ValueError(f"Month must be YYYY-MM, got {value!r}") from None
+    return first, date(year + month // 12, month % 12 + 1, 1)
+
+
+def scope_sql(scope, value):
+    """
+    SQL filters of a scope: (RAW where, its params, canonical where on
+    alias c, its params).
+    """
+    if scope == "source_file":
+        return "source_file = %s", (value,), "c.source_file = %s", (value,)
+    if scope == "load_batch_id":
+        return "load_batch_id = %s", (value,), "c.load_batch_id = %s", (value,)
+    if scope == "month":
+        first, after = month_range(value)
+        # the RAW rows whose canonical row is (or, after drop_canonical_month,
+        # was) in the month
+        raw_where = """row_hash in (
+              select raw_row_hash from canonical_row_keys
+              where source_system = %s
+                and invoice_date_gregorian >= %s
+                and invoice_date_gregorian < %s
+          )"""
+        canonical_where = "c.invoice_date_gregorian >= %s and c.invoice_date_gregorian < %s"
+        return raw_where, (SOURCE_SYSTEM, first, after), canonical_where, (first, after)
+    raise ValueError(f"Unknown scope: {scope}")
+
+
+def renormalize(scope, value, batch_size=DEFAULT_BATCH_SIZE, dq_flush_size=1000, engine="row", refresh=True):
+    """
+    Re-derive the canonical rows of one scope (see SCOPES) in one
+    transaction. Returns the run's counts, or None when the scope has no
+    RAW rows.
+    """
+    raw_where, raw_params, canonical_where, canonical_params = scope_sql(scope, value)
+    run_started_at = datetime.now(tz=timezone.utc)
+    transform = get_engine(engine)
+    metrics = RunMetrics()
+    run_clock = time.perf_counter()
+
+    run = {"processed": 0, "inserted": 0, "skipped": 0, "touched_days": set(), "lineage": None}
+
+    with connect() as conn:
+        with conn.cursor() as cur, conn.cursor(name="raw_karamad_renormalize") as raw_cur:
+
+            dq = DQWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            rejects = RejectWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            partitions = CanonicalPartitions(cur)
+            with metrics.stage("setup"):
+                date_lookup.load(cur)
+                cur.execute(STAGE_SQL)
+
+            raw_cur.itersize = batch_size
+            with metrics.stage("fetch"):
+                raw_cur.execute(SCOPE_RAW_SQL.format(raw_where=raw_where), (SOURCE_SYSTEM,) + raw_params)
+
+            while True:
+                with metrics.stage("fetch") as fetch:
+                    batch = raw_cur.fetchmany(batch_size)
+                    fetch.rows += len(batch)
+                if not batch:
+                    break
+
+                if run["lineage"] is None:
+                    run["lineage"] = (batch[0][1], batch[0][2], batch[0][3])
+
+                with metrics.stage("transform", rows=len(batch)):
+                    canonical_rows = transform(batch, dq, rejects)
+                run["processed"] += len(batch)
+                run["skipped"] += len(batch) - len(canonical_rows)
+
+                with metrics.stage("stage_write", rows=len(batch)):
+                    execute_values(cur, HASHES_INSERT_SQL, [(r[_ROW_HASH],) for r in batch], page_size=len(batch))
+                    if canonical_rows:
+                        partitions.ensure({row[INVOICE_DATE_INDEX] for row in canonical_rows})
+                        execute_values(cur, STAGE_INSERT_SQL, canonical_rows, page_size=len(canonical_rows))
+
+            if run["lineage"] is None:
+                print(f"No RAW rows for {scope} {value}.")
+                return None
+
+            with metrics.stage("canonical_write") as write:
+                cur.execute(DELETE_STALE_SQL.format(canonical_where=canonical_where),
+                            (SOURCE_SYSTEM,) + canonical_params)
+                deleted_by_day = cur.fetchall()
+                cur.execute(SYNC_KEYS_SQL, {"source_system": SOURCE_SYSTEM})
+                cur.execute(UPSERT_SQL)
+                written_by_day = cur.fetchall()
+
+                deleted = sum(n for _, n in deleted_by_day)
+                inserted = sum(n for _, n, _ in written_by_day)
+                updated = sum(n for _, _, n in written_by_day)
+                write.rows = deleted + inserted + updated
+
+            # only days whose canonical rows changed
+            run["touched_days"] = {d for d, _ in deleted_by_day} | {d for d, _, _ in written_by_day}
+            run["inserted"] = inserted + updated
+
+            rejects.flush()
+            with metrics.stage("release") as release:
+                cur.execute(RELEASE_SQL, (SOURCE_SYSTEM,))
+                release.rows = cur.rowcount
+            released = release.rows
+
+            run_id = finish_run(cur, run, dq, rejects, metrics, refresh=refresh, started_at=run_started_at,
+                                clock=run_clock)
+
+    print(f"Re-derived: {run['processed']} RAW rows of {scope} {value}")
+    print(f"Canonical: {inserted} inserted, {updated} updated, {deleted} deleted, "
+          f"{run['processed'] - run['skipped'] - inserted - updated} unchanged")
+    print(f"Rejected: {rejects.count} (released from quarantine: {released})")
+    print(f"KPI days refreshed: {len(run['touched_days']) if refresh else 0}")
+    print("Stages:")
+    print(metrics.summary())
+
+    return {"run_id": run_id, "processed": run["processed"], "inserted": inserted, "updated": updated,
+            "deleted": deleted, "skipped": run["skipped"], "released": released,
+            "touched_days": sorted(run["touched_days"])}
+
+
+# =========================
+# Entry point
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Re-derive the canonical rows of one file, load batch or month.")
+    scope = ap.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--source-file", help="RAW source_file of one export")
+    scope.add_argument("--batch-id", help="one load_batch_id")
+    scope.add_argument("--month", help="YYYY-MM: canonical rows with invoice_date_gregorian in this month")
+    ap.add_argument("--engine", choices=["row", "columnar"], default="row")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--no-refresh", action="store_true", help="do not refresh the KPI tables")
+    args = ap.parse_args()
+
+    if args.source_file:
+        scope, value = "source_file", args.source_file
+    elif args.batch_id:
+        scope, value = "load_batch_id", args.batch_id
+    else:
+        scope, value = "month", args.month
+        try:
+            month_range(value)
+        except ValueError as e:
+            ap.error(str(e))
+
+    renormalize(scope, value, batch_size=args.batch_size, engine=args.engine, refresh=not args.no_refresh)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Retry quarantined rows (canonical_rejects, migration 013) after a rule or
+mapping fix, without rescanning RAW.
+
+Only the RAW rows behind the selected rejects are read (by raw_id) and run
+through the usual transform, canonical write, KPI refresh and run
+bookkeeping, in one transaction; the normalize watermark does not move.
+Rows that pass now leave the quarantine; rows still rejected stay, with one
+more attempt (under their new reason if it changed). Rows of archived
+batches (rejected again by `normalize_karamad --from-archive`) are read
+back from their archive files instead (raw_archive_batches; needs
+pyarrow).
+"""
+import argparse
+import itertools
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from src.common.telemetry import RunMetrics
+from src.transform.dq import DQWriter, RejectWriter
+from src.transform.normalize_karamad import (
+    DEFAULT_BATCH_SIZE,
+    RAW_COLUMNS_SQL,
+    SOURCE_SYSTEM,
+    connect,
+    date_lookup,
+    finish_run,
+    get_engine,
+    transform_batches,
+)
+from src.transform.partitions import CanonicalPartitions
+
+# raw_ids of the rejects to retry
+SCOPE_SQL = """
+    create temp table reprocess_scope on commit drop as
+    select distinct c.raw_id
+    from canonical_rejects c
+    where c.source_system = %s
+      and (%s::text[] is null or c.reason = any(%s))
+      and (%s::text[] is null or c.load_batch_id = any(%s))
+"""
+
+REJECTED_RAW_SQL = f"""
+    select{RAW_COLUMNS_SQL}    from raw_karamad_sales
+    where source_system = %s
+      and raw_id in (select raw_id from reprocess_scope)
+    order by raw_id
+"""
+
+# archive files holding scope rows that left RAW, with those raw_ids
+ARCHIVED_SQL = """
+    select b.archive_path, array_agg(a.raw_id order by a.raw_id)
+    from reprocess_scope s
+    join raw_karamad_archived a on a.raw_id = s.raw_id
+    join raw_archive_batches b
+      on b.source_system = a.source_system
+     and b.load_batch_id = a.load_batch_id
+     and a.raw_id between b.min_raw_id and b.max_raw_id
+    where a.source_system = %s
+    group by b.archive_path
+    order by min(a.raw_id)
+"""
+
+# rejects of the scope this run did not reject again (now() is the
+# transaction start, so every upsert of this run has last_seen_at = now())
+RELEASE_SQL = """
+    delete from canonical_rejects c
+    using reprocess_scope s
+    where c.raw_id = s.raw_id
+      and c.source_system = %s
+      and c.last_seen_at < now()
+"""
+
+SUMMARY_SQL = """
+    select
+        c.reason,
+        count(*),
+        count(*) filter (where exists (
+            select 1 from raw_karamad_sales r
+            where r.raw_id = c.raw_id and r.source_system = c.source_system
+        )),
+        count(*) filter (where exists (
+            select 1 from raw_karamad_archived a
+            where a.raw_id = c.raw_id and a.source_system = c.source_system
+        )),
+        sum(c.attempts),
+        min(c.first_seen_at),
+        max(c.last_seen_at)
+    from canonical_rejects c
+    where c.source_system = %s
+    group by c.reason
+    order by c.reason
+"""
+
+
+def list_rejects():
+    """
+    Print the quarantine by reason.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SUMMARY_SQL, (SOURCE_SYSTEM,))
+            rows = cur.fetchall()
+    conn.close()
+
+    if not rows:
+        print("No quarantined rows.")
+        return
+    print(f"{'reason':<24} {'rows':>10} {'in RAW':>10} {'archived':>10} {'attempts':>10}  first seen / last seen")
+    for reason, count, in_raw, archived, attempts, first_seen, last_seen in rows:
+        print(f"{reason:<24} {count:>10} {in_raw:>10} {archived:>10} {attempts:>10}  "
+              f"{first_seen:%Y-%m-%d %H:%M} / {last_seen:%Y-%m-%d %H:%M}")
+
+
+def archived_batches(archived, batch_size):
+    """
+    Batches of the archived rows to retry; `archived` is ARCHIVED_SQL's
+    (archive file, raw_ids) rows.
+    """
+    if not archived:
+        return
+    from src.ingestion.archive_raw import iter_archive_batches
+
+    for path, raw_ids in archived:
+        raw_ids = set(raw_ids)
+        for batch in iter_archive_batches([Path(path)], batch_size):
+            rows = [r for r in batch if r[0] in raw_ids]
+            if rows:
+                yield rows
+
+
+def reprocess(reasons=None, batch_ids=None, batch_size=DEFAULT_BATCH_SIZE, dq_flush_size=1000, engine="row",
+              refresh=True):
+    """
+    Re-normalize the quarantined rows (optionally only some reasons or load
+    batches). Returns the run's counts plus "released" (rows that left the
+    quarantine), or None when there was nothing to retry.
+    """
+    run_started_at = datetime.now(tz=timezone.utc)
+    transform = get_engine(engine)
+    metrics = RunMetrics()
+    run_clock = time.perf_counter()
+
+    with connect() as conn:
+        with conn.cursor() as cur, conn.cursor(name="raw_karamad_rejects") as raw_cur:
+
+            dq = DQWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            rejects = RejectWriter(cur, flush_size=dq_flush_size, metrics=metrics)
+            partitions = CanonicalPartitions(cur)
+            with metrics.stage("setup") as setup:
+                date_lookup.load(cur)
+                cur.execute(SCOPE_SQL, (SOURCE_SYSTEM, reasons, reasons, batch_ids, batch_ids))
+                setup.rows = cur.rowcount
+            if not setup.rows:
+                print("No quarantined rows to reprocess.")
+                return None
+
+            raw_cur.itersize = batch_size
+            with metrics.stage("fetch"):
+                raw_cur.execute(REJECTED_RAW_SQL, (SOURCE_SYSTEM,))
+                cur.execute(ARCHIVED_SQL, (SOURCE_SYSTEM,))
+                archived = cur.fetchall()
+            # rows still in RAW first, then those read back from archive files
+            batches = itertools.chain(
+                iter(lambda: raw_cur.fetchmany(batch_size), []),
+                archived_batches(archived, batch_size),
+            )
+
+            run = transform_batches(cur, batches, transform, dq, rejects, metrics, partitions)
+            if run["lineage"] is None:
+                # neither in RAW nor in an archive file
+                print("No quarantined rows left in RAW or the archive to reprocess.")
+                return None
+
+            rejects.flush()
+            with metrics.stage("release") as release:
+                cur.execute(RELEASE_SQL, (SOURCE_SYSTEM,))
+                release.rows = cur.rowcount
+            released = release.rows
+
+            run_id = finish_run(cur, run, dq, rejects, metrics, refresh=refresh, started_at=run_started_at,
+                                clock=run_clock)
+
+    print(f"Reprocessed: {run['processed']}")
+    print(f"Inserted (attempted): {run['inserted']}")
+    print(f"Released from quarantine: {released}")
+    print(f"Still rejected: {rejects.count}")
+    print("Stages:")
+    print(metrics.summary())
+
+    return {"run_id": run_id, "processed": run["processed"], "inserted": run["inserted"],
+            "skipped": run["skipped"], "released": released}
+
+
+# =========================
+# Entry point
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Retry quarantined rows (canonical_rejects) after a rule fix.")
+    ap.add_argument("--reason", action="append",
+                    help="only rejects with this reason (repeatable), e.g. missing_event_date")
+    ap.add_argument("--batch-id", action="append", help="only rejects of this load_batch_id (repeatable)")
+    ap.add_argument("--engine", choices=["row", "columnar"], default="row")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--no-refresh", action="store_true", help="do not refresh the KPI tables")
+    ap.add_argument("--list", action="store_true", help="show the quarantine by reason and exit")
+    args = ap.parse_args()
+
+    if args.list:
+        list_rejects()
+        return
+
+    reprocess(reasons=args.reason, batch_ids=args.batch_id, batch_size=args.batch_size, engine=args.engine,
+              refresh=not args.no_refresh)
+
+
+if __name__ == "__main__":
+    main()
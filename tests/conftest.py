@@ -0,0 +1,52 @@
+"""
+Database fixtures. The tests need a Postgres with the DDL, the migrations
+and views_kpi.sql applied (see the README's Local Setup). They empty the
+pipeline tables, so they only run against the database named in
+TEST_DB_NAME (the other DB_* variables apply as usual).
+"""
+import os
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    Empty pipeline tables in TEST_DB_NAME; yields connect().
+    """
+    name = os.getenv("TEST_DB_NAME")
+    if not name:
+        pytest.skip("TEST_DB_NAME is not set")
+    # read by every connect(), also in worker processes
+    monkeypatch.setenv("DB_NAME", name)
+    # the mapping path is relative to the repo root
+    monkeypatch.chdir(REPO_ROOT)
+
+    from src.bench.run_bench import truncate_pipeline_tables
+    from src.transform.dim_date import load_dim_date
+    from src.transform.normalize_karamad import connect
+
+    truncate_pipeline_tables()
+    with connect() as conn, conn.cursor() as cur:
+        load_dim_date(cur, 1401, 1403)
+    conn.close()
+    yield connect
+
+
+@pytest.fixture
+def loaded(db, tmp_path):
+    """
+    Three synthetic monthly exports (1402/01..03) loaded into RAW, one load
+    batch per file; returns {file name: data rows}.
+    """
+    from src.bench.generate_karamad import generate
+    from src.ingestion.load_raw import batch_id_for, load_file
+
+    manifest = generate(tmp_path, rows=3000, months=3, seed=7)
+    for name in manifest:
+        path = tmp_path / name
+        load_file(path, batch_id_for(path, None))
+    return manifest
@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src.api.main import app  # noqa: E402
+from src.transform.normalize_karamad import normalize  # noqa: E402
+
+
+@pytest.fixture
+def client(db, loaded):
+    normalize()
+    with TestClient(app) as client:
+        yield client
+
+
+def test_csv_export_streams_every_row(client, db):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute("select count(*) from canonical_sales")
+        canonical_rows = cur.fetchone()[0]
+    conn.close()
+
+    response = client.get("/export/canonical_sales")
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0].startswith("canonical_id,")
+    assert len(lines) - 1 == canonical_rows
+
+
+def test_request_metrics_label_full_route_templates(client):
+    client.get("/export/kpi_net_sales_daily")
+    client.get("/kpi/net-sales-daily")
+    client.get("/health/")
+
+    routes = {line.split('route="')[1].split('"')[0]
+              for line in client.get("/metrics").text.splitlines()
+              if line.startswith("api_request_duration_seconds_count")}
+
+    assert {"/export/{dataset}", "/kpi/net-sales-daily", "/health/"} <= routes
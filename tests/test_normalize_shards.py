@@ -0,0 +1,65 @@
+from src.transform.normalize_karamad import SOURCE_SYSTEM, get_watermark
+from src.transform.normalize_shards import normalize_sharded, plan_shards
+
+
+def test_normalize_sharded_covers_every_new_row(db, loaded):
+    result = normalize_sharded(2, refresh=False)
+
+    with db() as conn, conn.cursor() as cur:
+        cur.execute("select count(*), max(raw_id) from raw_karamad_sales")
+        raw_rows, max_raw_id = cur.fetchone()
+        cur.execute("select count(*) from canonical_sales")
+        canonical_rows = cur.fetchone()[0]
+        cur.execute("select count(distinct raw_row_hash) from canonical_rejects")
+        rejected_rows = cur.fetchone()[0]
+        cur.execute("select count(*) from normalize_shards")
+        shards_left = cur.fetchone()[0]
+        cur.execute(
+            "select processed_count, inserted_count, skipped_count from dq_run_stats where run_id = %s",
+            (result["run_id"],),
+        )
+        combined = cur.fetchone()
+        watermark = get_watermark(cur, SOURCE_SYSTEM)
+    conn.close()
+
+    assert len(result["shards"]) >= 2
+    # the watermark passed every shard, so none is kept
+    assert shards_left == 0
+    assert result["processed"] == raw_rows
+    assert canonical_rows + rejected_rows == raw_rows
+    assert watermark == max_raw_id
+    # the plan's row adds up its shards
+    assert combined == (result["processed"], result["inserted"], result["skipped"])
+
+    assert normalize_sharded(2, refresh=False) is None
+
+
+def test_one_run_stats_row_per_worker(db, loaded):
+    # small shards, so each worker normalizes several
+    with db() as conn, conn.cursor() as cur:
+        plan_run_id = plan_shards(cur, SOURCE_SYSTEM, 2, max_shard_rows=500)
+    conn.close()
+
+    result = normalize_sharded(2, refresh=False)
+
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "select count(*), sum(processed_count) from dq_run_stats where parent_run_id = %s",
+            (plan_run_id,),
+        )
+        worker_rows, processed = cur.fetchone()
+        cur.execute(
+            """
+            select count(*) from pipeline_run_metrics m
+            join dq_run_stats r using (run_id)
+            where r.parent_run_id = %s and m.stage = 'total'
+            """,
+            (plan_run_id,),
+        )
+        totals = cur.fetchone()[0]
+    conn.close()
+
+    assert len(result["shards"]) >= 6
+    assert 1 <= worker_rows <= 2
+    assert totals == worker_rows
+    assert processed == result["processed"]
@@ -0,0 +1,62 @@
+from src.transform.normalize_karamad import normalize
+from src.transform.renormalize import renormalize
+
+SNAPSHOT_SQL = """
+    select raw_row_hash, invoice_date_gregorian, invoice_id, net_amount
+    from canonical_sales
+    order by raw_row_hash
+"""
+
+
+def snapshot(db):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(SNAPSHOT_SQL)
+        rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def test_renormalize_batch_restores_changed_rows(db, loaded):
+    normalize(refresh=False)
+    before = snapshot(db)
+
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            update canonical_sales set net_amount = net_amount + 1
+            where raw_row_hash in (
+                select raw_row_hash from canonical_sales
+                where load_batch_id = 'karamad_1402_02'
+                order by raw_row_hash limit 3
+            )
+            """
+        )
+    conn.close()
+
+    result = renormalize("load_batch_id", "karamad_1402_02", refresh=False)
+
+    assert result["updated"] == 3
+    assert result["inserted"] == 0 and result["deleted"] == 0
+    assert snapshot(db) == before
+
+
+def test_renormalize_month_reloads_a_dropped_month(db, loaded):
+    normalize(refresh=False)
+    before = snapshot(db)
+
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            select count(*) from canonical_sales
+            where invoice_date_gregorian >= '2023-05-01' and invoice_date_gregorian < '2023-06-01'
+            """
+        )
+        in_month = cur.fetchone()[0]
+        cur.execute("select drop_canonical_month('2023-05-01')")
+    conn.close()
+
+    result = renormalize("month", "2023-05", refresh=False)
+
+    assert in_month > 0
+    assert result["inserted"] == in_month
+    assert snapshot(db) == before
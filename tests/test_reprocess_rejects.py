@@ -0,0 +1,48 @@
+import pytest
+
+from src.transform.normalize_karamad import normalize
+from src.transform.reprocess_rejects import reprocess
+
+pytest.importorskip("pyarrow")
+
+from src.ingestion.archive_raw import archive, archive_files  # noqa: E402
+
+BATCH = "karamad_1402_02"
+
+
+def batch_rejects(db):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "select raw_id, attempts from canonical_rejects where load_batch_id = %s order by raw_id",
+            (BATCH,),
+        )
+        rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def test_reprocess_retries_rejects_of_archived_batch(db, loaded, tmp_path):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute("truncate raw_archive_batches, raw_karamad_archived")
+    conn.close()
+
+    normalize(refresh=False)
+    quarantined = batch_rejects(db)
+    assert quarantined
+
+    # batches with open rejects stay in RAW; clear them to archive the batch
+    with db() as conn, conn.cursor() as cur:
+        cur.execute("delete from canonical_rejects where load_batch_id = %s", (BATCH,))
+    conn.close()
+    assert [b["load_batch_id"] for b in archive(tmp_path, [BATCH])] == [BATCH]
+
+    # re-normalizing from the archive quarantines the same rows again
+    normalize(refresh=False, archive=archive_files([str(tmp_path)]))
+    assert batch_rejects(db) == quarantined
+
+    result = reprocess(batch_ids=[BATCH], refresh=False)
+
+    assert result is not None
+    assert result["processed"] == len(quarantined)
+    assert result["released"] == 0
+    assert batch_rejects(db) == [(raw_id, attempts + 1) for raw_id, attempts in quarantined]
@@ -0,0 +1,27 @@
+from src.common.telemetry import RunMetrics
+
+
+def test_stages_count_their_own_round_trips(db):
+    metrics = RunMetrics()
+    conn = db()
+    with conn.cursor() as cur, conn.cursor(name="numbers") as named:
+        with metrics.stage("outer"):
+            cur.execute("select 1")
+            with metrics.stage("inner"):
+                cur.execute("select 2")
+                cur.fetchall()
+            cur.execute("select 3")
+        with metrics.stage("fetch"):
+            named.execute("select generate_series(1, 10)")
+            while named.fetchmany(4):
+                pass
+        cur.execute("select 4")
+    conn.close()
+    metrics.finish(0, 0)
+
+    assert metrics["outer"].round_trips == 2
+    assert metrics["inner"].round_trips == 1
+    # declare + four fetches (4, 4, 2, none left)
+    assert metrics["fetch"].round_trips == 5
+    # the statement outside any stage too
+    assert metrics["total"].round_trips == 9